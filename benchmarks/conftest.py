@@ -0,0 +1,60 @@
+import os
+
+import pytest
+from omegaconf import OmegaConf
+
+from benchmarks.synthetic import make_subswath, write_listing, write_safe
+from sarwaveifrproc.main import Model
+from sarwaveifrproc.sessions import create_sessions
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGS = ["e08", "e09", "e10", "e11"]
+# Tiles of a subswath: the reference subswath, and a full IW subswath
+SIZES = {
+    "small": dict(n_bursts=9, n_tile_lines=1, n_tile_samples=5),
+    "large": dict(n_bursts=10, n_tile_lines=4, n_tile_samples=20),
+}
+LAND_FRACTION = 0.3
+
+
+def load_config(name):
+    conf = OmegaConf.load(os.path.join(root, "sarwave_config", f"{name}.yaml"))
+    models = {
+        k: Model(**{**OmegaConf.to_container(d), "path": os.path.join(root, d.path)})
+        for k, d in conf.models.items()
+    }
+    return models, conf.predicted_variables
+
+
+@pytest.fixture(scope="session", params=CONFIGS)
+def config_name(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def config(config_name):
+    """Sessions, outputs and predicted variables of a shipped configuration."""
+    models, predicted_variables = load_config(config_name)
+    return *create_sessions(models), predicted_variables
+
+
+@pytest.fixture(scope="session", params=list(SIZES))
+def size(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def subswath(size):
+    return make_subswath(land_fraction=LAND_FRACTION, **SIZES[size])
+
+
+@pytest.fixture(scope="session")
+def input_safe(tmp_path_factory, size):
+    """A synthetic SAFE with an ocean, a coastal and a land subswath."""
+    return write_safe(str(tmp_path_factory.mktemp("input")), **SIZES[size])
+
+
+@pytest.fixture(scope="session")
+def listing(tmp_path_factory, size):
+    """A listing of two synthetic SAFEs."""
+    return write_listing(str(tmp_path_factory.mktemp("listing")), 2, **SIZES[size])
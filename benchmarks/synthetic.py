@@ -0,0 +1,163 @@
+"""Synthetic L1B/L1C subswaths shaped like the reference data, for the benchmarks."""
+
+import functools
+import os
+
+import numpy as np
+import xarray as xr
+
+import sarwaveifrproc
+
+L1B_SAR_vv = os.path.join(
+    os.path.dirname(sarwaveifrproc.__file__),
+    "reference_data",
+    "s1a-iw2-slc-vv-20231128t035702-20231128t035727-051412-063451-005_L1B_xspec_IFR_3.7_nospectra.nc",
+)
+SAFE = "S1A_IW_XSP__1SDV_20231128T035702_20231128T035727_051412_063451_{id}_B08.SAFE"
+SUBSWATH = "{level}-s1a-{swath}-xsp-vv-20231128t035702-20231128t035727-051412-063451-002-b08.nc"
+TILE_DIMS = ("burst", "tile_line", "tile_sample")
+# Variables with a pol dimension in the L1B and L1C files
+POL_VARIABLES = [
+    "incidence",
+    "sigma0",
+    "nesz",
+    "sigma0_filt",
+    "nesz_filt",
+    "normalized_variance_filt",
+    "azimuth_cutoff",
+    "cwave_params",
+]
+
+
+@functools.lru_cache
+def load_reference():
+    with xr.open_dataset(L1B_SAR_vv) as ds:
+        return ds.load()
+
+
+def make_dataset(n_bursts, n_tile_lines, n_tile_samples, land_fraction, pols, rng):
+    """
+    Build a dataset of n_bursts x n_tile_lines x n_tile_samples tiles from the reference subswath.
+
+    Each tile is drawn from the ocean tiles of the reference, or from its land tiles with probability
+    `land_fraction`, with all its variables, so that the missing values follow the real files.
+    """
+    ref = load_reference().drop_vars("pol")
+    shape = (n_bursts, n_tile_lines, n_tile_samples)
+    # Variables on a subset of the tile dimensions (line, sample, ...) are drawn along each dimension
+    ds = ref.isel(
+        {d: rng.integers(ref.sizes[d], size=n) for d, n in zip(TILE_DIMS, shape)}
+    ).assign_coords(burst=np.arange(n_bursts, dtype=ref["burst"].dtype))
+
+    land = ref["land_flag"].transpose(*TILE_DIMS).values.ravel()
+    is_land = rng.random(shape).ravel() < land_fraction
+    index = np.where(
+        is_land,
+        rng.choice(np.flatnonzero(land), size=is_land.size),
+        rng.choice(np.flatnonzero(~land), size=is_land.size),
+    )
+    for v, da in ref.variables.items():
+        if not set(TILE_DIMS) <= set(da.dims):
+            continue
+        da = da.transpose(*TILE_DIMS, ...)
+        values = da.values.reshape(-1, *da.shape[3:])[index].reshape(
+            shape + da.shape[3:]
+        )
+        ds[v] = xr.Variable(da.dims, values, da.attrs).transpose(*ref[v].dims)
+
+    for v in POL_VARIABLES:
+        ds[v] = ds[v].expand_dims(pol=list(pols), axis=-1).copy()
+    ds.attrs["pols"] = " ".join(pols)
+    return ds.drop_encoding()
+
+
+def make_subswath(
+    n_bursts=9,
+    n_tile_lines=1,
+    n_tile_samples=5,
+    land_fraction=0.0,
+    pols=("VV", "VH"),
+    seed=0,
+):
+    """
+    Build a synthetic L1B/L1C subswath DataTree, with an intraburst and an interburst group.
+
+    Parameters:
+    - n_bursts (int): number of bursts of the intraburst group, the interburst group has one less.
+    - n_tile_lines (int): number of tiles along the lines of a burst.
+    - n_tile_samples (int): number of tiles along the samples of a burst.
+    - land_fraction (float): expected fraction of land tiles.
+    - pols (tuple): polarisations of the subswath.
+    - seed (int): seed of the random tile selection.
+    Returns:
+    - xdt (DataTree): synthetic subswath
+    """
+    rng = np.random.default_rng(seed)
+    xdt = xr.DataTree.from_dict(
+        {
+            "intraburst": make_dataset(
+                n_bursts, n_tile_lines, n_tile_samples, land_fraction, pols, rng
+            ),
+            "interburst": make_dataset(
+                max(n_bursts - 1, 1),
+                n_tile_lines,
+                n_tile_samples,
+                land_fraction,
+                pols,
+                rng,
+            ),
+        }
+    )
+    xdt.encoding = {"source": L1B_SAR_vv}
+    return xdt
+
+
+def write_safe(
+    directory,
+    land_fractions=(0.0, 0.5, 1.0),
+    level="l1b",
+    safe_id="A1B2",
+    seed=0,
+    **kwargs,
+):
+    """
+    Write a synthetic SAFE, with one subswath by land fraction.
+
+    Parameters:
+    - directory (str): directory where the SAFE is written.
+    - land_fractions (tuple): land fraction of each subswath (iw1, iw2, iw3).
+    - level (str): 'l1b' or 'l1c', used in the subswath file names.
+    - safe_id (str): 4 characters identifier of the SAFE, to write several SAFEs in the same directory.
+    - seed (int): seed of the first subswath.
+    - kwargs: see `make_subswath`.
+    Returns:
+    - safe (str): path of the SAFE
+    """
+    safe = os.path.join(directory, SAFE.format(id=safe_id))
+    os.makedirs(safe, exist_ok=True)
+    for i, land_fraction in enumerate(land_fractions):
+        xdt = make_subswath(land_fraction=land_fraction, seed=seed + i, **kwargs)
+        path = os.path.join(safe, SUBSWATH.format(level=level, swath=f"iw{i + 1}"))
+        xdt.to_netcdf(path)
+    return safe
+
+
+def write_listing(directory, n_safes=2, **kwargs):
+    """
+    Write n_safes synthetic SAFEs and their listing.
+
+    Parameters:
+    - directory (str): directory where the SAFEs and the listing are written.
+    - n_safes (int): number of SAFEs.
+    - kwargs: see `write_safe`.
+    Returns:
+    - listing (str): path of the listing
+    """
+    safes = [
+        write_safe(directory, safe_id=f"{i:04X}", seed=10 * i, **kwargs)
+        for i in range(n_safes)
+    ]
+    listing = os.path.join(directory, "listing.txt")
+    with open(listing, "w") as f:
+        f.write("\n".join(safes))
+    return listing
@@ -0,0 +1,35 @@
+import pytest
+
+from sarwaveifrproc.l2_wave import (
+    KEPT_VARIABLES,
+    generate_intermediate_product,
+    generate_l2_wave_product,
+    get_group_models,
+)
+
+
+@pytest.mark.parametrize("engine", ["xarray", "numpy"])
+def test_generate_intermediate_product(benchmark, config, subswath, engine):
+    models, models_outputs, predicted_variables = config
+    benchmark(
+        generate_intermediate_product,
+        subswath["intraburst"].ds,
+        get_group_models(models, predicted_variables.intraburst),
+        models_outputs,
+        predicted_variables.intraburst,
+        KEPT_VARIABLES,
+        engine=engine,
+    )
+
+
+@pytest.mark.parametrize("engine", ["xarray", "numpy"])
+def test_generate_l2_wave_product(benchmark, config, subswath, engine):
+    models, models_outputs, predicted_variables = config
+    benchmark(
+        generate_l2_wave_product,
+        subswath,
+        models,
+        models_outputs,
+        predicted_variables,
+        engine=engine,
+    )
@@ -0,0 +1,28 @@
+import hydra
+import hydra_zen
+
+from benchmarks.conftest import root
+from sarwaveifrproc import main, utils
+
+
+def test_process_files(benchmark, config, input_safe, tmp_path):
+    benchmark.pedantic(
+        utils.process_files,
+        (input_safe, str(tmp_path / "output"), *config, "E00"),
+        rounds=3,
+    )
+
+
+def test_main_listing(benchmark, config_name, listing, tmp_path, monkeypatch):
+    # Model paths of the shipped configurations are relative to the repository
+    monkeypatch.chdir(root)
+    with hydra.initialize_config_module("sarwave_config", version_base="1.3"):
+        cfg = hydra.compose(
+            config_name,
+            overrides=[
+                f"input_path={listing}",
+                f"save_directory={tmp_path / 'output'}",
+                "overwrite=true",
+            ],
+        )
+    benchmark.pedantic(hydra_zen.zen(main.main), (cfg,), rounds=3)
@@ -0,0 +1,69 @@
+"""Startup time of the L2-wave-processor entry point, in a fresh interpreter as for each hydra multirun job."""
+
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.conftest import SIZES, root
+from benchmarks.synthetic import write_listing
+
+CLI = "from sarwaveifrproc.main import hydra_main; hydra_main()"
+
+
+def run_cli(tmp_path, *overrides):
+    return subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            CLI,
+            f"hydra.run.dir={tmp_path / 'hydra'}",
+            *overrides,
+        ],
+        cwd=root,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.fixture(scope="session")
+def small_listing(tmp_path_factory):
+    """A listing of two small synthetic SAFEs: the startup does not depend on the size of the inputs."""
+    return write_listing(str(tmp_path_factory.mktemp("listing")), 2, **SIZES["small"])
+
+
+def test_import(benchmark):
+    benchmark.pedantic(
+        subprocess.run,
+        ([sys.executable, "-c", "import sarwaveifrproc.main"],),
+        dict(check=True),
+        rounds=3,
+    )
+
+
+def test_dry_run(benchmark, small_listing, tmp_path):
+    result = benchmark.pedantic(
+        run_cli,
+        (
+            tmp_path,
+            f"input_path={small_listing}",
+            f"save_directory={tmp_path / 'output'}",
+            "dry_run=true",
+        ),
+        rounds=3,
+    )
+    assert "onnxruntime" not in result.stderr
+
+
+def test_all_done(benchmark, small_listing, tmp_path):
+    overrides = (
+        f"input_path={small_listing}",
+        f"save_directory={tmp_path / 'output'}",
+        "overwrite=false",
+    )
+    run_cli(tmp_path, *overrides)
+    result = benchmark.pedantic(run_cli, (tmp_path, *overrides), rounds=3)
+    assert "onnxruntime" not in result.stderr
@@ -1,17 +1,31 @@
 import sarwaveifrproc.main
+import sarwaveifrproc.utils
+import sarwaveifrproc.variants
 import hydra_zen
 from pathlib import Path
 
-def chunk_listing(path: str, i: int, n: int=10) -> str:
+def chunk_listing(path: str, i: int, n: int=10, weight: str='count') -> str:
+    """
+    Writes the i-th of n chunks of a listing, balanced by `weight` (see sarwaveifrproc.utils.get_safe_weight).
+    Every SAFE of the listing is in exactly one chunk.
+    """
     l = Path(path).read_text().split()
-    chunk_size = len(l)//(n - 1)
+    chunk = sarwaveifrproc.utils.partition_listing(l, n, weight)[i]
     Path('tmp').mkdir(exist_ok=True)
     Path(f'tmp/chunk_{i}_{Path(path).name}').write_text(
-        '\n'.join(l[i*chunk_size:(i+1)*chunk_size])
+        '\n'.join(chunk)
     )
     return f'tmp/chunk_{i}_{Path(path).name}' 
 
-hydra_zen.store(sarwaveifrproc.main.main, name='base')
+hydra_zen.store(
+        sarwaveifrproc.main.main,
+        name='base',
+        hydra_defaults=['_self_', {'output_encoding': 'default'}],
+)
+hydra_zen.store(
+        sarwaveifrproc.variants.prepare_models,
+        name='prepare_models',
+)
 hydra_zen.store(
     dict(header=sarwaveifrproc.main.main.__doc__),
     name='doc',
@@ -30,4 +44,24 @@ hydra_zen.store(
         package='_global_',
 )
 
+hydra_zen.store(
+        dict(input_path=hydra_zen.builds(
+            chunk_listing,
+            path='???',
+            i='${hydra:job.num}',
+            n='${hydra:launcher.n_jobs}',
+            weight='bytes',
+        )),
+        name='balanced',
+        group='parallel',
+        package='_global_',
+)
+
+# Output profiles, overriding the defaults of sarwaveifrproc.main.OutputEncoding
+output_encoding_store = hydra_zen.store(group='output_encoding')
+output_encoding_store(dict(), name='default')
+output_encoding_store(dict(zlib=True, complevel=4, shuffle=True, predictions_dtype='float32'), name='compressed')
+output_encoding_store(dict(zlib=True, complevel=4, shuffle=True, predictions_dtype='int16'), name='packed')
+output_encoding_store(dict(format='zarr', predictions_dtype='float32'), name='zarr')
+
 hydra_zen.store.add_to_hydra_store(overwrite_ok=True)
@@ -0,0 +1,257 @@
+import contextlib
+import fcntl
+import json
+import os
+
+import netCDF4
+import xarray as xr
+
+import sarwaveifrproc.manifest as manifest
+
+CONTAINERS = ("day", "orbit")
+INDEX_DIMENSION = "subswath"
+INDEX_VARIABLES = {
+    "group": str,
+    "output_safe": str,
+    "output": str,
+    "input_safe": str,
+    "input": str,
+    "size": "i8",
+    "mtime_ns": "i8",
+    "sha256": str,
+    "run": str,
+    "valid": "i1",
+}
+
+
+def get_container_path(output_safe, container="day"):
+    """
+    Path of the container holding the products of an output SAFE.
+
+    Day containers are written next to the output SAFEs of the day, orbit containers in the orbits directory of
+    the save directory. Their name is built from the mission, the date or absolute orbit and the product id of the
+    output SAFE, e.g. l2-s1a-wav-20231128-e11.nc or l2-s1a-wav-051412-e11.nc.
+
+    Parameters:
+    - output_safe (str): path of the output SAFE, see sarwaveifrproc.utils.get_output_safe.
+    - container (str): "day" or "orbit".
+    Returns:
+    - path (str): path of the NetCDF container.
+    """
+    fields = os.path.basename(output_safe.rstrip(os.sep)).split("_")
+    mission, product_id = fields[0].lower(), fields[-1].split(".")[0].lower()
+    day_directory = os.path.dirname(output_safe.rstrip(os.sep))
+    if container == "day":
+        key, directory = fields[5][:8], day_directory
+    elif container == "orbit":
+        key = fields[-4]
+        directory = os.path.join(
+            os.path.dirname(os.path.dirname(day_directory)), "orbits"
+        )
+    else:
+        raise ValueError(
+            f"Unknown container {container!r}, expected one of {CONTAINERS}."
+        )
+    return os.path.join(directory, f"l2-{mission}-wav-{key}-{product_id}.nc")
+
+
+@contextlib.contextmanager
+def lock(path, shared=False):
+    """
+    Lock a container for the processes of all the jobs sharing it, with a lock file next to it.
+
+    Parameters:
+    - path (str): path of the container.
+    - shared (bool): take a shared lock, for reading, instead of an exclusive lock.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def create_container(path):
+    """
+    Create an empty container: an index with an unlimited subswath dimension, and no product.
+
+    Parameters:
+    - path (str): path of the container.
+    """
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension(INDEX_DIMENSION, None)
+        for name, dtype in INDEX_VARIABLES.items():
+            nc.createVariable(name, dtype, (INDEX_DIMENSION,))
+        nc.setncattr(
+            "comment",
+            "Level-2 WAVE products, one group per subswath, indexed along the subswath dimension.",
+        )
+
+
+def load_index(path):
+    """
+    Load the index of a container.
+
+    Parameters:
+    - path (str): path of the container.
+    Returns:
+    - index (list[dict]): entries of the products written in the container, oldest first. Empty if there is no
+      container.
+    """
+    if not os.path.exists(path):
+        return []
+    with lock(path, shared=True), netCDF4.Dataset(path) as nc:
+        columns = {name: nc[name][:].tolist() for name in INDEX_VARIABLES}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def get_products(index, output_safe):
+    """
+    Latest valid entry of each product of an output SAFE.
+
+    Parameters:
+    - index (list[dict]): see `load_index`.
+    - output_safe (str): path of the output SAFE.
+    Returns:
+    - products (dict[str, dict]): index entries, by filename of the input subswath.
+    """
+    name = os.path.basename(output_safe.rstrip(os.sep))
+    return {
+        entry["input"]: entry
+        for entry in index
+        if entry["output_safe"] == name and entry["valid"]
+    }
+
+
+def get_run(run_info):
+    return json.dumps(run_info, sort_keys=True)
+
+
+def write_product(l2_product, path, input_path, savepath, encoding=None, run_info=None):
+    """
+    Append the product of a subswath to a container.
+
+    The product is written in the group named after its output SAFE and filename, with a numbered suffix if
+    the subswath was already written, then recorded in the index. The index entry is written last, so that an
+    interrupted write leaves no entry behind.
+
+    Parameters:
+    - l2_product (xr.DataTree): Level-2 wave product.
+    - path (str): path of the container, created if needed.
+    - input_path (str): path of the input subswath file.
+    - savepath (str): path of the product in its output SAFE, see sarwaveifrproc.utils.get_output_filename.
+    - encoding (dict): encoding of the variables, by group path, see sarwaveifrproc.utils.get_product_encoding.
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info.
+    Returns:
+    - group (str): path of the group of the product in the container.
+    """
+    encoding = encoding or {}
+    output_safe = os.path.dirname(savepath)
+    entry = {
+        "output_safe": os.path.basename(output_safe),
+        "output": os.path.basename(savepath),
+        "input_safe": os.path.basename(os.path.dirname(os.path.abspath(input_path))),
+        "input": os.path.basename(input_path),
+        **manifest.get_fingerprint(input_path),
+        "run": get_run(run_info),
+        "valid": 1,
+    }
+    with lock(path):
+        if not os.path.exists(path):
+            create_container(path)
+        with netCDF4.Dataset(path) as nc:
+            safe_group = nc.groups.get(entry["output_safe"])
+            written = set(safe_group.groups) if safe_group is not None else set()
+        group, version = entry["output"], 1
+        while group in written:
+            version += 1
+            group = f"{entry['output']}_{version}"
+        entry["group"] = f"/{entry['output_safe']}/{group}"
+        for node in l2_product.subtree:
+            node.to_dataset(inherit=False).to_netcdf(
+                path,
+                mode="a",
+                group=entry["group"] + node.path.rstrip("/"),
+                encoding=encoding.get(node.path),
+            )
+        with netCDF4.Dataset(path, "a") as nc:
+            n = len(nc.dimensions[INDEX_DIMENSION])
+            for name, value in entry.items():
+                nc[name][n] = value
+    return entry["group"]
+
+
+def open_product(path, output_safe, filename):
+    """
+    Open a product of a container, looked up with the names of its output SAFE and file.
+
+    Parameters:
+    - path (str): path of the container.
+    - output_safe (str): path or name of the output SAFE, see sarwaveifrproc.utils.get_output_safe.
+    - filename (str): path or name of the product, see sarwaveifrproc.utils.get_output_filename.
+    Returns:
+    - l2_product (xr.DataTree): Level-2 wave product.
+    """
+    filename = os.path.basename(filename)
+    for entry in get_products(load_index(path), output_safe).values():
+        if entry["output"] == filename:
+            return xr.open_datatree(path, group=entry["group"])
+    raise KeyError(f"{filename} of {os.path.basename(output_safe)} is not in {path}.")
+
+
+def is_subswath_done(products, input_path, run_info):
+    """
+    Check whether the product of a subswath in a container is up to date.
+
+    Parameters:
+    - products (dict[str, dict]): products of the output SAFE, see `get_products`.
+    - input_path (str): path of the input subswath file.
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info.
+    Returns:
+    - done (bool): True if the subswath was written by a run with the same run info and its input did not change
+      since.
+    """
+    entry = products.get(os.path.basename(input_path))
+    if entry is None or entry["run"] != get_run(run_info):
+        return False
+    previous = {k: entry[k] for k in ("size", "mtime_ns", "sha256")}
+    return manifest.get_fingerprint(input_path, previous)["sha256"] == entry["sha256"]
+
+
+def is_safe_done(input_paths, output_safe, run_info, container="day"):
+    """
+    Check whether the products of all the subswaths of a SAFE are up to date in their container.
+
+    Parameters:
+    - input_paths (list): paths of the input subswath files of the SAFE.
+    - output_safe (str): path of the output SAFE.
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info.
+    - container (str): "day" or "orbit".
+    Returns:
+    - done (bool): True if no subswath of the SAFE needs to be processed.
+    """
+    products = get_products(
+        load_index(get_container_path(output_safe, container)), output_safe
+    )
+    return all(is_subswath_done(products, path, run_info) for path in input_paths)
+
+
+def invalidate_safe(output_safe, container="day"):
+    """
+    Mark the products of an output SAFE as invalid in its container, so that all its subswaths are processed
+    again. The products are left in the container, which is only appended to.
+
+    Parameters:
+    - output_safe (str): path of the output SAFE.
+    - container (str): "day" or "orbit".
+    """
+    path = get_container_path(output_safe, container)
+    if not os.path.exists(path):
+        return
+    name = os.path.basename(output_safe.rstrip(os.sep))
+    with lock(path), netCDF4.Dataset(path, "a") as nc:
+        for i, safe in enumerate(nc["output_safe"][:].tolist()):
+            if safe == name:
+                nc["valid"][i] = 0
@@ -0,0 +1,241 @@
+import datetime
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import traceback
+
+STATUS_DIRECTORY = ".status"
+
+
+def list_items(inbox):
+    """
+    List the items waiting in an inbox: listings (.txt) and SAFEs (directories or symbolic links).
+
+    Hidden entries, such as the status directory, are ignored.
+
+    Parameters:
+    - inbox (str): inbox directory.
+    Returns:
+    - items (list[str]): names of the items, oldest first.
+    """
+    items = []
+    for name in os.listdir(inbox):
+        if name.startswith(".") or not name.endswith((".txt", ".SAFE")):
+            continue
+        try:
+            items.append((os.stat(os.path.join(inbox, name)).st_mtime_ns, name))
+        except FileNotFoundError:  # removed, or dangling symbolic link
+            continue
+    return [name for _, name in sorted(items)]
+
+
+def get_status_path(inbox, name, status_directory=None):
+    """
+    Path of the status file of an item.
+
+    Parameters:
+    - inbox (str): inbox directory.
+    - name (str): name of the item.
+    - status_directory (str): directory of the status files, `STATUS_DIRECTORY` in the inbox if None.
+    Returns:
+    - path (str): path of the json status file.
+    """
+    return os.path.join(
+        status_directory or os.path.join(inbox, STATUS_DIRECTORY), f"{name}.json"
+    )
+
+
+def load_status(path):
+    """
+    Load the status of an item.
+
+    Parameters:
+    - path (str): path of the status file, see `get_status_path`.
+    Returns:
+    - status (dict): status of the item, None if it was never seen.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_status(path, status):
+    """
+    Save the status of an item, atomically.
+
+    Parameters:
+    - path (str): path of the status file, see `get_status_path`.
+    - status (dict): status of the item.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def is_pending(status, mtime_ns, retry_interval=None):
+    """
+    Check whether an item should be processed.
+
+    Parameters:
+    - status (dict): status of the item, None if it was never seen.
+    - mtime_ns (int): modification time of the item.
+    - retry_interval (float): seconds after which a failed item is processed again, doubled after each
+      consecutive failure of the item. Failed items are not retried if None.
+    Returns:
+    - pending (bool): True for new items, items replaced since they were processed, items whose processing
+      was interrupted, and failed items due for a retry.
+    """
+    if status is None or status["mtime_ns"] != mtime_ns:
+        return True
+    if status["state"] == "processing":
+        return True
+    if status["state"] != "failed" or retry_interval is None:
+        return False
+    backoff = retry_interval * 2 ** (status.get("attempts", 1) - 1)
+    finished = datetime.datetime.fromisoformat(status["finished"])
+    elapsed = datetime.datetime.now(datetime.timezone.utc) - finished
+    return elapsed.total_seconds() >= backoff
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+def process_item(inbox, name, process, status_directory=None):
+    """
+    Process an item of an inbox and record its status.
+
+    The status is "processing" while the item is processed, then "done", or "failed" if the processing raised an
+    error or if some SAFEs of the item could not be processed. The status counts the consecutive attempts at
+    processing the item, see `is_pending`.
+
+    Parameters:
+    - inbox (str): inbox directory.
+    - name (str): name of the item.
+    - process (callable): function processing the path of a listing or SAFE, and returning a summary dict with
+      the errors of the SAFEs that could not be processed under "failures".
+    - status_directory (str): directory of the status files, `STATUS_DIRECTORY` in the inbox if None.
+    Returns:
+    - status (dict): final status of the item.
+    """
+    path = os.path.join(inbox, name)
+    status_path = get_status_path(inbox, name, status_directory)
+    mtime_ns = os.stat(path).st_mtime_ns
+    previous = load_status(status_path)
+    attempts = 1
+    if (
+        previous is not None
+        and previous["mtime_ns"] == mtime_ns
+        and previous["state"] != "done"
+    ):
+        # retry of a failed or interrupted item
+        attempts = previous.get("attempts", 1) + 1
+    status = dict(
+        item=path,
+        mtime_ns=mtime_ns,
+        state="processing",
+        started=now(),
+        attempts=attempts,
+    )
+    save_status(status_path, status)
+    logging.info(f"Processing {path}...")
+    start = time.perf_counter()
+    try:
+        summary = process(path) or {}
+        status.update(
+            summary,
+            state=(
+                "failed"
+                if summary.get("failures") or summary.get("deferred")
+                else "done"
+            ),
+        )
+    except Exception:
+        status.update(state="failed", error=traceback.format_exc())
+    status.update(finished=now(), elapsed=time.perf_counter() - start)
+    save_status(status_path, status)
+    log = logging.info if status["state"] == "done" else logging.error
+    log(f"{path}: {status['state']} in {status['elapsed']:.1f}s.")
+    return status
+
+
+def poll(
+    inbox,
+    process,
+    status_directory=None,
+    settle_time=0.0,
+    stop=None,
+    retry_interval=None,
+):
+    """
+    Process the pending items of an inbox once.
+
+    Parameters:
+    - inbox (str): inbox directory.
+    - process (callable): see `process_item`.
+    - status_directory (str): directory of the status files, `STATUS_DIRECTORY` in the inbox if None.
+    - settle_time (float): items modified less than this many seconds ago are left for the next poll, so that
+      listings and SAFEs still being written are not processed.
+    - stop (threading.Event): event stopping the poll before the next item.
+    - retry_interval (float): seconds before a failed item is retried, see `is_pending`. No retry if None.
+    Returns:
+    - statuses (dict[str, dict]): final status of each processed item.
+    """
+    statuses = {}
+    for name in list_items(inbox):
+        if stop is not None and stop.is_set():
+            break
+        try:
+            mtime_ns = os.stat(os.path.join(inbox, name)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if time.time_ns() - mtime_ns < settle_time * 1e9:
+            continue
+        status = load_status(get_status_path(inbox, name, status_directory))
+        if is_pending(status, mtime_ns, retry_interval):
+            statuses[name] = process_item(inbox, name, process, status_directory)
+    return statuses
+
+
+def serve(
+    inbox,
+    process,
+    poll_interval=5.0,
+    status_directory=None,
+    stop=None,
+    retry_interval=None,
+):
+    """
+    Watch an inbox and process its items as they arrive, until `stop` is set or SIGTERM or SIGINT is received.
+
+    Parameters:
+    - inbox (str): inbox directory, created if needed.
+    - process (callable): see `process_item`.
+    - poll_interval (float): seconds between two polls of the inbox. Items are processed once they were not
+      modified for this long.
+    - status_directory (str): directory of the status files, `STATUS_DIRECTORY` in the inbox if None.
+    - stop (threading.Event): event stopping the service once the current item is processed.
+    - retry_interval (float): seconds before a failed item is retried, see `is_pending`. No retry if None.
+    """
+    os.makedirs(inbox, exist_ok=True)
+    stop = stop or threading.Event()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            handlers[sig] = signal.signal(sig, lambda signum, frame: stop.set())
+    logging.info(f"Watching {inbox} every {poll_interval}s.")
+    try:
+        while not stop.is_set():
+            poll(inbox, process, status_directory, poll_interval, stop, retry_interval)
+            stop.wait(poll_interval)
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+    logging.info(f"Stopped watching {inbox}.")
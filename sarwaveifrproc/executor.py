@@ -0,0 +1,256 @@
+import concurrent.futures
+import contextlib
+import logging
+import multiprocessing
+import time
+import traceback
+
+import sarwaveifrproc.metrics as metrics
+import sarwaveifrproc.utils as utils
+
+# State of a worker process, set once by `init_worker`.
+_worker = {}
+
+
+def init_worker(
+    models,
+    predicted_variables,
+    product_id,
+    verbose=False,
+    sessions_kwargs={},
+    product_kwargs={},
+    reader_kwargs={},
+    writer_kwargs={},
+    collect_metrics=False,
+    block_size_mb=None,
+    memory_budget_mb=None,
+    incremental_from=None,
+):
+    """
+    Initialize a worker process: set up logging and load the models once.
+
+    Parameters:
+    - models (dict[str, Model]): onnx models and outputs
+    - predicted_variables (PredictedVariables): model outputs and associated variables name to add to the L2 product
+    - product_id (str): Identifier for the output product.
+    - verbose (bool): debug log level if True
+    - sessions_kwargs (dict): options of sarwaveifrproc.server.load_sessions
+    - product_kwargs (dict): options of sarwaveifrproc.l2_wave.generate_l2_wave_product
+    - reader_kwargs (dict): options of sarwaveifrproc.utils.open_subswath
+    - writer_kwargs (dict): options of sarwaveifrproc.utils.write_product
+    - collect_metrics (bool): record the stages of the processing, see sarwaveifrproc.metrics
+    - block_size_mb (float): if set, process the subswaths by blocks of bursts, see sarwaveifrproc.utils.process_files
+    - memory_budget_mb (float): if set, memory available to process a subswath, see sarwaveifrproc.utils.process_files
+    - incremental_from (str): if set, previous product id whose unchanged groups are reused, see
+      sarwaveifrproc.utils.process_files
+    """
+    from sarwaveifrproc.main import setup_logging
+    from sarwaveifrproc.server import load_sessions
+
+    setup_logging(verbose)
+    metrics.enable(collect_metrics)
+    ort_mods, mod_outs = load_sessions(models, **sessions_kwargs)
+    _worker.update(
+        models=ort_mods,
+        models_outputs=mod_outs,
+        predicted_variables=predicted_variables,
+        product_id=product_id,
+        product_kwargs=product_kwargs,
+        reader_kwargs=reader_kwargs,
+        writer_kwargs=writer_kwargs,
+        block_size_mb=block_size_mb,
+        memory_budget_mb=memory_budget_mb,
+        incremental_from=incremental_from,
+    )
+
+
+def process_safe(input_safe, output_safe):
+    """
+    Process a SAFE in a worker process initialized by `init_worker`.
+
+    Parameters:
+    - input_safe (str): Input safe path.
+    - output_safe (str): Path to the directory where output data will be saved.
+    Returns:
+    - error (str): formatted traceback if the processing failed, None otherwise.
+    - records (list[dict]): stage records of the SAFE, empty if the metrics are not collected.
+    - deferred (list[str]): subswath files deferred by the memory budget, see sarwaveifrproc.utils.process_files.
+    """
+    try:
+        deferred = utils.process_files(
+            input_safe,
+            output_safe,
+            _worker["models"],
+            _worker["models_outputs"],
+            _worker["predicted_variables"],
+            _worker["product_id"],
+            _worker["product_kwargs"],
+            _worker["reader_kwargs"],
+            _worker["writer_kwargs"],
+            _worker["block_size_mb"],
+            _worker["memory_budget_mb"],
+            _worker["incremental_from"],
+        )
+    except Exception:
+        return traceback.format_exc(), metrics.pop_records(), []
+    return None, metrics.pop_records(), deferred
+
+
+def create_pool(
+    models,
+    predicted_variables,
+    product_id,
+    workers,
+    verbose=False,
+    sessions_kwargs={},
+    product_kwargs={},
+    reader_kwargs={},
+    writer_kwargs={},
+    collect_metrics=False,
+    block_size_mb=None,
+    memory_budget_mb=None,
+    incremental_from=None,
+):
+    """
+    Create a pool of worker processes, each loading the models once, see `init_worker`.
+
+    Parameters:
+    - workers (int): number of worker processes.
+    - other parameters: see `init_worker`.
+    Returns:
+    - pool (concurrent.futures.ProcessPoolExecutor): pool to pass to `process_listing`.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(
+            models,
+            predicted_variables,
+            product_id,
+            verbose,
+            sessions_kwargs,
+            product_kwargs,
+            reader_kwargs,
+            writer_kwargs,
+            collect_metrics,
+            block_size_mb,
+            memory_budget_mb,
+            incremental_from,
+        ),
+    )
+
+
+def process_listing(
+    files,
+    output_safes,
+    models,
+    predicted_variables,
+    product_id,
+    workers,
+    verbose=False,
+    sessions_kwargs={},
+    product_kwargs={},
+    reader_kwargs={},
+    writer_kwargs={},
+    collect_metrics=False,
+    block_size_mb=None,
+    memory_budget_mb=None,
+    incremental_from=None,
+    pool=None,
+    deferred=None,
+):
+    """
+    Process SAFEs with a pool of worker processes.
+
+    Each worker loads the models once and is fed the SAFEs one by one. Failures are collected
+    instead of stopping the run, and a summary is logged at the end.
+
+    Parameters:
+    - files (list): Input safe paths.
+    - output_safes (list): Paths to the directories where output data will be saved, one per input safe.
+    - models (dict[str, Model]): onnx models and outputs
+    - predicted_variables (PredictedVariables): model outputs and associated variables name to add to the L2 product
+    - product_id (str): Identifier for the output product.
+    - workers (int): number of worker processes.
+    - verbose (bool): debug log level if True
+    - sessions_kwargs (dict): options of sarwaveifrproc.server.load_sessions
+    - product_kwargs (dict): options of sarwaveifrproc.l2_wave.generate_l2_wave_product
+    - reader_kwargs (dict): options of sarwaveifrproc.utils.open_subswath
+    - writer_kwargs (dict): options of sarwaveifrproc.utils.write_product
+    - collect_metrics (bool): record the stages of the processing in the workers and gather their records in this process
+    - block_size_mb (float): if set, process the subswaths by blocks of bursts, see sarwaveifrproc.utils.process_files
+    - memory_budget_mb (float): if set, memory available to process a subswath, see sarwaveifrproc.utils.process_files
+    - incremental_from (str): if set, previous product id whose unchanged groups are reused, see
+      sarwaveifrproc.utils.process_files
+    - pool (concurrent.futures.ProcessPoolExecutor): pool created by `create_pool`, kept open to process several
+      listings with the same workers. A pool is created with the other parameters for this listing if None.
+    - deferred (dict[str, list[str]]): if given, filled with the subswath files deferred by the memory budget, by
+      SAFE, see sarwaveifrproc.utils.process_files.
+    Returns:
+    - failures (dict[str, str]): error of each SAFE that could not be processed.
+    """
+    failures = {}
+    deferred = {} if deferred is None else deferred
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(
+                create_pool(
+                    models,
+                    predicted_variables,
+                    product_id,
+                    workers,
+                    verbose,
+                    sessions_kwargs,
+                    product_kwargs,
+                    reader_kwargs,
+                    writer_kwargs,
+                    collect_metrics,
+                    block_size_mb,
+                    memory_budget_mb,
+                    incremental_from,
+                )
+            )
+        futures = {
+            pool.submit(process_safe, f, output_safe): f
+            for f, output_safe in zip(files, output_safes)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            f = futures[future]
+            try:
+                error, records, deferred_subswaths = future.result()
+                metrics.add_records(records)
+                if deferred_subswaths:
+                    deferred[f] = deferred_subswaths
+            except Exception as e:  # the worker died, e.g. killed when out of memory
+                error = repr(e)
+            if error is None:
+                logging.info(f"Processed {f}")
+            else:
+                logging.error(f"Failed to process {f}:\n{error}")
+                failures[f] = error
+
+    log_summary(len(futures), failures, time.perf_counter() - start, deferred)
+    return failures
+
+
+def log_summary(n_files, failures, elapsed, deferred={}):
+    """
+    Log a summary of a run.
+
+    Parameters:
+    - n_files (int): number of SAFEs to process.
+    - failures (dict[str, str]): error of each SAFE that could not be processed.
+    - elapsed (float): wall time of the run, in seconds.
+    - deferred (dict[str, list[str]]): subswath files deferred by the memory budget, by SAFE.
+    """
+    logging.info(
+        f"{n_files - len(failures)}/{n_files} SAFE(s) processed in {elapsed:.1f}s, {len(failures)} failure(s)."
+    )
+    for f, error in failures.items():
+        logging.info(f"Failed: {f}: {error.strip().splitlines()[-1]}")
+    for f, subswaths in deferred.items():
+        logging.info(
+            f"Deferred: {f}: {len(subswaths)} subswath(s) above the memory budget."
+        )
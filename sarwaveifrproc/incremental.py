@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+
+import xarray as xr
+
+import sarwaveifrproc.manifest as manifest
+from sarwaveifrproc.l2_wave import GROUPS
+
+# Attribute of each group of a product recording what determines its predictions, see `get_group_info`.
+GROUP_INFO_ATTR = "predictions_run_info"
+# Processing options of the run info that change the groups, recorded only when set, see
+# sarwaveifrproc.manifest.get_run_info.
+GROUP_OPTIONS = ["mask_invalid_tiles", "read_pols"]
+
+
+def get_group_info(run_info, group):
+    """
+    Part of a run info that determines the predictions of a group of the products.
+
+    Parameters:
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info.
+    - group (str): "intraburst" or "interburst".
+    Returns:
+    - group_info (dict): hash of each model used by the group, model output of each of its predicted variables,
+      predicted polarisations, and the processing options that are set.
+    """
+    predicted_variables = run_info["predicted_variables"].get(group, {})
+    models = {model for model, _ in predicted_variables.values()}
+    return {
+        "models": {k: h for k, h in run_info["models"].items() if k in models},
+        "predicted_variables": predicted_variables,
+        "pols": run_info.get("pols"),
+        **{k: run_info[k] for k in GROUP_OPTIONS if k in run_info},
+    }
+
+
+def set_group_info(ds, run_info, group):
+    """
+    Record what determines the predictions of a group in its attributes.
+
+    Parameters:
+    - ds (xarray.Dataset): intraburst or interburst group of a product, updated in place.
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info.
+    - group (str): "intraburst" or "interburst".
+    Returns:
+    - ds (xarray.Dataset): the updated group.
+    """
+    ds.attrs[GROUP_INFO_ATTR] = json.dumps(
+        get_group_info(run_info, group), sort_keys=True
+    )
+    return ds
+
+
+def get_previous_groups(input_path, previous_savepath, run_info):
+    """
+    Groups of a previous product of a subswath whose predictions do not change with a new run info.
+
+    The previous product is used only if its output SAFE has a manifest recording it, and its input did not change
+    since. What determines the predictions of each of its groups is read from the group attributes, or, for products
+    written without them, from the run info of the manifest.
+
+    Parameters:
+    - input_path (str): path of the input subswath file.
+    - previous_savepath (str): path of the previous product of the subswath, see
+      sarwaveifrproc.utils.get_output_filename.
+    - run_info (dict): run info of the new product, see sarwaveifrproc.manifest.get_run_info.
+    Returns:
+    - groups (list[str]): reusable groups, empty if the previous product cannot be used.
+    """
+    output_safe = os.path.dirname(previous_savepath)
+    previous_manifest = manifest.load_manifest(output_safe)
+    if previous_manifest is None or not manifest.is_subswath_done(
+        previous_manifest,
+        input_path,
+        output_safe,
+        previous_manifest["run"],
+    ):
+        return []
+    entry = previous_manifest["subswaths"][os.path.basename(input_path)]
+    if entry["output"] != os.path.basename(previous_savepath):
+        return []
+    groups = []
+    for group in GROUPS:
+        with xr.open_dataset(previous_savepath, group=group) as ds:
+            recorded = ds.attrs.get(GROUP_INFO_ATTR)
+        if recorded is not None:
+            previous = json.loads(recorded)
+        else:
+            previous = get_group_info(previous_manifest["run"], group)
+        if previous == json.loads(json.dumps(get_group_info(run_info, group))):
+            groups.append(group)
+    return groups
+
+
+def load_groups(previous_savepath, groups):
+    """
+    Load groups of a previous product.
+
+    Parameters:
+    - previous_savepath (str): path of the previous product.
+    - groups (list[str]): groups to load, see `get_previous_groups`.
+    Returns:
+    - datasets (dict[str, xarray.Dataset]): datasets of the groups, by group name.
+    """
+    datasets = {}
+    for group in groups:
+        with xr.open_dataset(previous_savepath, group=group) as ds:
+            datasets[group] = ds.load()
+    return datasets
+
+
+def link_product(previous_savepath, savepath):
+    """
+    Give a new product the file of a previous one, whose groups are all reused: the file is hard linked, or copied
+    if it is on another file system.
+
+    Parameters:
+    - previous_savepath (str): path of the previous product.
+    - savepath (str): path of the new product.
+    """
+    try:
+        os.link(previous_savepath, savepath)
+    except OSError:
+        shutil.copyfile(previous_savepath, savepath)
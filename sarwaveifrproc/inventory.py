@@ -0,0 +1,303 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+import sarwaveifrproc.manifest as manifest
+import sarwaveifrproc.utils as utils
+
+# Seconds a connection waits for the jobs sharing the inventory to release it.
+TIMEOUT = 300.0
+# Maximum number of parameters of a query.
+QUERY_SIZE = 500
+SAFE_FIELDS = list(re.compile(utils.VERS_SAFE_PATTERN).groupindex)
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS safes (
+    path TEXT PRIMARY KEY, directory TEXT, inode INTEGER, {", ".join(f'"{k}" TEXT' for k in SAFE_FIELDS)},
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS safes_directory ON safes (directory);
+CREATE TABLE IF NOT EXISTS subswaths (path TEXT PRIMARY KEY, safe TEXT);
+CREATE INDEX IF NOT EXISTS subswaths_safe ON subswaths (safe);
+CREATE TABLE IF NOT EXISTS products (
+    output_safe TEXT PRIMARY KEY, safe TEXT, product_id TEXT, run_hash TEXT, processed TEXT
+);
+CREATE INDEX IF NOT EXISTS products_safe ON products (safe);
+"""
+
+
+def connect(path):
+    """
+    Open the inventory database, creating it if needed.
+
+    The database is shared by the jobs processing the chunks of a listing: it is journaled with a write-ahead
+    log, so that reads do not wait for writes, and writes wait up to `TIMEOUT` seconds for each other.
+
+    Parameters:
+    - path (str): path of the SQLite database.
+    Returns:
+    - db (sqlite3.Connection): connection to the inventory.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, timeout=TIMEOUT)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    if "mtime_ns" not in [row[1] for row in db.execute("PRAGMA table_info(safes)")]:
+        # inventory of a previous version: its SAFEs are listed again on the next refresh
+        try:
+            with db:
+                db.execute("ALTER TABLE safes ADD COLUMN mtime_ns INTEGER")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e):  # added by another job meanwhile
+                raise
+    return db
+
+
+def get_key(path):
+    return os.path.abspath(path.rstrip("/"))
+
+
+def get_run_hash(run_info):
+    """
+    Digest of a run info, see sarwaveifrproc.manifest.get_run_info.
+    """
+    return hashlib.sha256(json.dumps(run_info, sort_keys=True).encode()).hexdigest()
+
+
+def forget_safe(db, safe):
+    db.execute("DELETE FROM safes WHERE path = ?", (safe,))
+    db.execute("DELETE FROM subswaths WHERE safe = ?", (safe,))
+    db.execute("DELETE FROM products WHERE safe = ?", (safe,))
+
+
+def get_safe_stat(safe):
+    """
+    Inode and modification time of a SAFE directory, which changes when files are added to or replaced in it.
+
+    Returns:
+    - stat (tuple): inode and modification time in nanoseconds. None if the SAFE does not exist.
+    """
+    try:
+        stat = os.stat(safe)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def add_safe(db, safe, inode, mtime_ns):
+    m = re.match(utils.VERS_SAFE_PATTERN, os.path.basename(safe))
+    metadata = m.groupdict() if m else dict.fromkeys(SAFE_FIELDS)
+    columns = ", ".join(
+        f'"{k}"' for k in ["path", "directory", "inode", *SAFE_FIELDS, "mtime_ns"]
+    )
+    db.execute(
+        f"INSERT INTO safes ({columns}) VALUES (?, ?, ?{', ?' * len(SAFE_FIELDS)}, ?)",
+        (
+            safe,
+            os.path.dirname(safe),
+            inode,
+            *(metadata[k] for k in SAFE_FIELDS),
+            mtime_ns,
+        ),
+    )
+    db.executemany(
+        "INSERT INTO subswaths VALUES (?, ?)",
+        [(path, safe) for path in sorted(utils.list_subswaths(safe))],
+    )
+
+
+def refresh_inputs(db, files):
+    """
+    Update the inventory of the input SAFEs of a listing and get their subswaths.
+
+    All the known SAFEs of a directory are checked only if the directory changed since the previous refresh, i.e.
+    SAFEs were added, replaced or removed. Otherwise, only the SAFEs of the listing are checked, as files may have
+    been added to or replaced in them. The subswaths
+    of new, replaced or changed SAFEs are listed, and the products of changed or removed SAFEs are forgotten.
+
+    Parameters:
+    - db (sqlite3.Connection): inventory, see `connect`.
+    - files (list): Input safe paths.
+    Returns:
+    - subswaths (dict[str, list]): paths of the subswath files of each input SAFE.
+    """
+    directories = collections.defaultdict(list)
+    for f in files:
+        safe = get_key(f)
+        directories[os.path.dirname(safe)].append(safe)
+
+    with db:
+        for directory, safes in directories.items():
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                mtime_ns = None
+            known = {
+                path: (inode, safe_mtime_ns)
+                for path, inode, safe_mtime_ns in db.execute(
+                    "SELECT path, inode, mtime_ns FROM safes WHERE directory = ?",
+                    (directory,),
+                )
+            }
+            row = db.execute(
+                "SELECT mtime_ns FROM directories WHERE path = ?", (directory,)
+            ).fetchone()
+            if (
+                mtime_ns is not None
+                and row is not None
+                and row[0] == mtime_ns
+                and all(safe in known for safe in safes)
+            ):
+                # no SAFE was added, replaced or removed, but their content may have changed
+                candidates = safes
+            else:
+                candidates = set(safes) | set(known)
+            for safe in candidates:
+                stat = get_safe_stat(safe) if mtime_ns is not None else None
+                if stat is not None and known.get(safe) == stat:
+                    continue
+                forget_safe(db, safe)
+                if stat is not None and safe in safes:
+                    add_safe(db, safe, *stat)
+            db.execute(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?)",
+                (directory, mtime_ns),
+            )
+
+    subswaths = {get_key(f): [] for f in files}
+    safes = list(subswaths)
+    for i in range(0, len(safes), QUERY_SIZE):
+        batch = safes[i : i + QUERY_SIZE]
+        for path, safe in db.execute(
+            f"SELECT path, safe FROM subswaths WHERE safe IN ({', '.join('?' * len(batch))}) "
+            "ORDER BY safe, path",
+            batch,
+        ):
+            subswaths[safe].append(path)
+    return {f: subswaths[get_key(f)] for f in files}
+
+
+def refresh_outputs(db, output_safes):
+    """
+    Forget the processed output SAFEs of a listing that were removed since they were recorded.
+
+    Each directory containing output SAFEs is scanned once.
+
+    Parameters:
+    - db (sqlite3.Connection): inventory, see `connect`.
+    - output_safes (list): paths of the output SAFEs.
+    """
+    keys = {get_key(o) for o in output_safes}
+    directories = collections.defaultdict(list)
+    for (output_safe,) in db.execute("SELECT output_safe FROM products"):
+        if output_safe in keys:
+            directories[os.path.dirname(output_safe)].append(output_safe)
+    with db:
+        for directory, recorded in directories.items():
+            try:
+                names = set(os.listdir(directory))
+            except FileNotFoundError:
+                names = set()
+            db.executemany(
+                "DELETE FROM products WHERE output_safe = ?",
+                [(o,) for o in recorded if os.path.basename(o) not in names],
+            )
+
+
+def get_done(db, files, output_safes, run_info):
+    """
+    Check which SAFEs of a listing are already processed.
+
+    A SAFE recorded as processed by a run with the same run info is done. The others are checked against the
+    manifest of their output SAFE (see sarwaveifrproc.manifest.is_safe_done), and recorded if done.
+
+    Parameters:
+    - db (sqlite3.Connection): inventory, see `connect`.
+    - files (list): Input safe paths.
+    - output_safes (list): paths of the output SAFEs, one per input SAFE.
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info
+    Returns:
+    - done (list[bool]): True for each SAFE with no subswath to process.
+    """
+    subswaths = refresh_inputs(db, files)
+    refresh_outputs(db, output_safes)
+    run_hash = get_run_hash(run_info)
+    recorded = {
+        o
+        for (o,) in db.execute(
+            "SELECT output_safe FROM products WHERE run_hash = ?", (run_hash,)
+        )
+    }
+    done, checked = [], []
+    for f, o in zip(files, output_safes):
+        if get_key(o) in recorded:
+            done.append(True)
+            continue
+        done.append(manifest.is_safe_done(subswaths[f], o, run_info))
+        if done[-1]:
+            checked.append((f, o))
+    if checked:
+        set_processed(db, *zip(*checked), run_info)
+    return done
+
+
+def set_processed(db, files, output_safes, run_info):
+    """
+    Record SAFEs as processed.
+
+    Parameters:
+    - db (sqlite3.Connection): inventory, see `connect`.
+    - files (list): Input safe paths.
+    - output_safes (list): paths of the output SAFEs, one per input SAFE.
+    - run_info (dict): see sarwaveifrproc.manifest.get_run_info
+    """
+    run_hash = get_run_hash(run_info)
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)",
+            [
+                (get_key(o), get_key(f), run_info["product_id"], run_hash, now)
+                for f, o in zip(files, output_safes)
+            ],
+        )
+
+
+def forget_processed(db, output_safes):
+    """
+    Forget that output SAFEs were processed, e.g. before overwriting them.
+
+    Parameters:
+    - db (sqlite3.Connection): inventory, see `connect`.
+    - output_safes (list): paths of the output SAFEs.
+    """
+    with db:
+        db.executemany(
+            "DELETE FROM products WHERE output_safe = ?",
+            [(get_key(o),) for o in output_safes],
+        )
+
+
+def get_summary(db):
+    """
+    Summary of the inventory.
+
+    Parameters:
+    - db (sqlite3.Connection): inventory, see `connect`.
+    Returns:
+    - summary (dict): number of SAFEs and subswaths, and number of processed SAFEs by product id.
+    """
+    return dict(
+        safes=db.execute("SELECT COUNT(*) FROM safes").fetchone()[0],
+        subswaths=db.execute("SELECT COUNT(*) FROM subswaths").fetchone()[0],
+        processed=dict(
+            db.execute(
+                "SELECT product_id, COUNT(*) FROM products GROUP BY product_id ORDER BY product_id"
+            )
+        ),
+    )
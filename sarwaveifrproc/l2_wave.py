@@ -1,10 +1,41 @@
+import concurrent.futures
+import contextvars
+import functools
 import numpy as np
 import os
 import xarray as xr
 
 # import datatree as dtt
-from scipy import special
 import sarwaveifrproc
+from sarwaveifrproc import metrics
+
+GROUPS = ["intraburst", "interburst"]
+
+FEATURE_VARIABLES = [
+    "sigma0_filt",
+    "normalized_variance_filt",
+    "incidence",
+    "azimuth_cutoff",
+    "cwave_params",
+]
+
+# Variables of the input dataset copied to the product of a dataset on land
+LAND_VARIABLES = ["corner_longitude", "corner_latitude", "incidence", "land_flag"]
+
+KEPT_VARIABLES = [
+    "corner_longitude",
+    "corner_latitude",
+    "land_flag",
+    "sigma0_filt",
+    "normalized_variance_filt",
+    "incidence",
+    "azimuth_cutoff",
+    "cwave_params",
+]
+
+# Rough ratio between the memory used to process a block of tiles (stacked inputs, features,
+# predictions and formatted product) and the size of its input variables.
+BLOCK_MEMORY_FACTOR = 4
 
 attributes_missing_variables = {
     "sigma0_filt": {
@@ -22,7 +53,17 @@ attributes_missing_variables = {
 }
 
 
-def generate_l2_wave_product(xdt, models, models_outputs, predicted_variables):
+def generate_l2_wave_product(
+    xdt,
+    models,
+    models_outputs,
+    predicted_variables,
+    mask_invalid_tiles=False,
+    engine="xarray",
+    concurrent_groups=False,
+    pol="VV",
+    reused_groups=None,
+):
     """
     Generate a level-2 wave (L2 WAV) product.
 
@@ -31,6 +72,13 @@ def generate_l2_wave_product(xdt, models, models_outputs, predicted_variables):
     - models (dict[str, onnxruntime.InferenceSession): different ml models used
     - models_outputs (dict[str, list]): list of variables predicted by each model
     - predicted_variables (dict[dict]):  variables to add to the product and corresponding model and output name
+    - mask_invalid_tiles (bool): run the models only on ocean tiles with finite inputs, the others are set to NaN.
+    - engine (str): "xarray" or "numpy", see `prepare_tiles`.
+    - concurrent_groups (bool): process the intraburst and interburst groups at the same time, on two threads.
+      They use different models, and onnx runtime releases the GIL during the inference.
+    - pol (str or list[str]): polarisation to predict, or list of polarisations predicted at once, see `stack_tiles`.
+    - reused_groups (dict[str, xarray.Dataset]): intermediate products of previous products, by group, used instead of
+      generating these groups again, see sarwaveifrproc.incremental.
     Returns:
     - l2_wave_product (dtt.DataTree): Level-2 wave product.
 
@@ -38,52 +86,311 @@ def generate_l2_wave_product(xdt, models, models_outputs, predicted_variables):
     - The scaler objects should be one of StandardScaler, MinMaxScaler, or RobustScaler from sklearn.preprocessing.
     """
 
-    kept_variables = [
-        "corner_longitude",
-        "corner_latitude",
-        "land_flag",
-        "sigma0_filt",
-        "normalized_variance_filt",
-        "incidence",
-        "azimuth_cutoff",
-        "cwave_params",
+    def generate(group):
+        if reused_groups and group in reused_groups:
+            return reused_groups[group]
+        group_variables = getattr(predicted_variables, group)
+        return generate_intermediate_product(
+            xdt[group].ds,
+            get_group_models(models, group_variables),
+            models_outputs,
+            group_variables,
+            KEPT_VARIABLES,
+            pol,
+            mask_invalid_tiles=mask_invalid_tiles,
+            engine=engine,
+        )
+
+    if concurrent_groups:
+        # each thread runs in a copy of the context, to keep the subswath of the metrics, see metrics.subswath
+        with concurrent.futures.ThreadPoolExecutor(len(GROUPS)) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, generate, group)
+                for group in GROUPS
+            ]
+            ds_intraburst, ds_interburst = [f.result() for f in futures]
+    else:
+        ds_intraburst, ds_interburst = map(generate, GROUPS)
+
+    return build_l2_wave_product(xdt, ds_intraburst, ds_interburst)
+
+
+def generate_l2_wave_products(
+    xdts,
+    models,
+    models_outputs,
+    predicted_variables,
+    batch_size=None,
+    mask_invalid_tiles=False,
+    engine="xarray",
+    pol="VV",
+):
+    """
+    Generate level-2 wave (L2 WAV) products for several subswaths, batching the inference.
+
+    The stacked tiles of every group of every subswath are gathered so that each model
+    is run once per batch of `batch_size` tiles instead of once per dataset.
+
+    Parameters:
+    - xdts (list): DataTrees containing intraburst and interburst datasets.
+    - models (dict[str, onnxruntime.InferenceSession): different ml models used
+    - models_outputs (dict[str, list]): list of variables predicted by each model
+    - predicted_variables (dict[dict]):  variables to add to the product and corresponding model and output name
+    - batch_size (int): maximum number of tiles per model call. All the tiles are sent at once if None.
+    - mask_invalid_tiles (bool): run the models only on ocean tiles with finite inputs, the others are set to NaN.
+    - engine (str): "xarray" or "numpy", see `prepare_tiles`.
+    - pol (str or list[str]): polarisation to predict, or list of polarisations predicted at once, see `stack_tiles`.
+    Returns:
+    - l2_wave_products (list[dtt.DataTree]): Level-2 wave products, in the order of `xdts`.
+    """
+    products = [{} for _ in xdts]
+    pending = []
+    for i, xdt in enumerate(xdts):
+        with metrics.subswath(xdt.encoding["source"]):
+            for group in GROUPS:
+                ds = xdt[group].ds
+                group_variables = getattr(predicted_variables, group)
+                if is_land(ds):
+                    with metrics.stage("format", tiles=ds["land_flag"].size):
+                        products[i][group] = generate_product_on_land(
+                            ds, group_variables, KEPT_VARIABLES, pol
+                        )
+                    continue
+                with metrics.stage("stack") as m:
+                    ds, tiles, X, land_flag = prepare_tiles(ds, pol, engine)
+                    m.update(tiles=len(X), array_bytes=X.nbytes)
+                pending.append(
+                    dict(
+                        index=i,
+                        group=group,
+                        ds=ds,
+                        tiles=tiles,
+                        features=X,
+                        valid=(
+                            get_valid_tiles(land_flag, X)
+                            if mask_invalid_tiles
+                            else None
+                        ),
+                        models=get_group_models(models, group_variables),
+                        res={},
+                    )
+                )
+
+    for model, names in group_sessions(models):
+        users = [p for p in pending if set(names) & set(p["models"])]
+        if not users:
+            continue
+        sizes = [len(p["features"]) for p in users]
+        valid = (
+            np.concatenate([p["valid"] for p in users]) if mask_invalid_tiles else None
+        )
+        res = run_session(
+            np.concatenate([p["features"] for p in users]),
+            model,
+            names,
+            batch_size,
+            valid,
+        )
+        offsets = np.cumsum([0] + sizes)
+        for p, start, stop in zip(users, offsets[:-1], offsets[1:]):
+            p["res"].update(
+                (k, [r[start:stop] for r in res[k]]) for k in names if k in p["models"]
+            )
+
+    for p in pending:
+        with metrics.subswath(xdts[p["index"]].encoding["source"]):
+            with metrics.stage("format", tiles=len(p["features"])) as m:
+                products[p["index"]][p["group"]] = format_predictions(
+                    p["ds"],
+                    p["tiles"],
+                    p["res"],
+                    models_outputs,
+                    getattr(predicted_variables, p["group"]),
+                    KEPT_VARIABLES,
+                    engine,
+                )
+                m["array_bytes"] = products[p["index"]][p["group"]].nbytes
+
+    return [
+        build_l2_wave_product(xdt, d["intraburst"], d["interburst"])
+        for xdt, d in zip(xdts, products)
     ]
-    intraburst_models = {
-        k: m
-        for k, m in models.items()
-        if k in [v.model for v in predicted_variables.intraburst.values()]
-    }
-    interburst_models = {
-        k: m
-        for k, m in models.items()
-        if k in [v.model for v in predicted_variables.interburst.values()]
-    }
-    ds_intraburst = generate_intermediate_product(
-        xdt["intraburst"].ds,
-        intraburst_models,
-        models_outputs,
-        predicted_variables.intraburst,
-        kept_variables,
-    )
-    ds_interburst = generate_intermediate_product(
-        xdt["interburst"].ds,
-        interburst_models,
-        models_outputs,
-        predicted_variables.interburst,
-        kept_variables,
+
+
+def generate_l2_wave_product_blocks(
+    xdt,
+    models,
+    models_outputs,
+    predicted_variables,
+    block_size_mb,
+    mask_invalid_tiles=False,
+    engine="xarray",
+    pol="VV",
+):
+    """
+    Generate a level-2 wave (L2 WAV) product by blocks of bursts, to bound the memory used by large subswaths.
+
+    The groups of `xdt` should be opened lazily: each block is read, predicted and formatted only when the
+    iterator reaches it, so that a single block is in memory at a time. The blocks of a group are concatenated
+    along their first tile dimension to give the product of `generate_l2_wave_product`.
+
+    Parameters:
+    - xdt (dict): DataTree containing intraburst and interburst datasets.
+    - models (dict[str, onnxruntime.InferenceSession): different ml models used
+    - models_outputs (dict[str, list]): list of variables predicted by each model
+    - predicted_variables (dict[dict]):  variables to add to the product and corresponding model and output name
+    - block_size_mb (float): approximate memory budget of a block, in MB, see `get_block_length`.
+    - mask_invalid_tiles (bool): run the models only on ocean tiles with finite inputs, the others are set to NaN.
+    - engine (str): "xarray" or "numpy", see `prepare_tiles`.
+    - pol (str or list[str]): polarisation to predict, or list of polarisations predicted at once, see `stack_tiles`.
+    Yields:
+    - group (str): "/" for the root of the product, whose dataset only holds its attributes, then "intraburst" or "interburst".
+    - ds (xarray.Dataset): root of the product or intermediate product of a block.
+    """
+    yield "/", xr.Dataset(attrs=get_product_attrs(xdt))
+    for group in GROUPS:
+        ds = xdt[group].ds
+        group_variables = getattr(predicted_variables, group)
+        group_models = get_group_models(models, group_variables)
+        # the land check is made on the whole group, so that all its blocks get the same variables
+        land = is_land(ds)
+        for block in iter_blocks(ds, block_size_mb):
+            if land:
+                with metrics.stage("format", tiles=block["land_flag"].size):
+                    yield group, generate_product_on_land(
+                        block, group_variables, KEPT_VARIABLES, pol
+                    )
+                continue
+            yield group, generate_ocean_product(
+                block,
+                group_models,
+                models_outputs,
+                group_variables,
+                KEPT_VARIABLES,
+                pol,
+                mask_invalid_tiles=mask_invalid_tiles,
+                engine=engine,
+            )
+
+
+def iter_blocks(ds, block_size_mb):
+    """
+    Split a dataset along its first tile dimension (burst, or tile_line for datasets without bursts).
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+    - block_size_mb (float): approximate memory budget of a block, in MB, see `get_block_length`.
+    Yields:
+    - block (xarray.Dataset): consecutive slices of the dataset.
+    """
+    dim = get_tiles_dims(ds)[0]
+    length = get_block_length(ds, dim, block_size_mb)
+    for start in range(0, ds.sizes[dim], length):
+        yield ds.isel({dim: slice(start, start + length)})
+
+
+def get_block_length(ds, dim, block_size_mb):
+    """
+    Get the number of indices along `dim` of the blocks of a dataset that fit in a memory budget.
+
+    The budget covers the input variables read to generate the product, along `dim`, and their copies
+    while the block is processed (BLOCK_MEMORY_FACTOR). Blocks have at least one index.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+    - dim (str): dimension along which the dataset is split.
+    - block_size_mb (float): approximate memory budget of a block, in MB.
+    Returns:
+    - length (int): number of indices along `dim` of each block.
+    """
+    read = set(KEPT_VARIABLES + FEATURE_VARIABLES) | set(ds.coords)
+    nbytes = sum(
+        var.nbytes for v, var in ds.variables.items() if v in read and dim in var.dims
     )
+    index_nbytes = BLOCK_MEMORY_FACTOR * nbytes / max(ds.sizes[dim], 1)
+    if not index_nbytes:
+        return max(ds.sizes[dim], 1)
+    return max(int(block_size_mb * 2**20 // index_nbytes), 1)
+
+
+def get_memory_estimate(xdt):
+    """
+    Estimate the memory needed to generate the product of a subswath in one go, before reading it.
 
+    As for the blocks (see `get_block_length`), the estimate is the size of the input variables read to generate
+    the product times BLOCK_MEMORY_FACTOR.
+
+    Parameters:
+    - xdt (dict): DataTree containing intraburst and interburst datasets, opened lazily.
+    Returns:
+    - size_mb (float): estimated memory, in MB.
+    """
+    read = set(KEPT_VARIABLES + FEATURE_VARIABLES)
+    nbytes = 0
+    for group in GROUPS:
+        ds = xdt[group].ds
+        nbytes += sum(
+            var.nbytes for v, var in ds.variables.items() if v in read or v in ds.coords
+        )
+    return BLOCK_MEMORY_FACTOR * nbytes / 2**20
+
+
+def get_product_attrs(xdt):
+    """
+    Get the attributes of the root of a level-2 wave (L2 WAV) product.
+
+    Parameters:
+    - xdt (dict): input DataTree, used for its source file name.
+    Returns:
+    - attrs (dict): attributes of the product.
+    """
+    return {"input_sar_product": os.path.basename(xdt.encoding["source"])}
+
+
+def build_l2_wave_product(xdt, ds_intraburst, ds_interburst):
+    """
+    Assemble the intermediate products into a level-2 wave (L2 WAV) product.
+
+    Parameters:
+    - xdt (dict): input DataTree, used for its source file name.
+    - ds_intraburst (xarray.Dataset): intraburst intermediate product.
+    - ds_interburst (xarray.Dataset): interburst intermediate product.
+    Returns:
+    - l2_wave_product (dtt.DataTree): Level-2 wave product.
+    """
     l2_wave_product = xr.DataTree.from_dict(
         {"intraburst": ds_intraburst, "interburst": ds_interburst}
     )
-    l2_wave_product.attrs["input_sar_product"] = os.path.basename(
-        xdt.encoding["source"]
-    )
+    l2_wave_product.attrs.update(get_product_attrs(xdt))
     return l2_wave_product
 
 
+def get_group_models(models, predicted_variables):
+    """
+    Select the models needed to predict the variables of a group (intraburst or interburst).
+
+    Parameters:
+    - models (dict[str, onnxruntime.InferenceSession): different ml models used
+    - predicted_variables (dict[dict]): variables of the group and corresponding model and output name
+    Returns:
+    - group_models (dict[str, onnxruntime.InferenceSession): models used by the group
+    """
+    return {
+        k: m
+        for k, m in models.items()
+        if k in [v.model for v in predicted_variables.values()]
+    }
+
+
 def generate_intermediate_product(
-    ds, models, models_outputs, predicted_variables, kept_variables, pol="VV"
+    ds,
+    models,
+    models_outputs,
+    predicted_variables,
+    kept_variables,
+    pol="VV",
+    mask_invalid_tiles=False,
+    engine="xarray",
 ):
     """
     Generate an intermediate l2 product, depending of the input dataset (intraburst or interburst).
@@ -94,95 +401,372 @@ def generate_intermediate_product(
     - models_outputs (dict[str, list]): list of variables predicted by each model
     - predicted_variables (dict[dict]):  variables to add to the product and corresponding model and output name
     - kept_variables (list): List of variables from the input dataset that are kept in the final product.
-    - pol (str): polarisation to select
+    - pol (str or list[str]): polarisation to select, or list of polarisations predicted at once, see `stack_tiles`.
+    - mask_invalid_tiles (bool): run the models only on ocean tiles with finite inputs, the others are set to NaN.
+    - engine (str): "xarray" or "numpy", see `prepare_tiles`.
 
     Returns:
     - ds_pred (xarray.Dataset): Intermediate predictions dataset.
     """
 
-    if ds["land_flag"].all():
-        return generate_product_on_land(ds, predicted_variables, kept_variables)
+    if is_land(ds):
+        with metrics.stage("format", tiles=ds["land_flag"].size):
+            return generate_product_on_land(
+                ds, predicted_variables, kept_variables, pol
+            )
 
-    if "2tau" in ds.dims:
-        ds = ds.squeeze(dim="2tau")
-        ds.attrs["squeezed_dimensions"] = "2tau"
+    return generate_ocean_product(
+        ds,
+        models,
+        models_outputs,
+        predicted_variables,
+        kept_variables,
+        pol,
+        mask_invalid_tiles,
+        engine,
+    )
 
-    tiles = ds[
-        [
-            "sigma0_filt",
-            "normalized_variance_filt",
-            "incidence",
-            "azimuth_cutoff",
-            "cwave_params",
-        ]
-    ].sel(pol=pol)
-    if "burst" in ds.coords:
-        tiles_stacked = tiles.stack(
-            all_tiles=["burst", "tile_line", "tile_sample"], k_phi=["k_gp", "phi_hf"]
+
+def generate_ocean_product(
+    ds,
+    models,
+    models_outputs,
+    predicted_variables,
+    kept_variables,
+    pol="VV",
+    mask_invalid_tiles=False,
+    engine="xarray",
+):
+    """
+    Generate an intermediate l2 product by running the models on all the tiles of a dataset, without checking for land.
+
+    Parameters: see `generate_intermediate_product`.
+
+    Returns:
+    - ds_pred (xarray.Dataset): Intermediate predictions dataset.
+    """
+    with metrics.stage("stack") as m:
+        ds, tiles, X, land_flag = prepare_tiles(ds, pol, engine)
+        m.update(tiles=len(X), array_bytes=X.nbytes)
+    valid = get_valid_tiles(land_flag, X) if mask_invalid_tiles else None
+    res = run_models(X, models, valid=valid)
+
+    with metrics.stage("format", tiles=len(X)) as m:
+        ds_pred = format_predictions(
+            ds, tiles, res, models_outputs, predicted_variables, kept_variables, engine
         )
-    else:
-        tiles_stacked = tiles.stack(
-            all_tiles=["tile_line", "tile_sample"], k_phi=["k_gp", "phi_hf"]
+        m["array_bytes"] = ds_pred.nbytes
+    return ds_pred
+
+
+def is_land(ds):
+    """
+    Check whether all the tiles of a dataset are on land.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+
+    Returns:
+    - land (bool): True if all the tiles are on land.
+    """
+    with metrics.stage("land_check", tiles=ds["land_flag"].size):
+        return bool(ds["land_flag"].all())
+
+
+def prepare_tiles(ds, pol="VV", engine="xarray"):
+    """
+    Build the model input matrix of a dataset.
+
+    The "xarray" engine stacks the tiles with `stack_tiles`. The "numpy" engine reshapes the
+    underlying arrays directly, without building any MultiIndex.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+    - pol (str or list[str]): polarisation to select, or list of polarisations, see `stack_tiles`.
+    - engine (str): "xarray" or "numpy".
+
+    Returns:
+    - ds (xarray.Dataset): Input dataset, without its 2tau dimension, restricted to the polarisations of a list.
+    - tiles (xarray.Dataset or tuple): stacked tiles ("xarray") or tile dimensions ("numpy"), to pass to `format_predictions`.
+    - X (np.ndarray): float32 array of shape (number of tiles, number of features).
+    - land_flag (np.ndarray): land flag of each tile.
+    """
+    if engine == "xarray":
+        ds, tiles_stacked = stack_tiles(ds, pol)
+        return (
+            ds,
+            tiles_stacked,
+            get_features(tiles_stacked),
+            tiles_stacked["land_flag"].values,
         )
+    if engine == "numpy":
+        ds = squeeze_2tau(select_pols(ds, pol))
+        tiles_dims = get_pol_dims(pol) + get_tiles_dims(ds)
+        return ds, tiles_dims, *get_features_numpy(ds, tiles_dims, pol)
+    raise ValueError(f"Unknown engine {engine!r}, expected 'xarray' or 'numpy'.")
+
+
+def format_predictions(
+    ds, tiles, res, models_outputs, predicted_variables, kept_variables, engine="xarray"
+):
+    """
+    Add the raw model outputs to the dataset, with the engine that prepared the tiles.
 
-    output_dims = [["preds", "all_tiles"]]
+    Parameters:
+    - ds (xarray.Dataset): Input dataset, as returned by `prepare_tiles`.
+    - tiles (xarray.Dataset or tuple): tiles, as returned by `prepare_tiles`.
+    - res (dict[str, list[np.ndarray]]): for each model, one array of predictions per output column.
+    - models_outputs (dict[str, list]): list of variables predicted by each model
+    - predicted_variables (dict[dict]):  variables to add to the product and corresponding model and output name
+    - kept_variables (list): List of variables from the input dataset that are kept in the final product.
+    - engine (str): "xarray" or "numpy".
 
+    Returns:
+    - ds_pred (xarray.Dataset): Intermediate predictions dataset.
+    """
+    if engine == "numpy":
+        return format_dataset_numpy(
+            ds, tiles, res, models_outputs, predicted_variables, kept_variables
+        )
     predictions = xr.concat(
         [
-            xr.apply_ufunc(
-                predict_variables,
-                tiles_stacked["sigma0_filt"],
-                tiles_stacked["normalized_variance_filt"],
-                tiles_stacked["incidence"],
-                tiles_stacked["azimuth_cutoff"],
-                tiles_stacked["cwave_params"],
-                model,
-                input_core_dims=[
-                    ["all_tiles"],
-                    ["all_tiles"],
-                    ["all_tiles"],
-                    ["all_tiles"],
-                    ["all_tiles", "k_phi"],
-                    [],
-                ],
-                output_core_dims=output_dims,
-                vectorize=False,
-            ).assign_coords(preds=[f"{k}_{o}" for o in models_outputs[k]])
-            for (k, model) in models.items()
+            wrap_predictions(tiles, r, [f"{k}_{o}" for o in models_outputs[k]])
+            for k, r in res.items()
         ],
         dim="preds",
     )
+    return format_dataset(ds, predictions, predicted_variables, kept_variables)
 
-    ds_pred = format_dataset(ds, predictions, predicted_variables, kept_variables)
 
-    return ds_pred
+def stack_tiles(ds, pol="VV"):
+    """
+    Select the model inputs of a dataset and stack its tiles along a single dimension.
 
+    With a list of polarisations, the tiles of every polarisation are stacked together, polarisation first,
+    so that the models are run once for all of them and the predictions get a `pol` dimension.
 
-def generate_product_on_land(ds, predicted_variables, kept_variables):
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+    - pol (str or list[str]): polarisation to select, or list of polarisations.
+
+    Returns:
+    - ds (xarray.Dataset): Input dataset, without its 2tau dimension, restricted to the polarisations of a list.
+    - tiles_stacked (xarray.Dataset): model inputs and land flag stacked along `all_tiles` (and `k_phi` for the cwave parameters).
+    """
+    ds = squeeze_2tau(select_pols(ds, pol))
+
+    tiles = ds[FEATURE_VARIABLES + ["land_flag"]].sel(pol=pol)
+    tiles_stacked = tiles.stack(
+        all_tiles=list(get_pol_dims(pol) + get_tiles_dims(ds)),
+        k_phi=["k_gp", "phi_hf"],
+    )
+    return ds, tiles_stacked
+
+
+def select_pols(ds, pol):
+    """
+    Restrict a dataset to a list of polarisations. A single polarisation is selected later, with the model inputs.
+    Only the variables with a `pol` dimension are restricted, e.g. the land flags of the L1B products have none.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+    - pol (str or list[str]): polarisation or list of polarisations.
+
+    Returns:
+    - ds (xarray.Dataset): Input dataset, restricted to the polarisations of a list.
+    """
+    if isinstance(pol, str) or "pol" not in ds.dims:
+        return ds
+    return ds.sel(pol=list(pol))
+
+
+def get_pol_dims(pol):
+    """
+    Get the dimensions added to the tiles by the polarisations.
+
+    Parameters:
+    - pol (str or list[str]): polarisation or list of polarisations.
+
+    Returns:
+    - pol_dims (tuple[str]): ("pol",) for a list of polarisations, () for a single one.
+    """
+    return () if isinstance(pol, str) else ("pol",)
+
+
+def squeeze_2tau(ds):
+    """
+    Remove the 2tau dimension of a dataset, if any.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+
+    Returns:
+    - ds (xarray.Dataset): Input dataset, without its 2tau dimension.
+    """
+    if "2tau" in ds.dims:
+        ds = ds.squeeze(dim="2tau")
+        ds.attrs["squeezed_dimensions"] = "2tau"
+    return ds
+
+
+def get_tiles_dims(ds):
+    """
+    Get the dimensions indexing the tiles of a dataset.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset.
+
+    Returns:
+    - tiles_dims (tuple[str]): ("burst", "tile_line", "tile_sample") or ("tile_line", "tile_sample").
+    """
+    if "burst" in ds.coords:
+        return ("burst", "tile_line", "tile_sample")
+    return ("tile_line", "tile_sample")
+
+
+def get_features_numpy(ds, tiles_dims, pol="VV"):
+    """
+    Build the model input matrix by reshaping the dataset arrays, in the tile order of `stack_tiles`.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset, without its 2tau dimension.
+    - tiles_dims (tuple[str]): dimensions indexing the tiles, starting with "pol" for a list of polarisations.
+    - pol (str or list[str]): polarisation to select, or list of polarisations, see `stack_tiles`.
+
+    Returns:
+    - X (np.ndarray): float32 array of shape (number of tiles, number of features).
+    - land_flag (np.ndarray): land flag of each tile.
+    """
+
+    def values(v, *dims):
+        da = ds[v]
+        if "pol" in da.dims:
+            da = da.sel(pol=pol)
+        elif "pol" in tiles_dims:
+            da = da.expand_dims(pol=ds["pol"].values)
+        return da.transpose(*tiles_dims, *dims).values
+
+    n_tiles = int(np.prod([ds.sizes[d] for d in tiles_dims]))
+    cwave_params = values("cwave_params", "k_gp", "phi_hf").reshape(n_tiles, -1)
+    scalars = FEATURE_VARIABLES[:-1]
+    X = np.empty((n_tiles, cwave_params.shape[1] + len(scalars)), dtype=np.float32)
+    X[:, : cwave_params.shape[1]] = cwave_params
+    for i, v in enumerate(scalars, start=cwave_params.shape[1]):
+        X[:, i] = values(v).reshape(n_tiles)
+    return X, values("land_flag").reshape(n_tiles)
+
+
+def get_features(tiles_stacked):
+    """
+    Build the model input matrix from stacked tiles.
+
+    Parameters:
+    - tiles_stacked (xarray.Dataset): model inputs stacked by `stack_tiles`.
+
+    Returns:
+    - X (np.ndarray): float32 array of shape (number of tiles, number of features).
+    """
+    return build_features(
+        *[tiles_stacked[v].values for v in FEATURE_VARIABLES[:-1]],
+        tiles_stacked["cwave_params"].transpose("all_tiles", "k_phi").values,
+    )
+
+
+def get_valid_tiles(land_flag, X):
+    """
+    Find the tiles worth running the models on: ocean tiles whose inputs are all finite.
+
+    Parameters:
+    - land_flag (np.ndarray): land flag of each tile.
+    - X (np.ndarray): model input matrix.
+
+    Returns:
+    - valid (np.ndarray): boolean mask of shape (number of tiles,).
+    """
+    return ~land_flag.astype(bool) & np.isfinite(X).all(axis=1)
+
+
+def wrap_predictions(tiles_stacked, res, preds):
+    """
+    Wrap raw model outputs into a DataArray aligned with the stacked tiles.
+
+    Parameters:
+    - tiles_stacked (xarray.Dataset): model inputs stacked by `stack_tiles`.
+    - res (list[np.ndarray]): one array of predictions per model output.
+    - preds (list[str]): names of the model outputs.
+
+    Returns:
+    - predictions (xarray.DataArray): predictions with dimensions (preds, all_tiles).
+    """
+    return xr.DataArray(
+        np.stack(res),
+        dims=("preds", "all_tiles"),
+        coords=tiles_stacked["sigma0_filt"].coords,
+    ).assign_coords(preds=preds)
+
+
+def generate_product_on_land(ds, predicted_variables, kept_variables, pol="VV"):
     """
     Patch function when input dataset does not contain all necessary variables.
 
+    The NaN placeholders of the missing variables are built once per tile shape and set of
+    predicted variables, see `get_land_template`.
+
     Parameters:
     - ds (xarray.Dataset): Input dataset.
     - predicted_variables (list): List of predicted variable names.
     - kept_variables (list): List of variables from the input dataset that are kept in the final product.
+    - pol (str or list[str]): predicted polarisation, or list of polarisations giving the predicted variables a `pol` dimension.
     - bins (dict): Dictionary containing bins for each variable.
     """
-    ds = ds[["corner_longitude", "corner_latitude", "incidence", "land_flag"]]
+    ds = select_pols(ds[LAND_VARIABLES], pol)
 
-    shape = ds["land_flag"].shape
-    dims = ds["land_flag"].dims
+    if set(predicted_variables).issubset(ds.keys()):
+        kept_variables = kept_variables + predicted_variables
+
+    template = get_land_template(
+        ds["land_flag"].dims,
+        ds["land_flag"].shape,
+        tuple(v for v in kept_variables if v not in ds.variables),
+        tuple(
+            (v, tuple(dict(vd.attrs).items())) for v, vd in predicted_variables.items()
+        ),
+        None if isinstance(pol, str) else tuple(pol),
+    )
+    ds = xr.merge([ds, template])
+
+    ds.attrs.pop("name", None)
+    ds.attrs.pop("multidataset", None)
+    return ds
+
+
+@functools.lru_cache(maxsize=32)
+def get_land_template(dims, shape, missing_variables, predicted_variables, pols=None):
+    """
+    Build the NaN placeholders of a product on land.
 
+    The placeholders are read-only broadcast arrays, shared by the products of the same shape.
+
+    Parameters:
+    - dims (tuple[str]): dimensions of the tiles.
+    - shape (tuple[int]): number of tiles along each dimension.
+    - missing_variables (tuple[str]): kept variables missing from the input dataset.
+    - predicted_variables (tuple): (name, attributes items) pair of each predicted variable.
+    - pols (tuple[str]): polarisations of the predicted variables, which then get a `pol` dimension, with these
+      polarisations as coordinate, if the tiles do not have one.
+
+    Returns:
+    - template (xarray.Dataset): missing and predicted variables, filled with NaN.
+    """
     data_to_merge = []
 
-    if set(predicted_variables).issubset(ds.keys()):
-        kept_variables = kept_variables + predicted_variables
+    def nan(shape):
+        return np.broadcast_to(np.nan, shape)
 
-    for v in kept_variables:
-        if v not in ds.variables:
-            v_array = xr.DataArray(data=np.full(shape, np.nan), dims=dims).rename(v)
-            v_array.attrs = attributes_missing_variables[v]
-            data_to_merge.append(v_array)
+    for v in missing_variables:
+        v_array = xr.DataArray(data=nan(shape), dims=dims).rename(v)
+        v_array.attrs = attributes_missing_variables[v]
+        data_to_merge.append(v_array)
 
     # Add CWAVES independently because the required dimensions are not in the input dataset when there is only land.
     k_gp = xr.DataArray(data=range(1, 5), dims="k_gp")
@@ -191,22 +775,21 @@ def generate_product_on_land(ds, predicted_variables, kept_variables):
     phi_hf.attrs = attributes_missing_variables["phi_hf"]
 
     cwaves = xr.DataArray(
-        data=np.full(shape + (4, 5), np.nan), dims=dims + ("k_gp", "phi_hf")
+        data=nan(shape + (4, 5)), dims=dims + ("k_gp", "phi_hf")
     ).rename("cwave_params")
     cwaves.attrs = attributes_missing_variables["cwave_params"]
     data_to_merge.append(cwaves.assign_coords({"k_gp": k_gp, "phi_hf": phi_hf}))
 
-    for v, vd in predicted_variables.items():
-        attributes = vd.attrs
-        preds = xr.DataArray(data=np.full(shape, np.nan), dims=dims).rename(v)
-        preds.attrs = attributes
+    coords = {}
+    if pols is not None and "pol" not in dims:
+        dims, shape = ("pol",) + dims, (len(pols),) + shape
+        coords = {"pol": list(pols)}
+    for v, attributes in predicted_variables:
+        preds = xr.DataArray(data=nan(shape), dims=dims, coords=coords).rename(v)
+        preds.attrs = dict(attributes)
         data_to_merge.append(preds)
 
-    ds = xr.merge([ds] + data_to_merge)
-
-    ds.attrs.pop("name", None)
-    ds.attrs.pop("multidataset", None)
-    return ds
+    return xr.merge(data_to_merge)
 
 
 def predict_variables(
@@ -226,18 +809,173 @@ def predict_variables(
     Returns:
     - res (tuple): Tuple containing predictions for each variable.
     """
+    X_stacked = build_features(
+        sigma0, normalized_variance, incidence, azimuth_cutoff, cwave_params
+    )
+    # X_normalized = scaler.transform(X_stacked)
+    return run_model(X_stacked, model)
+
+
+def build_features(
+    sigma0, normalized_variance, incidence, azimuth_cutoff, cwave_params
+):
+    """
+    Stack the model inputs into a single matrix.
+
+    Parameters:
+    - sigma0 (np.ndarray): sigma0 values, shape (n,).
+    - normalized_variance (np.ndarray): normalized variance values, shape (n,).
+    - incidence (np.ndarray): incidence values, shape (n,).
+    - azimuth_cutoff (np.ndarray): azimuth cutoff values, shape (n,).
+    - cwave_params (np.ndarray): cwave parameters, shape (n, k_phi).
+
+    Returns:
+    - X_stacked (np.ndarray): float32 array of shape (n, k_phi + 4).
+    """
     X_stacked = np.vstack([sigma0, normalized_variance, incidence, azimuth_cutoff]).T
     X_stacked = np.hstack([cwave_params, X_stacked])
-    # X_normalized = scaler.transform(X_stacked)
+    return X_stacked.astype(np.float32)
+
 
+def run_model(X, model):
+    """
+    Run an inference session on an input matrix.
+
+    Parameters:
+    - X (np.ndarray): float32 input matrix.
+    - model (onnxruntime.InferenceSession): model to run.
+
+    Returns:
+    - res (list[np.ndarray]): one array of predictions per model output column.
+    """
     input_name = model.get_inputs()[0].name
-    inputs = {input_name: X_stacked.astype(np.float32)}
+    inputs = {input_name: X}
 
     res = model.run(None, inputs)
     res = [r[:, i] for r in res for i in range(r.shape[-1])]
     return res
 
 
+def run_model_batched(X, model, batch_size=None):
+    """
+    Run an inference session on an input matrix, by batches of `batch_size` rows.
+
+    Parameters:
+    - X (np.ndarray): float32 input matrix.
+    - model (onnxruntime.InferenceSession): model to run.
+    - batch_size (int): maximum number of rows per call. A single call is made if None.
+
+    Returns:
+    - res (list[np.ndarray]): one array of predictions per model output column.
+    """
+    if not batch_size or len(X) <= batch_size:
+        return run_model(X, model)
+    batches = [
+        run_model(X[i : i + batch_size], model) for i in range(0, len(X), batch_size)
+    ]
+    return [np.concatenate(r) for r in zip(*batches)]
+
+
+def run_model_masked(X, model, batch_size=None, valid=None):
+    """
+    Run an inference session on the valid rows of an input matrix only.
+
+    The predictions are scattered back into NaN-filled arrays of the full number of rows.
+
+    Parameters:
+    - X (np.ndarray): float32 input matrix.
+    - model (onnxruntime.InferenceSession): model to run.
+    - batch_size (int): maximum number of rows per call. A single call is made if None.
+    - valid (np.ndarray): boolean mask of the rows to run the model on. All the rows are run if None.
+
+    Returns:
+    - res (list[np.ndarray]): one array of predictions per model output column.
+    """
+    if valid is None:
+        return run_model_batched(X, model, batch_size)
+    if valid.any():
+        res = run_model_batched(X[valid], model, batch_size)
+    else:  # onnx runtime models do not accept empty inputs
+        n_columns = sum(o.shape[-1] for o in model.get_outputs())
+        res = [np.empty(0, dtype=np.float32)] * n_columns
+
+    full_res = []
+    for r in res:
+        full = np.full(len(X), np.nan, dtype=r.dtype)
+        full[valid] = r
+        full_res.append(full)
+    return full_res
+
+
+def run_models(X, models, batch_size=None, valid=None):
+    """
+    Run several models on the same input matrix.
+
+    Models sharing a session (fused models) are run with a single call.
+
+    Parameters:
+    - X (np.ndarray): float32 input matrix.
+    - models (dict[str, onnxruntime.InferenceSession): different ml models used
+    - batch_size (int): maximum number of rows per call. A single call is made if None.
+    - valid (np.ndarray): boolean mask of the rows to run the models on, the others are set to NaN. All the rows are run if None.
+
+    Returns:
+    - res (dict[str, list[np.ndarray]]): for each model, one array of predictions per output column.
+    """
+    res = {}
+    for model, names in group_sessions(models):
+        res.update(run_session(X, model, names, batch_size, valid))
+    return {k: res[k] for k in models}
+
+
+def run_session(X, model, names, batch_size=None, valid=None):
+    """
+    Run a session and split its output columns between the models it holds.
+
+    Parameters:
+    - X (np.ndarray): float32 input matrix.
+    - model (onnxruntime.InferenceSession): session to run, possibly holding several fused models.
+    - names (list[str]): names of the models held by the session.
+    - batch_size (int): maximum number of rows per call. A single call is made if None.
+    - valid (np.ndarray): boolean mask of the rows to run the session on, the others are set to NaN. All the rows are run if None.
+
+    Returns:
+    - res (dict[str, list[np.ndarray]]): for each model, one array of predictions per output column.
+    """
+    n_features = model.get_inputs()[0].shape[-1]
+    if isinstance(n_features, int) and n_features != X.shape[1]:
+        raise ValueError(
+            f"Models {names} expect {n_features} features, got {X.shape[1]}."
+        )
+    n_tiles = len(X) if valid is None else int(valid.sum())
+    with metrics.stage("inference", model="+".join(names), tiles=n_tiles) as m:
+        res = run_model_masked(X, model, batch_size, valid)
+        m["array_bytes"] = sum(r.nbytes for r in res)
+    if not hasattr(model, "columns"):
+        return {names[0]: res}
+    split, start = {}, 0
+    for k, n_columns in model.columns.items():
+        split[k] = res[start : start + n_columns]
+        start += n_columns
+    return {k: split[k] for k in names}
+
+
+def group_sessions(models):
+    """
+    Group the models by session, fused models sharing the same session.
+
+    Parameters:
+    - models (dict[str, onnxruntime.InferenceSession): different ml models used
+
+    Returns:
+    - sessions (list[tuple]): (session, names of the models it holds) pairs.
+    """
+    sessions = {}
+    for k, model in models.items():
+        sessions.setdefault(id(model), (model, []))[1].append(k)
+    return list(sessions.values())
+
+
 def format_dataset(ds, predictions, predicted_variables, kept_variables):
     """
     Format a dataset based on predictions, variables, and bins.
@@ -273,6 +1011,70 @@ def format_dataset(ds, predictions, predicted_variables, kept_variables):
 
     ds = xr.merge([ds] + data_to_merge)
     ds = ds.drop_vars(["tile_line", "tile_sample"])
+
+    return set_processor_attrs(ds)
+
+
+def format_dataset_numpy(
+    ds, tiles_dims, res, models_outputs, predicted_variables, kept_variables
+):
+    """
+    Build the intermediate product from raw model outputs, reshaped to the tile dimensions.
+
+    This is the counterpart of `format_dataset` for the "numpy" engine, giving the same dataset.
+
+    Parameters:
+    - ds (xarray.Dataset): Input dataset, without its 2tau dimension.
+    - tiles_dims (tuple[str]): dimensions indexing the tiles.
+    - res (dict[str, list[np.ndarray]]): for each model, one array of predictions per output column.
+    - models_outputs (dict[str, list]): list of variables predicted by each model
+    - predicted_variables (dict[dict]):  variables to add to the product and corresponding model and output name
+    - kept_variables (list): List of variables from the input dataset that are kept in the final product.
+
+    Returns:
+    - ds_pred (xarray.Dataset): Formatted dataset with predictions and original data.
+    """
+    shape = tuple(ds.sizes[d] for d in tiles_dims)
+    data_vars = {
+        v: xr.Variable(
+            tiles_dims,
+            res[vd.model][list(models_outputs[vd.model]).index(vd.output)].reshape(
+                shape
+            ),
+            attrs=vd.attrs,
+        )
+        for v, vd in predicted_variables.items()
+    }
+
+    if set(predicted_variables).issubset(ds.keys()):
+        kept_variables = kept_variables + predicted_variables
+
+    ds = ds[kept_variables].assign(data_vars)
+    ds = ds.drop_vars(["tile_line", "tile_sample"], errors="ignore")
+
+    # As when merging unstacked predictions, coordinates depending on only some of the
+    # tile dimensions are broadcast to all of them.
+    for c, coord in ds.coords.items():
+        missing = [d for d in tiles_dims if d not in coord.dims]
+        if c in ds.indexes or not coord.dims or not missing:
+            continue
+        if set(coord.dims) <= set(tiles_dims):
+            sizes = {d: ds.sizes[d] for d in coord.dims + tuple(missing)}
+            ds = ds.assign_coords({c: coord.variable.set_dims(sizes)})
+
+    return set_processor_attrs(ds)
+
+
+def set_processor_attrs(ds):
+    """
+    Set the processor attributes of an intermediate product.
+
+    Parameters:
+    - ds (xarray.Dataset): intermediate product.
+
+    Returns:
+    - ds (xarray.Dataset): intermediate product with the processor name and version.
+    """
     ds.attrs["l2_processor_name"] = "sarwaveifrproc"
     ds.attrs["l2_processor_version"] = sarwaveifrproc.__version__
     ds.attrs.pop("name", None)
@@ -6,9 +6,20 @@ import os
 import glob
 import numpy as np
 import sarwaveifrproc.utils as utils
-from dataclasses import dataclass
-import onnxruntime
+import sarwaveifrproc.containers as containers
+import sarwaveifrproc.daemon as daemon
+import sarwaveifrproc.executor as executor
+import sarwaveifrproc.inventory as inventory
+import sarwaveifrproc.manifest as manifest
+import sarwaveifrproc.metrics as metrics
+import sarwaveifrproc.server as server
+import sarwaveifrproc.variants as variants
+from dataclasses import dataclass, field, replace
+from typing import Optional
 import re
+import time
+import contextlib
+from concurrent.futures.process import BrokenProcessPool
 
 
 @dataclass
@@ -16,10 +27,24 @@ class Model:
     """
     path: path to the onnx file
     outputs: names of the model output variables
+    intra_op_num_threads: number of threads used to parallelize an operator (0: onnx runtime default)
+    inter_op_num_threads: number of threads used to run independent operators in parallel (0: onnx runtime default)
+    execution_mode: sequential or parallel
+    graph_optimization_level: disable, basic, extended or all
+    enable_cpu_mem_arena: use a memory arena on CPU
+    enable_mem_pattern: pre-allocate memory according to the observed allocation pattern
+    providers: onnx runtime execution providers, by order of preference
     """
 
     path: str
     outputs: list[str]
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    execution_mode: str = "sequential"
+    graph_optimization_level: str = "all"
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    providers: list[str] = field(default_factory=lambda: ["CPUExecutionProvider"])
 
 
 @dataclass
@@ -48,6 +73,25 @@ class PredictedVariables:
     interburst: dict[str, Prediction]
 
 
+@dataclass
+class OutputEncoding:
+    """
+    format: netcdf or zarr (requires the zarr package)
+    zlib: compress the variables with zlib (netcdf)
+    complevel: zlib compression level, from 1 to 9 (netcdf)
+    shuffle: apply the shuffle filter before the compression (netcdf)
+    chunks: chunk size of the variables along each dimension, dimensions not listed are not chunked
+    predictions_dtype: dtype of the predicted variables: float32, int16 (scaled integers) or null to keep the computed dtype
+    """
+
+    format: str = "netcdf"
+    zlib: bool = False
+    complevel: int = 4
+    shuffle: bool = True
+    chunks: dict[str, int] = field(default_factory=dict)
+    predictions_dtype: Optional[str] = None
+
+
 def main(
     input_path,
     save_directory: str,
@@ -57,7 +101,32 @@ def main(
     supported_input_product_versions: list[str]=[],
     overwrite: bool = False,
     verbose: bool = False,
-    dry_run: bool = False
+    dry_run: bool = False,
+    batch_size: Optional[int] = None,
+    prefetch: int = 0,
+    workers: int = 0,
+    optimized_models_cache: Optional[str] = None,
+    fuse_models: bool = False,
+    mask_invalid_tiles: bool = False,
+    engine: str = "xarray",
+    reader: str = "full",
+    read_pols: Optional[list[str]] = None,
+    output_encoding: OutputEncoding = OutputEncoding(),
+    metrics_report: Optional[str] = None,
+    inventory_db: Optional[str] = None,
+    model_variant: Optional[str] = None,
+    block_size_mb: Optional[float] = None,
+    watch: bool = False,
+    poll_interval: float = 5.0,
+    retry_interval: Optional[float] = 600.0,
+    concurrent_groups: bool = False,
+    predicted_pols: Optional[list[str]] = None,
+    inference_server: Optional[str] = None,
+    serve_models: bool = False,
+    inference_batch_window: float = 0.002,
+    container: Optional[str] = None,
+    memory_budget_mb: Optional[float] = None,
+    incremental_from: Optional[str] = None,
 ):
     """
     Generate a L2 WAVE product from a L1B or L1C SAFE.
@@ -67,74 +136,374 @@ def main(
     product_id: 3 digits ID representing the processing options. Ex: E00.
     models: onnx models and output
     predicted_variables:  model outputs and associated variables name to add to the L2 product
-    overwrite: overwrite the existing outputs
+    overwrite: overwrite the existing outputs. Otherwise, only the subswaths missing from the output SAFEs, or whose input or models changed, are processed
     verbose: debug log level if True
     supported_input_product_versions: list of product versions the model exlicitely supports
     dry_run: flag to skip the actual processing
+    batch_size: if set, gather the tiles of several subswaths and SAFEs and run each model on batches of this many tiles
+    prefetch: if > 0, overlap reading, inference and writing, with up to this many subswaths waiting between stages
+    workers: if > 0, process the SAFEs with this many worker processes, each loading the models once
+    optimized_models_cache: directory where the graphs optimized by onnx runtime are cached
+    fuse_models: merge the models used by the same group (intraburst or interburst) into a single graph, run once per dataset
+    mask_invalid_tiles: run the models only on ocean tiles with finite inputs, the predictions of the other tiles are set to NaN
+    engine: "xarray" or "numpy", the numpy engine reshapes the arrays directly instead of stacking and unstacking the tiles with xarray
+    reader: "full" or "selective", the selective reader opens only the intraburst and interburst groups and the variables needed by the product
+    read_pols: polarisations to read (all of them if null), e.g. [VV] since only VV is used by the models. The kept input variables are restricted to these polarisations
+    output_encoding: compression, chunking, dtype of the predictions and format of the written products, see the output_encoding profiles
+    metrics_report: path of a .json or .csv report of the wall time, tiles and bytes of each processing stage (open, land check, stack, inference of each model, format, write), aggregated over the run
+    inventory_db: path of a SQLite inventory of the input SAFEs of the listings, their subswaths and the processed SAFEs of each product id, used to plan the runs without listing every SAFE again
+    model_variant: int8, int8-static or fp16 to use the quantized or float16 variants of the models written by L2-wave-prepare-models (e.g. models/multi.int8.onnx), null for the full precision models
+    block_size_mb: if set, read, process and write each subswath by blocks of bursts of about this many MB, so that the memory used does not grow with the size of the inputs. Not compatible with batch_size, prefetch and int16 or zarr output encodings
+    watch: run as a service with the models loaded once: input_path is an inbox directory where listings (.txt) and SAFEs (or symbolic links to SAFEs) are dropped, and processed as they arrive. The status of each item is written in the .status directory of the inbox
+    poll_interval: seconds between two scans of the inbox in watch mode. Items are processed once they were not modified for this long
+    retry_interval: seconds after which a failed item is processed again in watch mode, doubled after each consecutive failure of the item. Failed items are only processed again when they are replaced if null
+    concurrent_groups: process the intraburst and interburst groups of a subswath at the same time, on two threads. The models left with the onnx runtime default intra_op_num_threads get an equal share of the CPUs of each worker. Not compatible with batch_size and block_size_mb
+    predicted_pols: polarisations to predict (VV if null), e.g. [VV, VH]. The tiles of every polarisation are read once and go through the models together, and the predicted variables get a pol dimension
+    inference_server: path of the Unix socket of an inference server of the node. The models are not loaded by the jobs and workers, which send their tiles to the server through shared memory
+    serve_models: run the inference server of inference_server instead of processing: load the models once and answer the requests of all the jobs of the node, until SIGTERM or SIGINT
+    inference_batch_window: seconds the inference server waits for the requests of other jobs, to run them in a single call of each model
+    container: "day" or "orbit" to append the products to a NetCDF container per day (next to the output SAFEs of the day) or per absolute orbit (in the orbits directory), with one group per subswath and an index of the source SAFEs, instead of writing one file per subswath. Not compatible with block_size_mb, inventory_db and zarr output encodings
+    memory_budget_mb: if set, memory available to process a subswath in each process, in MB, on top of the models. The subswaths estimated to need more are processed by blocks that fit in it, or deferred to a later run when their products cannot be written by blocks (int16, zarr or container outputs), as are the subswaths running out of memory. Not compatible with batch_size, prefetch and block_size_mb
+    incremental_from: product id of previous products in save_directory, e.g. E11 to produce E12. The groups (intraburst or interburst) of the previous products whose models, predicted variables and polarisations did not change, according to their attributes or to the manifests, are reused instead of being predicted again, and the products whose groups are all reused are linked. Not compatible with batch_size, prefetch, block_size_mb, container and zarr output encodings
     """
 
     setup_logging(verbose)
+    if block_size_mb and (batch_size or prefetch):
+        raise ValueError("block_size_mb cannot be combined with batch_size or prefetch.")
+    if concurrent_groups and (batch_size or block_size_mb):
+        raise ValueError("concurrent_groups cannot be combined with batch_size or block_size_mb.")
+    if memory_budget_mb and (batch_size or prefetch or block_size_mb):
+        raise ValueError("memory_budget_mb cannot be combined with batch_size, prefetch or block_size_mb.")
+    if incremental_from and (batch_size or prefetch or block_size_mb or container or output_encoding.format != "netcdf"):
+        raise ValueError(
+            "incremental_from cannot be combined with batch_size, prefetch, block_size_mb, container or zarr output encodings."
+        )
+    if metrics_report:
+        metrics.check_report_path(metrics_report)
+    if container is not None:
+        if container not in containers.CONTAINERS:
+            raise ValueError(f"Unknown container {container!r}, expected one of {containers.CONTAINERS}.")
+        if block_size_mb or inventory_db or output_encoding.format != "netcdf":
+            raise ValueError("container cannot be combined with block_size_mb, inventory_db or zarr output encodings.")
     os.environ["TF_CPP_MIN_LOG_LEVEL"] = (
         "3"  # Suppress TensorFlow INFO and WARNING messages
     )
-    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"  # Hide CUDA devices
+    if all(p == "CPUExecutionProvider" for d in models.values() for p in d.providers):
+        os.environ["CUDA_VISIBLE_DEVICES"] = "-1"  # Hide CUDA devices
     logging.info("Loading configuration file...")
+    if model_variant is not None:
+        models = {k: replace(d, path=variants.resolve_variant(d.path, model_variant)) for k, d in models.items()}
+
+    sessions_kwargs = dict(
+        cache_dir=optimized_models_cache,
+        fused_groups=get_fused_groups(predicted_variables) if fuse_models else (),
+        inference_server=inference_server,
+    )
+    if serve_models:
+        if inference_server is None:
+            raise ValueError("serve_models requires the inference_server socket path.")
+        logging.info("Loading models...")
+        ort_mods, mod_outs = server.load_sessions(models, **dict(sessions_kwargs, inference_server=None))
+        hashes = {k: manifest.get_file_hash(d.path) for k, d in models.items()}
+        server.serve(ort_mods, mod_outs, inference_server, inference_batch_window, hashes)
+        return None
+    product_kwargs = dict(mask_invalid_tiles=mask_invalid_tiles, engine=engine)
+    reader_kwargs = dict(reader=reader, pols=read_pols)
+    run_info = manifest.get_run_info(product_id, models, predicted_variables, mask_invalid_tiles, read_pols)
+    if predicted_pols:
+        # the products of a single polarisation keep the run info, and manifests, of the previous versions
+        product_kwargs.update(pol=list(predicted_pols))
+        run_info.update(pols=list(predicted_pols))
+    if concurrent_groups:
+        # only supported by generate_l2_wave_product, see the check above
+        product_kwargs.update(concurrent_groups=True)
+        models = share_threads(models, len(utils.GROUPS) * max(workers, 1))
+    writer_kwargs = dict(output_encoding=output_encoding, run_info=run_info)
+    if container is not None:
+        writer_kwargs.update(container=container)
+    pool_args = (
+        models, predicted_variables, product_id, workers, verbose,
+        sessions_kwargs, product_kwargs, reader_kwargs, writer_kwargs, bool(metrics_report), block_size_mb,
+        memory_budget_mb, incremental_from,
+    )
+
+    with contextlib.ExitStack() as stack:
+        # the worker processes are only started, and the models loaded, once there is something to process
+        if workers:
+            pools = [stack.enter_context(executor.create_pool(*pool_args))]
+        sessions = {}
+
+        def process(files, output_safes):
+            """
+            Process SAFEs with the loaded models, and return the errors of the SAFEs that could not be processed,
+            and the subswaths deferred by the memory budget of each SAFE.
+            """
+            failures, deferred = {}, {}
+            if not workers and not sessions:
+                logging.info("Loading models...")
+                sessions["models"], sessions["outputs"] = server.load_sessions(models, **sessions_kwargs)
+                logging.info("Models loaded.")
+            ort_mods, mod_outs = sessions.get("models"), sessions.get("outputs")
+            if workers:
+                try:
+                    failures = executor.process_listing(
+                        files, output_safes, *pool_args, pool=pools[-1], deferred=deferred
+                    )
+                except BrokenProcessPool:
+                    # a worker died while processing a previous listing, e.g. killed when out of memory
+                    pools.append(stack.enter_context(executor.create_pool(*pool_args)))
+                    failures = executor.process_listing(
+                        files, output_safes, *pool_args, pool=pools[-1], deferred=deferred
+                    )
+                if failures:
+                    logging.error(f"{len(failures)} SAFE(s) could not be processed.")
+            elif batch_size:
+                utils.process_files_batched(
+                    files, output_safes, ort_mods, mod_outs, predicted_variables, product_id, batch_size,
+                    product_kwargs, reader_kwargs, writer_kwargs,
+                )
+            elif prefetch:
+                utils.process_files_pipelined(
+                    files, output_safes, ort_mods, mod_outs, predicted_variables, product_id, prefetch,
+                    product_kwargs, reader_kwargs, writer_kwargs,
+                )
+            else:
+                for f, output_safe in zip(files, output_safes):
+                    deferred_subswaths = utils.process_files(
+                        f, output_safe, ort_mods, mod_outs, predicted_variables, product_id,
+                        product_kwargs, reader_kwargs, writer_kwargs, block_size_mb, memory_budget_mb,
+                        incremental_from,
+                    )
+                    if deferred_subswaths:
+                        deferred[f] = deferred_subswaths
+            return failures, deferred
+
+        run_kwargs = dict(
+            save_directory=save_directory,
+            product_id=product_id,
+            run_info=run_info,
+            supported_input_product_versions=supported_input_product_versions,
+            overwrite=overwrite,
+            dry_run=dry_run,
+            inventory_db=inventory_db,
+            metrics_report=metrics_report,
+            container=container,
+        )
+        if watch:
+            daemon.serve(
+                input_path, lambda path: run(path, process, **run_kwargs), poll_interval, retry_interval=retry_interval
+            )
+            return None
+        return run(input_path, process, **run_kwargs)
+
+
+def run(
+    input_path,
+    process,
+    save_directory,
+    product_id,
+    run_info,
+    supported_input_product_versions=[],
+    overwrite=False,
+    dry_run=False,
+    inventory_db=None,
+    metrics_report=None,
+    container=None,
+):
+    """
+    Process a L1B or L1C SAFE or a listing of SAFEs, skipping the SAFEs already processed.
 
-    logging.info("Loading models...")
-    ort_mods = {k: onnxruntime.InferenceSession(d.path) for k, d in models.items()}
-    mod_outs = {k: d.outputs for k, d in models.items()}
-    logging.info("Models loaded.")
+    input_path: l1b or l1c safe path or listing path (.txt file).
+    process: function processing SAFEs, given the input and output SAFE paths, and returning the errors of the SAFEs that could not be processed and the subswaths deferred of each SAFE
+    save_directory: where to save output data
+    product_id: 3 digits ID representing the processing options. Ex: E00.
+    run_info: description of the run recorded in the manifests, see sarwaveifrproc.manifest.get_run_info
+    supported_input_product_versions: list of product versions the model exlicitely supports
+    overwrite: overwrite the existing outputs
+    dry_run: flag to skip the actual processing
+    inventory_db: path of a SQLite inventory, see main
+    metrics_report: path of a .json or .csv metrics report, see main
+    container: "day" or "orbit" if the products are appended to containers, see main
 
+    Returns a summary: number of SAFEs of the input, number of SAFEs processed, errors of the SAFEs that could not be processed,
+    and, if any, the subswaths deferred by the memory budget of each SAFE. The SAFEs with deferred subswaths are not counted as processed.
+    """
     if input_path.endswith(".txt"):
-        files = np.loadtxt(input_path, dtype=str)
+        files = np.atleast_1d(np.loadtxt(input_path, dtype=str))
         output_safes = np.array(
             [utils.get_output_safe(f, save_directory, product_id) for f in files]
         )
+        n_safes = len(files)
 
         if not overwrite:
-            mask = np.array([os.path.exists(f) for f in output_safes])
+            if inventory_db:
+                with contextlib.closing(inventory.connect(inventory_db)) as db:
+                    mask = np.array(inventory.get_done(db, files, output_safes, run_info), dtype=bool)
+            else:
+                mask = np.array(
+                    [
+                        is_safe_done(utils.list_subswaths(f), o, run_info, container)
+                        for f, o in zip(files, output_safes)
+                    ],
+                    dtype=bool,
+                )
             files, output_safes = files[~mask], output_safes[~mask]
 
             logging.info(
-                f"{np.sum(mask)} file(s) already exist(s) and overwriting is not allowed. Use --overwrite to overwrite existing files."
+                f"{np.sum(mask)} file(s) already processed and overwriting is not allowed. Use --overwrite to overwrite existing files."
             )
 
             if not files.size:
-                return None
-
-        logging.info("Processing files...")
-        for f, output_safe in zip(files, output_safes):
-            name = Path(f).name
-            m = re.match(utils.VERS_SAFE_PATTERN, name)
-            if m is None or m.groupdict().get('version') not in supported_input_product_versions:
-                logging.warning(f'Unsupported product version for SAFE {name}')
-            if dry_run: continue
-            utils.process_files(
-                f, output_safe, ort_mods, mod_outs, predicted_variables, product_id
-            )
+                return dict(safes=n_safes, processed=0, failures={})
+
+        for f in files:
+            check_product_version(f, supported_input_product_versions)
 
     else:
-        name = Path(input_path).name
-        m = re.match(utils.VERS_SAFE_PATTERN, name)
-        if m is None or m.groupdict().get('version') not in supported_input_product_versions:
-            logging.warning(f'Unsupported product version for SAFE {name}')
+        check_product_version(input_path, supported_input_product_versions)
         logging.info("Checking if output safe already exists...")
         output_safe = utils.get_output_safe(input_path, save_directory, product_id)
+        n_safes = 1
 
-        if os.path.exists(output_safe) and not overwrite:
+        if not overwrite and is_safe_done(
+            utils.list_subswaths(input_path), output_safe, run_info, container
+        ):
             logging.info(
-                f"{output_safe} already exists and overwriting is not allowed. Use --overwrite to overwrite existing files."
-            )
-            return None
-
-        logging.info("Processing files...")
-        if not dry_run:
-            utils.process_files(
-                input_path, output_safe, ort_mods, mod_outs, predicted_variables, product_id
+                f"{output_safe} already processed and overwriting is not allowed. Use --overwrite to overwrite existing files."
             )
+            return dict(safes=n_safes, processed=0, failures={})
+
+        files, output_safes = [input_path], [output_safe]
+
+    if overwrite and not dry_run:
+        for output_safe in output_safes:
+            if container is not None:
+                containers.invalidate_safe(output_safe, container)
+            else:
+                manifest.remove_manifest(output_safe)
+        if inventory_db:
+            with contextlib.closing(inventory.connect(inventory_db)) as db:
+                inventory.forget_processed(db, output_safes)
+
+    logging.info("Processing files...")
+    metrics.enable(bool(metrics_report))
+    start = time.perf_counter()
+    failures, deferred = {}, {}
+    if dry_run:
+        logging.info("Dry run: the processing is skipped.")
+    else:
+        failures, deferred = process(files, output_safes)
+    if deferred:
+        logging.warning(
+            f"{len(deferred)} SAFE(s) with subswaths above the memory budget, left for a later run: {', '.join(deferred)}"
+        )
 
     logging.info(f"Processing terminated. Output directory: \n{save_directory}")
 
+    if inventory_db and not dry_run:
+        processed = [(f, o) for f, o in zip(files, output_safes) if f not in failures and f not in deferred]
+        with contextlib.closing(inventory.connect(inventory_db)) as db:
+            if processed:
+                inventory.set_processed(db, *zip(*processed), run_info)
+            summary = inventory.get_summary(db)
+        logging.info(
+            f"Inventory: {summary['safes']} SAFE(s), {summary['subswaths']} subswaths, processed SAFE(s) by product id: {summary['processed']}"
+        )
+
+    if metrics_report and not dry_run:
+        report = metrics.get_report(
+            metrics.pop_records(), time.perf_counter() - start, product_id=product_id, safes=len(files)
+        )
+        metrics.write_report(metrics_report, report)
+        log_metrics(report)
+        logging.info(f"Metrics report: {metrics_report}")
+
+    summary = dict(
+        safes=n_safes,
+        processed=0 if dry_run else sum(f not in failures and f not in deferred for f in files),
+        failures=failures,
+    )
+    if deferred:
+        summary.update(deferred=deferred)
+    return summary
+
+
+def log_metrics(report):
+    """
+    Log the totals of a run and the share of its wall time spent in each stage.
+
+    report: metrics report, see sarwaveifrproc.metrics.get_report
+    """
+    logging.info(
+        f"{report['subswaths']} subswath(s), {report['tiles']} tiles in {report['elapsed']:.1f}s "
+        f"({report['tiles_per_second']:.0f} tiles/s), {report['bytes_read']} bytes read, {report['bytes_written']} bytes written."
+    )
+    for s in report["stages"]:
+        name = f"{s['stage']} ({s['model']})" if s["model"] else s["stage"]
+        share = s["wall_time"] / report["elapsed"] if report["elapsed"] else 0.0
+        logging.info(
+            f"{name}: {s['calls']} call(s), {s['wall_time']:.2f}s ({share:.0%}), {s['tiles']} tiles, "
+            f"peak RSS {s['max_peak_rss'] / 2**20:.0f} MB"
+        )
+    if report["files"]:
+        f = report["files"][0]
+        shared = ", shared with other threads" if f["shared_peak_rss"] else ""
+        logging.info(f"Highest peak RSS: {f['peak_rss'] / 2**20:.0f} MB, {f['file']} ({f['peak_stage']}{shared}).")
+
+
+def is_safe_done(input_paths, output_safe, run_info, container=None):
+    """
+    Check whether the products of all the subswaths of a SAFE are up to date, in its output SAFE or in its container.
+
+    input_paths: paths of the input subswath files of the SAFE
+    output_safe: path of the output SAFE
+    run_info: see sarwaveifrproc.manifest.get_run_info
+    container: "day" or "orbit" if the products are appended to containers, see main
+    """
+    if container is not None:
+        return containers.is_safe_done(input_paths, output_safe, run_info, container)
+    return manifest.is_safe_done(input_paths, output_safe, run_info)
+
+
+def get_fused_groups(predicted_variables):
+    """
+    Groups of models that can be fused: the models used by each group of the product.
+
+    predicted_variables: model outputs and associated variables name to add to the L2 product
+    """
+    groups = []
+    for group in [predicted_variables.intraburst, predicted_variables.interburst]:
+        names = list(dict.fromkeys(v.model for v in group.values()))
+        if names not in groups:
+            groups.append(names)
+    return groups
+
+
+def share_threads(models, concurrent_sessions):
+    """
+    Share the CPUs between sessions run at the same time: the models left with the onnx runtime default
+    intra_op_num_threads, which uses all the CPUs, get an equal share of them instead.
+
+    models: onnx models and output
+    concurrent_sessions: number of sessions run at the same time
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    threads = max(1, cpus // concurrent_sessions)
+    return {k: d if d.intra_op_num_threads else replace(d, intra_op_num_threads=threads) for k, d in models.items()}
+
+
+def check_product_version(input_safe, supported_input_product_versions):
+    """
+    Warn if the version of the input SAFE is not explicitly supported by the models.
+
+    input_safe: l1b or l1c safe path
+    supported_input_product_versions: list of product versions the model exlicitely supports
+    """
+    name = Path(input_safe).name
+    m = re.match(utils.VERS_SAFE_PATTERN, name)
+    if m is None or m.groupdict().get('version') not in supported_input_product_versions:
+        logging.warning(f'Unsupported product version for SAFE {name}')
+
 
 def setup_logging(verbose=False):
     fmt = "%(asctime)s %(levelname)s %(filename)s(%(lineno)d) %(message)s"
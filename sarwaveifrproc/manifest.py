@@ -0,0 +1,230 @@
+import glob
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+# Suffixes of the products written in the output SAFEs, see sarwaveifrproc.utils.write_product.
+PRODUCT_SUFFIXES = (".nc", ".zarr")
+
+
+def get_run_info(
+    product_id, models, predicted_variables, mask_invalid_tiles=False, read_pols=None
+):
+    """
+    Description of what determines the products of a run, recorded in the manifests.
+
+    The processing options are only recorded when they are set, so that the runs without them keep the run info,
+    and manifests, of the previous versions.
+
+    Parameters:
+    - product_id (str): Identifier for the output product.
+    - models (dict[str, Model]): onnx models and outputs
+    - predicted_variables (PredictedVariables): model outputs and associated variables name to add to the L2 product
+    - mask_invalid_tiles (bool): whether the predictions of the tiles on land or with invalid inputs are set to NaN.
+    - read_pols (list[str]): polarisations read from the inputs, all of them if None.
+    Returns:
+    - run_info (dict): product id, hash of each model, model output of each predicted variable, and the processing
+      options that are set.
+    """
+    run_info = {
+        "product_id": product_id,
+        "models": {k: get_file_hash(m.path) for k, m in models.items()},
+        "predicted_variables": {
+            group: {
+                v: [p.model, p.output]
+                for v, p in getattr(predicted_variables, group).items()
+            }
+            for group in ["intraburst", "interburst"]
+        },
+    }
+    if mask_invalid_tiles:
+        run_info.update(mask_invalid_tiles=True)
+    if read_pols:
+        run_info.update(read_pols=list(read_pols))
+    return run_info
+
+
+def get_file_hash(path):
+    """
+    SHA-256 of a file.
+
+    Parameters:
+    - path (str): path of the file
+    Returns:
+    - digest (str): hexadecimal digest
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_fingerprint(path, previous=None):
+    """
+    Fingerprint of an input file: size, modification time and checksum.
+
+    The checksum is only computed again if the size or the modification time changed since `previous`.
+
+    Parameters:
+    - path (str): path of the file
+    - previous (dict): previous fingerprint of the file, if any
+    Returns:
+    - fingerprint (dict): size, mtime_ns and sha256 of the file
+    """
+    st = os.stat(path)
+    if (
+        previous is not None
+        and previous["size"] == st.st_size
+        and previous["mtime_ns"] == st.st_mtime_ns
+    ):
+        return previous
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": get_file_hash(path),
+    }
+
+
+def get_manifest_path(output_safe):
+    return os.path.join(output_safe, MANIFEST_NAME)
+
+
+def load_manifest(output_safe):
+    """
+    Load the manifest of an output SAFE.
+
+    Parameters:
+    - output_safe (str): output SAFE directory
+    Returns:
+    - manifest (dict): run info and completed subswaths, None if there is no valid manifest.
+    """
+    try:
+        with open(get_manifest_path(output_safe)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(output_safe, manifest):
+    """
+    Save the manifest of an output SAFE, atomically.
+
+    Parameters:
+    - output_safe (str): output SAFE directory
+    - manifest (dict): run info and completed subswaths
+    """
+    path = get_manifest_path(output_safe)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def remove_manifest(output_safe):
+    """
+    Remove the manifest of an output SAFE, so that all its subswaths are processed again.
+
+    Parameters:
+    - output_safe (str): output SAFE directory
+    """
+    try:
+        os.remove(get_manifest_path(output_safe))
+    except FileNotFoundError:
+        pass
+
+
+def init_manifest(output_safe, run_info):
+    """
+    Create the manifest of an output SAFE before its first product is written, if needed.
+
+    This tells a partially written SAFE apart from a SAFE written before the manifests were introduced.
+
+    Parameters:
+    - output_safe (str): output SAFE directory
+    - run_info (dict): see `get_run_info`
+    """
+    manifest = load_manifest(output_safe)
+    if manifest is None or manifest["run"] != run_info:
+        save_manifest(
+            output_safe, {"version": MANIFEST_VERSION, "run": run_info, "subswaths": {}}
+        )
+
+
+def record_subswath(output_safe, input_path, output_path, run_info):
+    """
+    Record a completed subswath in the manifest of its output SAFE.
+
+    The subswaths recorded by a run with a different run info are forgotten.
+
+    Parameters:
+    - output_safe (str): output SAFE directory
+    - input_path (str): path of the input subswath file
+    - output_path (str): path of the written product
+    - run_info (dict): see `get_run_info`
+    """
+    manifest = load_manifest(output_safe)
+    if manifest is None or manifest["run"] != run_info:
+        manifest = {"version": MANIFEST_VERSION, "run": run_info, "subswaths": {}}
+    manifest["subswaths"][os.path.basename(input_path)] = {
+        "input": get_fingerprint(input_path),
+        "output": os.path.basename(output_path),
+    }
+    save_manifest(output_safe, manifest)
+
+
+def is_subswath_done(manifest, input_path, output_safe, run_info):
+    """
+    Check whether the product of a subswath is up to date.
+
+    Parameters:
+    - manifest (dict): manifest of the output SAFE, see `load_manifest`
+    - input_path (str): path of the input subswath file
+    - output_safe (str): output SAFE directory
+    - run_info (dict): see `get_run_info`
+    Returns:
+    - done (bool): True if the subswath was processed by a run with the same run info, its product exists and
+      its input did not change since.
+    """
+    if manifest is None or manifest["run"] != run_info:
+        return False
+    entry = manifest["subswaths"].get(os.path.basename(input_path))
+    if entry is None or not os.path.exists(os.path.join(output_safe, entry["output"])):
+        return False
+    return (
+        get_fingerprint(input_path, entry["input"])["sha256"]
+        == entry["input"]["sha256"]
+    )
+
+
+def is_safe_done(input_paths, output_safe, run_info):
+    """
+    Check whether the products of all the subswaths of a SAFE are up to date.
+
+    Output SAFEs written before the manifests were introduced are considered done if they contain products, NetCDF
+    files or Zarr stores, see `PRODUCT_SUFFIXES`. The products appended to containers are checked by
+    sarwaveifrproc.containers.is_safe_done instead.
+
+    Parameters:
+    - input_paths (list): paths of the input subswath files of the SAFE
+    - output_safe (str): output SAFE directory
+    - run_info (dict): see `get_run_info`
+    Returns:
+    - done (bool): True if no subswath of the SAFE needs to be processed.
+    """
+    if not os.path.isdir(output_safe):
+        return False
+    manifest = load_manifest(output_safe)
+    if manifest is None and not os.path.exists(get_manifest_path(output_safe)):
+        return any(
+            glob.glob(os.path.join(output_safe, f"*{suffix}"))
+            for suffix in PRODUCT_SUFFIXES
+        )
+    return all(
+        is_subswath_done(manifest, path, output_safe, run_info) for path in input_paths
+    )
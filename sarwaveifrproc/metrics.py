@@ -0,0 +1,303 @@
+import contextlib
+import contextvars
+import csv
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ["open", "land_check", "stack", "inference", "format", "write"]
+COUNTS = ["tiles", "bytes_read", "bytes_written", "array_bytes"]
+FIELDS = [
+    "stage",
+    "model",
+    "calls",
+    "wall_time",
+    "max_wall_time",
+    *COUNTS,
+    "max_peak_rss",
+    "tiles_per_second",
+]
+
+# Records of the current process, collected only once `enable` is called, and stages being recorded, by thread.
+_state = {"enabled": False, "records": [], "active": []}
+_lock = threading.Lock()
+# Subswath file whose stages are being recorded, see `subswath`.
+_file = contextvars.ContextVar("file", default=None)
+
+
+def enable(enabled=True):
+    """
+    Start or stop collecting the stage records of the current process.
+
+    Parameters:
+    - enabled (bool): collect the records if True.
+    """
+    _state["enabled"] = enabled
+
+
+def is_enabled():
+    return _state["enabled"]
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the current process, where supported (Linux), see `get_peak_rss`.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss():
+    """
+    Peak resident set size of the current process since the last `reset_peak_rss`, or since its start where the
+    peak cannot be reset.
+
+    Returns:
+    - peak_rss (int): peak resident set size, in bytes. 0 if unknown.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextlib.contextmanager
+def subswath(path):
+    """
+    Attribute the stages recorded in the block, in the current thread, to a subswath file.
+
+    Parameters:
+    - path (str): path of the subswath file.
+    """
+    token = _file.set(os.path.basename(path))
+    try:
+        yield
+    finally:
+        _file.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name, **counts):
+    """
+    Time a processing stage and record it with its counts, if the collection is enabled.
+
+    The block can add counts to the yielded record, e.g. the number of tiles once it is known. The record also
+    gets the peak resident set size of the process during the stage, and the subswath file being processed, see
+    `subswath`. The peak is reset only when no other stage is being recorded, so that the stages run at the same
+    time by several threads (prefetch, concurrent groups) do not reset each other's peaks: their records are marked
+    with `shared_peak_rss`, as their peak is the peak of the process over all of them.
+
+    Parameters:
+    - name (str): stage name, one of STAGES.
+    - counts: tiles, bytes_read, bytes_written, array_bytes (size of the main arrays allocated by the stage), or
+      model for the inference stage.
+    Yields:
+    - record (dict): record of the stage.
+    """
+    record = dict(stage=name, **counts)
+    if not _state["enabled"]:
+        yield record
+        return
+    if _file.get() is not None:
+        record["file"] = _file.get()
+    thread = threading.get_ident()
+    with _lock:
+        others = [r for t, r in _state["active"] if t != thread]
+        for r in others:
+            r["shared_peak_rss"] = True
+        if others:
+            record["shared_peak_rss"] = True
+        elif not _state["active"]:
+            reset_peak_rss()
+        _state["active"].append((thread, record))
+    try:
+        start = time.perf_counter()
+        yield record
+        record["wall_time"] = time.perf_counter() - start
+        record["peak_rss"] = get_peak_rss()
+    finally:
+        with _lock:
+            _state["active"] = [(t, r) for t, r in _state["active"] if r is not record]
+    with _lock:
+        _state["records"].append(record)
+
+
+def pop_records():
+    """
+    Get and forget the records collected so far by the current process.
+
+    Returns:
+    - records (list[dict]): stage records.
+    """
+    with _lock:
+        records, _state["records"] = _state["records"], []
+    return records
+
+
+def add_records(records):
+    """
+    Add records collected by another process, e.g. a worker.
+
+    Parameters:
+    - records (list[dict]): stage records.
+    """
+    with _lock:
+        _state["records"].extend(records)
+
+
+def aggregate(records):
+    """
+    Aggregate stage records by stage, and by model for the inference stage.
+
+    Parameters:
+    - records (list[dict]): stage records.
+    Returns:
+    - stages (list[dict]): number of calls, total and maximum wall time, counts, maximum peak resident set size
+      and tiles per second of each stage.
+    """
+    stages = {}
+    for r in records:
+        key = (r["stage"], r.get("model", ""))
+        s = stages.setdefault(
+            key,
+            dict(
+                stage=r["stage"],
+                model=r.get("model", ""),
+                calls=0,
+                wall_time=0.0,
+                max_wall_time=0.0,
+                **dict.fromkeys(COUNTS, 0),
+                max_peak_rss=0,
+            ),
+        )
+        s["calls"] += 1
+        s["wall_time"] += r["wall_time"]
+        s["max_wall_time"] = max(s["max_wall_time"], r["wall_time"])
+        s["max_peak_rss"] = max(s["max_peak_rss"], r.get("peak_rss", 0))
+        for c in COUNTS:
+            s[c] += r.get(c, 0)
+    for s in stages.values():
+        s["tiles_per_second"] = s["tiles"] / s["wall_time"] if s["wall_time"] else 0.0
+    order = {name: i for i, name in enumerate(STAGES)}
+    return sorted(
+        stages.values(), key=lambda s: (order.get(s["stage"], len(order)), s["model"])
+    )
+
+
+def aggregate_files(records):
+    """
+    Aggregate stage records by subswath file, see `subswath`. Records without a file are left out.
+
+    Parameters:
+    - records (list[dict]): stage records.
+    Returns:
+    - files (list[dict]): wall time, tiles, bytes read and written and size of the main arrays allocated by the
+      stages of each file, with the peak resident set size of the process, the stage that reached it and whether
+      it is shared with stages run at the same time by other threads, see `stage`. The files with the highest peak
+      come first.
+    """
+    files = {}
+    for r in records:
+        if "file" not in r:
+            continue
+        f = files.setdefault(
+            r["file"],
+            dict(
+                file=r["file"],
+                wall_time=0.0,
+                **dict.fromkeys(COUNTS, 0),
+                peak_rss=0,
+                peak_stage="",
+                shared_peak_rss=False,
+            ),
+        )
+        f["wall_time"] += r["wall_time"]
+        for c in COUNTS:
+            # the tiles of a file are counted once, when it is opened
+            if c != "tiles" or r["stage"] == "open":
+                f[c] += r.get(c, 0)
+        if r.get("peak_rss", 0) > f["peak_rss"]:
+            f["peak_rss"] = r["peak_rss"]
+            f["peak_stage"] = r["stage"]
+            f["shared_peak_rss"] = r.get("shared_peak_rss", False)
+    return sorted(files.values(), key=lambda f: (-f["peak_rss"], f["file"]))
+
+
+def get_report(records, elapsed, **info):
+    """
+    Build the report of a run.
+
+    Parameters:
+    - records (list[dict]): stage records of the run.
+    - elapsed (float): wall time of the run, in seconds.
+    - info: other fields of the report, e.g. the number of SAFEs.
+    Returns:
+    - report (dict): totals of the run, aggregated stages, and aggregated subswath files (JSON report only).
+    """
+    stages = aggregate(records)
+    opened = [s for s in stages if s["stage"] == "open"]
+    tiles = sum(s["tiles"] for s in opened)
+    return dict(
+        info,
+        elapsed=elapsed,
+        subswaths=sum(s["calls"] for s in opened),
+        tiles=tiles,
+        tiles_per_second=tiles / elapsed if elapsed else 0.0,
+        bytes_read=sum(s["bytes_read"] for s in stages),
+        bytes_written=sum(s["bytes_written"] for s in stages),
+        max_peak_rss=max((s["max_peak_rss"] for s in stages), default=0),
+        stages=stages,
+        files=aggregate_files(records),
+    )
+
+
+def check_report_path(path):
+    """
+    Check the format of a report from its extension, e.g. before a run rather than once it is over.
+
+    Parameters:
+    - path (str): path of the report.
+    Returns:
+    - ext (str): ".json" or ".csv".
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".json", ".csv"):
+        raise ValueError(
+            f"Unknown metrics report format {ext!r}, expected '.json' or '.csv'."
+        )
+    return ext
+
+
+def write_report(path, report):
+    """
+    Write the report of a run, as JSON or as CSV (one row per aggregated stage) according to its extension.
+
+    Parameters:
+    - path (str): path of the .json or .csv report.
+    - report (dict): see `get_report`.
+    """
+    ext = check_report_path(path)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="") as f:
+        if ext == ".json":
+            json.dump(report, f, indent=1)
+        else:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(report["stages"])
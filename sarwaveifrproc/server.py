@@ -0,0 +1,475 @@
+import collections
+import logging
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+import traceback
+import weakref
+from multiprocessing import connection, resource_tracker, shared_memory
+
+import numpy as np
+
+from sarwaveifrproc.manifest import get_file_hash
+
+NodeArg = collections.namedtuple("NodeArg", ["name", "shape", "type"])
+
+DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(double)": np.float64,
+    "tensor(float16)": np.float16,
+}
+
+
+def load_sessions(models, inference_server=None, **sessions_kwargs):
+    """
+    Create the inference sessions of the models, or connect to the inference server holding them.
+
+    Parameters:
+    - models (dict[str, Model]): onnx models, outputs and session options
+    - inference_server (str): path of the Unix socket of an inference server, see `serve`.
+      The sessions are created in the current process if None.
+    - sessions_kwargs: options of sarwaveifrproc.sessions.create_sessions, only used without server.
+    Returns:
+    - ort_mods (dict[str, onnxruntime.InferenceSession or RemoteSession]): inference session of each model.
+    - mod_outs (dict[str, list]): names of the outputs of each model
+    """
+    if inference_server is None:
+        from sarwaveifrproc import sessions
+
+        return sessions.create_sessions(models, **sessions_kwargs)
+    return connect(inference_server, models)
+
+
+def get_session_info(ort_mods, mod_outs, model_hashes):
+    """
+    Description of the sessions of a server, sent to each client when it connects.
+
+    Parameters:
+    - ort_mods (dict[str, onnxruntime.InferenceSession]): inference session of each model, fused models sharing one.
+    - mod_outs (dict[str, list]): names of the outputs of each model
+    - model_hashes (dict[str, str]): SHA-256 of the onnx file of each model
+    Returns:
+    - info (dict): key of the session, inputs, outputs, output columns of the fused models, output names and hash
+      of each model.
+    """
+    info = {}
+    for k, session in ort_mods.items():
+        info[k] = dict(
+            session=id(session),
+            inputs=[NodeArg(i.name, i.shape, i.type) for i in session.get_inputs()],
+            outputs=[NodeArg(o.name, o.shape, o.type) for o in session.get_outputs()],
+            columns=getattr(session, "columns", None),
+            model_outputs=list(mod_outs[k]),
+            hash=model_hashes.get(k),
+        )
+    return info
+
+
+def get_layout(n_rows, n_features, outputs):
+    """
+    Layout of a request in shared memory: the float32 input matrix, followed by each output.
+
+    Parameters:
+    - n_rows (int): number of rows (tiles) of the input matrix.
+    - n_features (int): number of columns of the input matrix.
+    - outputs (list[NodeArg]): outputs of the session.
+    Returns:
+    - size (int): number of bytes of the request.
+    - outputs (list[tuple]): offset, shape and dtype of each output.
+    """
+    offset = n_rows * n_features * np.dtype(np.float32).itemsize
+    layout = []
+    for o in outputs:
+        offset = -(-offset // 8) * 8  # 8-byte aligned
+        dtype = np.dtype(DTYPES[o.type])
+        shape = (n_rows, *o.shape[1:])
+        layout.append((offset, shape, dtype))
+        offset += int(np.prod(shape)) * dtype.itemsize
+    return offset, layout
+
+
+def attach(name):
+    """
+    Attach a shared memory segment created by a client.
+
+    The segment belongs to the client: it is not tracked by the server, which would otherwise remove it at exit.
+
+    Parameters:
+    - name (str): name of the segment.
+    Returns:
+    - shm (multiprocessing.shared_memory.SharedMemory): attached segment.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class InferenceServer:
+    """
+    Inference sessions shared by the processing jobs of a node, served on a Unix socket.
+
+    The clients write their input matrices in shared memory and send the name of the segment on the socket. The
+    requests for the same session arriving within `batch_window` seconds, from any client, are run in a single call,
+    and the predictions are written back in the segment of each request.
+    """
+
+    def __init__(
+        self, ort_mods, mod_outs, socket_path, batch_window=0.002, model_hashes=None
+    ):
+        """
+        Parameters:
+        - ort_mods (dict[str, onnxruntime.InferenceSession]): inference session of each model
+        - mod_outs (dict[str, list]): names of the outputs of each model
+        - socket_path (str): path of the Unix socket, replaced if it exists.
+        - batch_window (float): seconds to wait for other requests before running a session.
+        - model_hashes (dict[str, str]): SHA-256 of the onnx file of each model, checked by the clients.
+        """
+        self.sessions = {id(s): s for s in ort_mods.values()}
+        self.names = {}
+        for k, session in ort_mods.items():
+            self.names.setdefault(id(session), []).append(k)
+        self.info = get_session_info(ort_mods, mod_outs, model_hashes or {})
+        self.socket_path = socket_path
+        self.batch_window = batch_window
+        self.requests = queue.Queue()
+        # no request is queued once the server is stopped, see `cancel_requests`
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def serve(self, stop=None):
+        """
+        Answer the requests of the clients until `stop` is set.
+
+        Parameters:
+        - stop (threading.Event): event stopping the server.
+        """
+        stop = stop or threading.Event()
+        # the socket appears at its path once it accepts connections
+        tmp_path = f"{self.socket_path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(tmp_path)
+        listener.listen()
+        listener.settimeout(0.1)
+        os.replace(tmp_path, self.socket_path)
+        batcher = threading.Thread(target=self.run_batches, args=(stop,), daemon=True)
+        batcher.start()
+        logging.info(f"Serving {len(self.info)} models on {self.socket_path}.")
+        try:
+            while not stop.is_set():
+                try:
+                    sock, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                sock.setblocking(True)
+                conn = connection.Connection(sock.detach())
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            os.remove(self.socket_path)
+            batcher.join()
+            self.cancel_requests()
+        logging.info(f"Stopped serving on {self.socket_path}.")
+
+    def cancel_requests(self):
+        """
+        Answer the requests left in the queue, and the next ones, with an error once the batches are stopped, so
+        that their clients do not wait forever.
+        """
+        with self.lock:
+            self.stopped = True
+            while True:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                request["error"] = "The inference server was stopped."
+                request["done"].set()
+
+    def handle(self, conn):
+        """
+        Answer the requests of a client, one at a time, until it disconnects.
+
+        Parameters:
+        - conn (multiprocessing.connection.Connection): connection to the client.
+        """
+        segments = {}
+        try:
+            conn.send(self.info)
+            while True:
+                key, name, n_rows, n_features = conn.recv()
+                if name not in segments:
+                    for shm in segments.values():  # the client replaced its segment
+                        shm.close()
+                    segments = {name: attach(name)}
+                buf = segments[name].buf
+                outputs = self.sessions[key].get_outputs()
+                request = dict(
+                    key=key,
+                    X=np.ndarray((n_rows, n_features), np.float32, buffer=buf),
+                    out=[
+                        np.ndarray(shape, dtype, buffer=buf, offset=offset)
+                        for offset, shape, dtype in get_layout(
+                            n_rows, n_features, outputs
+                        )[1]
+                    ],
+                    done=threading.Event(),
+                    error=None,
+                )
+                with self.lock:
+                    if self.stopped:
+                        request.update(error="The inference server was stopped.")
+                        request["done"].set()
+                    else:
+                        self.requests.put(request)
+                request["done"].wait()
+                error = request["error"]
+                # release the views of the segment, so that it can be closed
+                request.clear()
+                conn.send(error)
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            for shm in segments.values():
+                shm.close()
+
+    def run_batches(self, stop):
+        """
+        Gather the requests arriving within the batch window, and run each session once on them.
+
+        Parameters:
+        - stop (threading.Event): event stopping the batches.
+        """
+        while not stop.is_set():
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_window
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            by_session = {}
+            for request in batch:
+                by_session.setdefault(request["key"], []).append(request)
+            for key, requests in by_session.items():
+                self.run_requests(key, requests)
+                for r in requests:
+                    r["done"].set()
+
+    def run_requests(self, key, requests):
+        """
+        Run a session on the concatenated inputs of several requests, and scatter the outputs.
+
+        Parameters:
+        - key (int): key of the session to run.
+        - requests (list[dict]): requests, whose outputs, or error, are written.
+        """
+        session = self.sessions[key]
+        start_time = time.perf_counter()
+        try:
+            X = (
+                requests[0]["X"]
+                if len(requests) == 1
+                else np.concatenate([r["X"] for r in requests])
+            )
+            res = session.run(None, {session.get_inputs()[0].name: X})
+            start = 0
+            for r in requests:
+                stop = start + len(r["X"])
+                for out, values in zip(r["out"], res):
+                    out[...] = values[start:stop]
+                start = stop
+        except Exception:
+            error = traceback.format_exc()
+            for r in requests:
+                r["error"] = error
+            return
+        logging.debug(
+            f"{'+'.join(self.names[key])}: {start} tiles of {len(requests)} request(s) "
+            f"in {time.perf_counter() - start_time:.3f}s."
+        )
+
+
+def serve(
+    ort_mods, mod_outs, socket_path, batch_window=0.002, model_hashes=None, stop=None
+):
+    """
+    Serve inference sessions on a Unix socket, until `stop` is set or SIGTERM or SIGINT is received.
+
+    Parameters:
+    - ort_mods (dict[str, onnxruntime.InferenceSession]): inference session of each model
+    - mod_outs (dict[str, list]): names of the outputs of each model
+    - socket_path (str): path of the Unix socket.
+    - batch_window (float): seconds to wait for other requests before running a session.
+    - model_hashes (dict[str, str]): SHA-256 of the onnx file of each model, checked by the clients.
+    - stop (threading.Event): event stopping the server.
+    """
+    stop = stop or threading.Event()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            handlers[sig] = signal.signal(sig, lambda signum, frame: stop.set())
+    try:
+        InferenceServer(
+            ort_mods, mod_outs, socket_path, batch_window, model_hashes
+        ).serve(stop)
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+
+
+class InferenceClient:
+    """
+    Connection of a process to an inference server, with the shared memory segment of its requests.
+
+    The segment is reused by the requests, and grown when needed. The requests of the threads of a process are
+    sent one at a time.
+    """
+
+    def __init__(self, socket_path):
+        """
+        Parameters:
+        - socket_path (str): path of the Unix socket of the server.
+        """
+        self.conn = connection.Client(socket_path, family="AF_UNIX")
+        self.info = self.conn.recv()
+        self.lock = threading.Lock()
+        self.shm = None
+        self.finalizer = None
+
+    def get_segment(self, size):
+        """
+        Get a shared memory segment of at least `size` bytes.
+
+        Parameters:
+        - size (int): number of bytes needed.
+        Returns:
+        - shm (multiprocessing.shared_memory.SharedMemory): segment of the requests.
+        """
+        if self.shm is None or self.shm.size < size:
+            if self.finalizer is not None:
+                self.finalizer()
+            old_size = self.shm.size if self.shm is not None else 0
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=max(size, 2 * old_size, 1)
+            )
+            self.finalizer = weakref.finalize(self, release, self.shm)
+        return self.shm
+
+    def run(self, key, X, outputs):
+        """
+        Run a session of the server.
+
+        Parameters:
+        - key (int): key of the session.
+        - X (np.ndarray): float32 input matrix.
+        - outputs (list[NodeArg]): outputs of the session.
+        Returns:
+        - res (list[np.ndarray]): value of each output.
+        """
+        n_rows, n_features = X.shape
+        size, layout = get_layout(n_rows, n_features, outputs)
+        with self.lock:
+            shm = self.get_segment(size)
+            np.ndarray(X.shape, np.float32, buffer=shm.buf)[...] = X
+            self.conn.send((key, shm.name, n_rows, n_features))
+            error = self.conn.recv()
+            if error is not None:
+                raise RuntimeError(f"The inference server failed:\n{error}")
+            return [
+                np.ndarray(shape, dtype, buffer=shm.buf, offset=offset).copy()
+                for offset, shape, dtype in layout
+            ]
+
+    def close(self):
+        self.conn.close()
+        if self.finalizer is not None:
+            self.finalizer()
+
+
+def release(shm):
+    shm.close()
+    shm.unlink()
+
+
+class RemoteSession:
+    """
+    Inference session held by an inference server, behaving like the onnxruntime.InferenceSession (or FusedSession,
+    with its `columns`) it stands for.
+    """
+
+    def __init__(self, client, key, inputs, outputs, columns=None):
+        """
+        Parameters:
+        - client (InferenceClient): connection to the server.
+        - key (int): key of the session in the server.
+        - inputs (list[NodeArg]): inputs of the session.
+        - outputs (list[NodeArg]): outputs of the session.
+        - columns (dict[str, int]): number of output columns of each fused model, None if the session is not fused.
+        """
+        self.client = client
+        self.key = key
+        self.inputs = inputs
+        self.outputs = outputs
+        if columns is not None:
+            self.columns = columns
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_outputs(self):
+        return self.outputs
+
+    def run(self, output_names, input_feed):
+        (X,) = input_feed.values()
+        return self.client.run(
+            self.key, np.ascontiguousarray(X, np.float32), self.outputs
+        )
+
+
+def connect(socket_path, models):
+    """
+    Connect to an inference server holding the sessions of the models.
+
+    Parameters:
+    - socket_path (str): path of the Unix socket of the server.
+    - models (dict[str, Model]): onnx models and outputs, which the server should hold.
+    Returns:
+    - ort_mods (dict[str, RemoteSession]): session of each model, fused models sharing one.
+    - mod_outs (dict[str, list]): names of the outputs of each model
+    """
+    client = InferenceClient(socket_path)
+    remote = {}
+    for k, d in models.items():
+        info = client.info.get(k)
+        if (
+            info is None
+            or info["hash"] != get_file_hash(d.path)
+            or info["model_outputs"] != list(d.outputs)
+        ):
+            client.close()
+            raise ValueError(
+                f"The inference server on {socket_path} does not hold the model {k} ({d.path})."
+            )
+        if info["session"] not in remote:
+            remote[info["session"]] = RemoteSession(
+                client,
+                info["session"],
+                info["inputs"],
+                info["outputs"],
+                info["columns"],
+            )
+    ort_mods = {k: remote[client.info[k]["session"]] for k in models}
+    mod_outs = {k: list(d.outputs) for k, d in models.items()}
+    return ort_mods, mod_outs
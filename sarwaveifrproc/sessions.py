@@ -0,0 +1,282 @@
+import dataclasses
+import hashlib
+import logging
+import os
+
+import onnxruntime
+
+from sarwaveifrproc.manifest import get_file_hash
+
+EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+# Highest optimization level of the cached graphs. The "all" level adds layout optimizations specific to the
+# hardware the graph is optimized on, so they are applied when a cached graph is loaded instead.
+CACHED_OPTIMIZATION_LEVEL = "extended"
+
+
+class FusedSession:
+    """
+    Inference session of several models with identical inputs merged into a single graph.
+
+    It behaves like an onnxruntime.InferenceSession whose outputs are the outputs of each model, in order.
+    `columns` gives the number of output columns of each model, to split the predictions.
+    """
+
+    def __init__(self, session, columns):
+        """
+        Parameters:
+        - session (onnxruntime.InferenceSession): session of the fused graph
+        - columns (dict[str, int]): number of output columns of each fused model
+        """
+        self.session = session
+        self.columns = columns
+
+    def get_inputs(self):
+        return self.session.get_inputs()
+
+    def get_outputs(self):
+        return self.session.get_outputs()
+
+    def run(self, output_names, input_feed):
+        return self.session.run(output_names, input_feed)
+
+
+def create_sessions(models, cache_dir=None, fused_groups=()):
+    """
+    Create the onnx runtime inference sessions of the models.
+
+    Parameters:
+    - models (dict[str, Model]): onnx models, outputs and session options
+    - cache_dir (str): directory where the optimized models are cached. No cache if None.
+    - fused_groups (list[list[str]]): groups of models with identical inputs to merge into a single graph.
+    Returns:
+    - ort_mods (dict[str, onnxruntime.InferenceSession]): inference session of each model.
+        The models of a fused group share the same FusedSession.
+    - mod_outs (dict[str, list]): names of the outputs of each model
+    """
+    ort_mods = {}
+    for names in fused_groups:
+        names = [k for k in names if k not in ort_mods]
+        if len(names) > 1:
+            session = create_fused_session({k: models[k] for k in names}, cache_dir)
+            ort_mods.update({k: session for k in names})
+    ort_mods = {
+        k: ort_mods[k] if k in ort_mods else create_session(d, cache_dir)
+        for k, d in models.items()
+    }
+    mod_outs = {k: list(d.outputs) for k, d in models.items()}
+    return ort_mods, mod_outs
+
+
+def create_fused_session(models, cache_dir=None):
+    """
+    Create a single inference session for several models with identical inputs.
+
+    The session options of the first model are used. Requires the onnx package.
+
+    Parameters:
+    - models (dict[str, Model]): onnx models, outputs and session options
+    - cache_dir (str): directory where the fused and optimized models are cached. No cache if None.
+    Returns:
+    - session (FusedSession): session running all the models at once
+    """
+    first = next(iter(models.values()))
+    columns = {k: len(d.outputs) for k, d in models.items()}
+    if cache_dir is not None:
+        key = hashlib.sha256(
+            "".join(f"{k}:{get_model_hash(d.path)}" for k, d in models.items()).encode()
+        ).hexdigest()[:16]
+        fused_path = os.path.join(cache_dir, f"fused-{key}.onnx")
+        if not os.path.exists(fused_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{fused_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(fuse_models({k: d.path for k, d in models.items()}))
+            os.replace(tmp_path, fused_path)
+        return FusedSession(
+            create_session(dataclasses.replace(first, path=fused_path), cache_dir),
+            columns,
+        )
+
+    session = onnxruntime.InferenceSession(
+        fuse_models({k: d.path for k, d in models.items()}),
+        get_session_options(first),
+        providers=list(first.providers),
+    )
+    return FusedSession(session, columns)
+
+
+def fuse_models(paths):
+    """
+    Merge models with identical inputs into a single onnx graph.
+
+    The fused graph has the input of the models and the outputs of every model, in order,
+    prefixed by the model name.
+
+    Parameters:
+    - paths (dict[str, str]): path of the onnx file of each model
+    Returns:
+    - model (bytes): serialized fused onnx model
+    """
+    try:
+        import onnx
+        from onnx import compose
+    except ImportError as e:
+        raise ImportError(
+            "Fusing models requires the onnx package: pip install sarwaveifrproc[fuse]"
+        ) from e
+
+    graphs, nodes, initializers, outputs = [], [], [], []
+    for k, path in paths.items():
+        model = onnx.load(path)
+        if graphs and (
+            model.graph.input != graphs[0].graph.input
+            or model.opset_import != graphs[0].opset_import
+        ):
+            raise ValueError(
+                f"Model {k} does not have the same inputs as {list(paths)[0]}"
+            )
+        graphs.append(model)
+        shared_inputs = {f"{k}/{i.name}": i.name for i in model.graph.input}
+        model = compose.add_prefix(model, f"{k}/")
+        for node in model.graph.node:
+            for i, name in enumerate(node.input):
+                node.input[i] = shared_inputs.get(name, name)
+        nodes.extend(model.graph.node)
+        initializers.extend(model.graph.initializer)
+        outputs.extend(model.graph.output)
+
+    graph = onnx.helper.make_graph(
+        nodes, "fused", graphs[0].graph.input, outputs, initializer=initializers
+    )
+    fused = onnx.helper.make_model(
+        graph,
+        opset_imports=graphs[0].opset_import,
+        ir_version=max(m.ir_version for m in graphs),
+    )
+    onnx.checker.check_model(fused)
+    return fused.SerializeToString()
+
+
+def create_session(model, cache_dir=None):
+    """
+    Create the onnx runtime inference session of a model.
+
+    When `cache_dir` is set, the graph optimized by onnx runtime is saved there on the first run,
+    and loaded without further optimization on the next ones. The cached graphs are optimized up to the
+    "extended" level only, which does not depend on the hardware, so that a cache shared by nodes of different
+    CPUs stays valid: the layout optimizations of the "all" level are applied each time a cached graph is loaded.
+
+    Parameters:
+    - model (Model): onnx model, outputs and session options
+    - cache_dir (str): directory where the optimized models are cached. No cache if None.
+    Returns:
+    - session (onnxruntime.InferenceSession): inference session of the model
+    """
+    options = get_session_options(model)
+    providers = list(model.providers)
+    if cache_dir is None:
+        return onnxruntime.InferenceSession(model.path, options, providers=providers)
+
+    cached_path = get_cached_model_path(model, cache_dir)
+    cached_level = get_cached_optimization_level(model.graph_optimization_level)
+    if not os.path.exists(cached_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+        options.optimized_model_filepath = tmp_path
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[cached_level]
+        session = onnxruntime.InferenceSession(model.path, options, providers=providers)
+        os.replace(tmp_path, cached_path)
+        logging.debug(f"Optimized model saved in {cached_path}")
+        if cached_level == model.graph_optimization_level:
+            return session
+        options = get_session_options(model)
+
+    logging.debug(f"Loading optimized model {cached_path}")
+    if cached_level == model.graph_optimization_level:
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS["disable"]
+    return onnxruntime.InferenceSession(cached_path, options, providers=providers)
+
+
+def get_cached_optimization_level(level):
+    """
+    Optimization level of the cached graph of a model, capped at `CACHED_OPTIMIZATION_LEVEL`.
+
+    Parameters:
+    - level (str): graph optimization level of the model, see `GRAPH_OPTIMIZATION_LEVELS`.
+    Returns:
+    - level (str): graph optimization level of its cached graph.
+    """
+    levels = list(GRAPH_OPTIMIZATION_LEVELS)
+    return levels[min(levels.index(level), levels.index(CACHED_OPTIMIZATION_LEVEL))]
+
+
+def get_session_options(model):
+    """
+    Build the onnx runtime session options of a model.
+
+    Parameters:
+    - model (Model): onnx model, outputs and session options
+    Returns:
+    - options (onnxruntime.SessionOptions): session options
+    """
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = model.intra_op_num_threads
+    options.inter_op_num_threads = model.inter_op_num_threads
+    options.enable_cpu_mem_arena = model.enable_cpu_mem_arena
+    options.enable_mem_pattern = model.enable_mem_pattern
+    try:
+        options.execution_mode = EXECUTION_MODES[model.execution_mode]
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+            model.graph_optimization_level
+        ]
+    except KeyError as e:
+        raise ValueError(
+            f"Invalid session option {e} for model {model.path}. "
+            f"Execution modes: {list(EXECUTION_MODES)}, "
+            f"graph optimization levels: {list(GRAPH_OPTIMIZATION_LEVELS)}."
+        ) from None
+    return options
+
+
+def get_cached_model_path(model, cache_dir):
+    """
+    Path of the optimized version of a model in the cache.
+
+    The path depends on the content of the model, the onnx runtime version, the optimization level
+    of the cached graph and the execution providers, so that a stale optimized graph is never reused.
+    It does not depend on the hardware, see `create_session`.
+
+    Parameters:
+    - model (Model): onnx model, outputs and session options
+    - cache_dir (str): cache directory
+    Returns:
+    - path (str): path of the optimized model
+    """
+    key = hashlib.sha256(get_model_hash(model.path).encode())
+    key.update(onnxruntime.__version__.encode())
+    key.update(get_cached_optimization_level(model.graph_optimization_level).encode())
+    key.update(",".join(model.providers).encode())
+    name = os.path.splitext(os.path.basename(model.path))[0]
+    return os.path.join(cache_dir, f"{name}-{key.hexdigest()[:16]}.onnx")
+
+
+def get_model_hash(path):
+    """
+    SHA-256 of a model file.
+
+    Parameters:
+    - path (str): path of the onnx file
+    Returns:
+    - digest (str): hexadecimal digest
+    """
+    return get_file_hash(path)
@@ -3,14 +3,27 @@ import sarwaveifrproc
 # import datatree as dtt
 import xarray as xr
 import numpy as np
+import contextlib
 import glob
+import heapq
 import logging
+import netCDF4
+import queue
+import threading
 import yaml 
 import pickle
 import re
 import os
+import shutil
 from datetime import datetime
-from sarwaveifrproc.l2_wave import generate_l2_wave_product
+import sarwaveifrproc.containers as containers
+import sarwaveifrproc.incremental as incremental
+import sarwaveifrproc.manifest as manifest
+import sarwaveifrproc.metrics as metrics
+from sarwaveifrproc.l2_wave import generate_l2_wave_product, generate_l2_wave_product_blocks, generate_l2_wave_products, get_memory_estimate, get_tiles_dims, GROUPS, KEPT_VARIABLES, LAND_VARIABLES
+
+# netCDF4/HDF5 is not thread-safe and xarray only locks the array reads, so the pipeline stages serialize their file accesses.
+NETCDF_LOCK = threading.Lock()
 
 SAFE_PATTERN = (
             r'^(?P<mission_id>\w{3})_'
@@ -112,6 +125,64 @@ def get_output_filename(l1x_path, output_safe, tail='e00'):
     savepath = os.path.join(output_safe, final_filename)
     return savepath
 
+def get_safe_weight(input_safe, weight='bytes'):
+    """
+    Estimates the processing cost of a SAFE.
+
+    Parameters:
+        input_safe (str): Input safe path.
+        weight (str): 'bytes' for the size of the subswath files, 'tiles' for their number of tiles, 'count' for 1 per SAFE.
+    Returns:
+        int: estimated cost of the SAFE.
+    """
+    if weight == 'count':
+        return 1
+    paths = list_subswaths(input_safe)
+    if weight == 'bytes':
+        return sum(os.path.getsize(p) for p in paths)
+    if weight == 'tiles':
+        n_tiles = 0
+        for p in paths:
+            with netCDF4.Dataset(p) as nc:
+                for g in GROUPS:
+                    n_tiles += nc[g]['land_flag'].size
+        return n_tiles
+    raise ValueError(f"Unknown weight {weight}, expected one of 'bytes', 'tiles', 'count'.")
+
+
+def partition(weights, n):
+    """
+    Splits items into n groups of balanced total weight, using the longest-processing-time-first heuristic.
+
+    Parameters:
+        weights (list): weight of each item.
+        n (int): number of groups.
+    Returns:
+        list: n lists of item indices, each in increasing order. Every item is in exactly one group.
+    """
+    heap = [(0, i, []) for i in range(n)]
+    for index in sorted(range(len(weights)), key=lambda k: (-weights[k], k)):
+        load, i, items = heapq.heappop(heap)
+        items.append(index)
+        heapq.heappush(heap, (load + weights[index], i, items))
+    return [sorted(items) for _, _, items in sorted(heap, key=lambda h: h[1])]
+
+
+def partition_listing(files, n, weight='bytes'):
+    """
+    Splits a listing of SAFEs into n chunks of balanced processing cost.
+
+    Parameters:
+        files (list): Input safe paths.
+        n (int): number of chunks.
+        weight (str): cost estimate of a SAFE, see `get_safe_weight`.
+    Returns:
+        list: n lists of input safe paths.
+    """
+    weights = [get_safe_weight(f, weight) for f in files]
+    return [[files[k] for k in chunk] for chunk in partition(weights, n)]
+
+
 def load_config():
     """
 
@@ -173,10 +244,19 @@ def load_models(paths, predicted_variables):
     return model_intraburst, model_interburst, scaler_intraburst, scaler_interburst, bins_intraburst, bins_interburst
     
     
-def process_files(input_safe, output_safe, models, models_outputs, predicted_variables, product_id):
+def process_files(input_safe, output_safe, models, models_outputs, predicted_variables, product_id, product_kwargs={}, reader_kwargs={}, writer_kwargs={}, block_size_mb=None, memory_budget_mb=None, incremental_from=None):
     """
     Processes files in the input directory, generates predictions, and saves results in the output directory.
 
+    With a memory budget, the subswaths estimated to need more memory than the budget are processed by blocks
+    that fit in it, or, when their products cannot be written by blocks, deferred: they are left unprocessed,
+    and not recorded in the manifest, so that a later run processes them, e.g. with fewer workers per node.
+    The subswaths running out of memory are deferred too.
+
+    In incremental mode, the groups of the products of a previous product id whose models and predicted variables did
+    not change are reused instead of being generated again, see sarwaveifrproc.incremental. The products whose groups
+    are all reused are linked to the previous ones, without reading their input.
+
     Parameters:
         input_safe (str): Input safe path.
         output_safe (str): Path to the directory where output data will be saved.
@@ -184,22 +264,731 @@ def process_files(input_safe, output_safe, models, models_outputs, predicted_var
         models_outputs (dict): dict of List of model outputs names
         predicted_variables (list): List of variable names to be predicted.
         product_id (str): Identifier for the output product.
+        product_kwargs (dict): options of sarwaveifrproc.l2_wave.generate_l2_wave_product
+        reader_kwargs (dict): options of open_subswath
+        writer_kwargs (dict): options of save_product
+        block_size_mb (float): if set, read, process and write each subswath by blocks of bursts of about this many MB,
+            see sarwaveifrproc.l2_wave.generate_l2_wave_product_blocks.
+        memory_budget_mb (float): if set, memory available to process a subswath, in MB, on top of the models,
+            see sarwaveifrproc.l2_wave.get_memory_estimate.
+        incremental_from (str): if set, product id of previous products of the SAFE, in the same save directory, to reuse.
+            Requires a run info in writer_kwargs.
 ort_mods, models, predicted_variables, product_id)
+    Returns:
+        list: paths of the deferred subswath files.
+    """
+    run_info = writer_kwargs.get('run_info')
+    deferred = []
+    for path, savepath in iter_subswaths([input_safe], [output_safe], product_id, run_info, writer_kwargs.get('container')):
+        with metrics.subswath(path):
+            reused_groups = {}
+            if incremental_from and run_info is not None:
+                previous_savepath = get_previous_savepath(path, input_safe, output_safe, incremental_from)
+                reused = incremental.get_previous_groups(path, previous_savepath, run_info) if os.path.exists(previous_savepath) else []
+                if len(reused) == len(GROUPS):
+                    link_previous_product(path, previous_savepath, savepath, run_info)
+                    logging.info(f'{path}: product of {incremental_from} reused.')
+                    continue
+                if reused:
+                    logging.info(f'{path}: {", ".join(reused)} of the product of {incremental_from} reused.')
+                    reused_groups = incremental.load_groups(previous_savepath, reused)
+            with metrics.stage('open', bytes_read=os.path.getsize(path)) as m:
+                groups = open_subswath(path, **get_land_reader_kwargs(path, reader_kwargs))
+                xdt = to_datatree(groups, path)
+                m.update(tiles=count_tiles(xdt), array_bytes=xdt.nbytes)
+            # the input file is closed once its product is written, so that long runs do not accumulate open files
+            try:
+                if block_size_mb:
+                    l2_product = generate_l2_wave_product_blocks(xdt, models, models_outputs, predicted_variables, block_size_mb, **product_kwargs)
+                elif memory_budget_mb and (needed_mb := get_memory_estimate(xdt)) > memory_budget_mb:
+                    message = f'{path}: about {needed_mb:.1f} MB needed, above the memory budget of {memory_budget_mb} MB'
+                    if not can_write_blocks(**writer_kwargs):
+                        logging.warning(f'{message}, deferred.')
+                        deferred.append(path)
+                        continue
+                    logging.warning(f'{message}, processed by blocks.')
+                    blocks_kwargs = {k: v for k, v in product_kwargs.items() if k != 'concurrent_groups'}
+                    l2_product = generate_l2_wave_product_blocks(xdt, models, models_outputs, predicted_variables, memory_budget_mb, **blocks_kwargs)
+                else:
+                    l2_product = generate_l2_wave_product(xdt, models, models_outputs, predicted_variables, reused_groups=reused_groups, **product_kwargs)
+                save_product(l2_product, path, savepath, predicted_variables, **writer_kwargs)
+            except MemoryError:
+                if not memory_budget_mb:
+                    raise
+                logging.warning(f'{path}: out of memory, deferred.')
+                deferred.append(path)
+            finally:
+                close_groups(groups)
+    if deferred:
+        logging.warning(f'{len(deferred)} subswath(s) of {input_safe} deferred to a later run.')
+    return deferred
+
+
+def get_previous_savepath(path, input_safe, output_safe, previous_product_id):
+    """
+    Path of the product of a subswath with a previous product id, in the same save directory.
+
+    Parameters:
+        path (str): path of the input subswath file.
+        input_safe (str): Input safe path.
+        output_safe (str): path of the output SAFE of the current product id, see get_output_safe.
+        previous_product_id (str): previous product id, e.g. E11.
+    Returns:
+        str: path of the previous product.
+    """
+    save_directory = os.path.dirname(os.path.dirname(os.path.dirname(output_safe.rstrip(os.sep))))
+    previous_output_safe = get_output_safe(input_safe, save_directory, previous_product_id)
+    return get_output_filename(path, previous_output_safe, previous_product_id)
+
+
+def link_previous_product(path, previous_savepath, savepath, run_info):
+    """
+    Gives a subswath the product of a previous product id, whose groups are all reused, and records it in the manifest.
+
+    Parameters:
+        path (str): path of the input subswath file.
+        previous_savepath (str): path of the previous product, see get_previous_savepath.
+        savepath (str): path of the product, in the output SAFE directory.
+        run_info (dict): run description recorded in the manifest, see sarwaveifrproc.manifest.get_run_info.
+    """
+    output_safe = os.path.dirname(savepath)
+    os.makedirs(output_safe, exist_ok=True)
+    manifest.init_manifest(output_safe, run_info)
+    with metrics.stage('write'), atomic_path(savepath) as tmp_path:
+        incremental.link_product(previous_savepath, tmp_path)
+    manifest.record_subswath(output_safe, path, savepath, run_info)
+
+
+def can_write_blocks(output_encoding=None, container=None, **writer_kwargs):
+    """
+    Checks whether products can be written by blocks with the options of save_product, see write_product_blocks.
+
+    Parameters:
+        output_encoding (OutputEncoding): output profile, see write_product.
+        container (str): container of the products, see save_product.
+        writer_kwargs: other options of save_product.
+    Returns:
+        bool: True for NetCDF products without int16 packed predictions, written in their output SAFE.
+    """
+    if container is not None:
+        return False
+    return output_encoding is None or (output_encoding.format == 'netcdf' and output_encoding.predictions_dtype != 'int16')
+
+
+def process_files_batched(input_safes, output_safes, models, models_outputs, predicted_variables, product_id, batch_size, product_kwargs={}, reader_kwargs={}, writer_kwargs={}):
+    """
+    Processes the files of several SAFEs, running the models on large batches of tiles gathered across subswaths and SAFEs.
+
+    Subswaths are opened until at least `batch_size` tiles are pending, then the inference is run once per model
+    on the gathered tiles and the corresponding products are saved.
+
+    Parameters:
+        input_safes (list): Input safe paths.
+        output_safes (list): Paths to the directories where output data will be saved, one per input safe.
+        models (dict): dict of onnx runtime inference sessions
+        models_outputs (dict): dict of List of model outputs names
+        predicted_variables (list): List of variable names to be predicted.
+        product_id (str): Identifier for the output product.
+        batch_size (int): Number of tiles per model call.
+        product_kwargs (dict): options of sarwaveifrproc.l2_wave.generate_l2_wave_products
+        reader_kwargs (dict): options of open_subswath
+        writer_kwargs (dict): options of save_product
     Returns:
         None
     """
-    subswath_filenames = glob.glob(os.path.join(input_safe, '*?v*.nc'))
-    logging.info(f'{len(subswath_filenames)} subswaths found in given safe.')
-    
-    for path in subswath_filenames:
-        xdt = xr.DataTree.from_dict(xr.open_groups(path))
-        l2_product = generate_l2_wave_product(xdt, models, models_outputs, predicted_variables)
+    pending, pending_tiles, opened = [], 0, []
+    run_info = writer_kwargs.get('run_info')
+    try:
+        for path, savepath in iter_subswaths(input_safes, output_safes, product_id, run_info, writer_kwargs.get('container')):
+            with metrics.subswath(path), metrics.stage('open', bytes_read=os.path.getsize(path)) as m:
+                opened.append(open_subswath(path, **get_land_reader_kwargs(path, reader_kwargs)))
+                xdt = to_datatree(opened[-1], path)
+                m.update(tiles=count_tiles(xdt), array_bytes=xdt.nbytes)
+            pending.append((xdt, savepath))
+            pending_tiles += m['tiles']
+            if pending_tiles >= batch_size:
+                _write_batch(pending, models, models_outputs, predicted_variables, batch_size, product_kwargs, writer_kwargs)
+                pending, pending_tiles = [], 0
+                while opened:
+                    close_groups(opened.pop())
+
+        if pending:
+            _write_batch(pending, models, models_outputs, predicted_variables, batch_size, product_kwargs, writer_kwargs)
+    finally:
+        for groups in opened:
+            close_groups(groups)
+
+
+def process_files_pipelined(input_safes, output_safes, models, models_outputs, predicted_variables, product_id, prefetch=2, product_kwargs={}, reader_kwargs={}, writer_kwargs={}):
+    """
+    Processes the files of several SAFEs, overlapping the reading, the inference and the writing.
+
+    A reader thread opens and decodes the next subswaths while the current one goes through the models,
+    and finished products are handed to a writer thread. Stages communicate through queues of `prefetch` items.
+
+    Parameters:
+        input_safes (list): Input safe paths.
+        output_safes (list): Paths to the directories where output data will be saved, one per input safe.
+        models (dict): dict of onnx runtime inference sessions
+        models_outputs (dict): dict of List of model outputs names
+        predicted_variables (list): List of variable names to be predicted.
+        product_id (str): Identifier for the output product.
+        prefetch (int): Maximum number of subswaths waiting between two stages.
+        product_kwargs (dict): options of sarwaveifrproc.l2_wave.generate_l2_wave_product
+        reader_kwargs (dict): options of open_subswath
+        writer_kwargs (dict): options of save_product
+    Returns:
+        None
+    """
+    done = object()
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    errors = []
+
+    def read():
+        try:
+            for path, savepath in iter_subswaths(input_safes, output_safes, product_id, writer_kwargs.get('run_info'), writer_kwargs.get('container')):
+                if errors:
+                    break
+                with NETCDF_LOCK, metrics.subswath(path), metrics.stage('open', bytes_read=os.path.getsize(path)) as m:
+                    xdt = load_subswath(path, **get_land_reader_kwargs(path, reader_kwargs))
+                    m.update(tiles=count_tiles(xdt), array_bytes=xdt.nbytes)
+                read_queue.put((xdt, savepath))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            read_queue.put(done)
+
+    def write():
+        while (item := write_queue.get()) is not done:
+            if errors:
+                continue
+            l2_product, path, savepath = item
+            try:
+                with NETCDF_LOCK, metrics.subswath(path):
+                    save_product(l2_product, path, savepath, predicted_variables, **writer_kwargs)
+            except Exception as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read, name='l2-reader', daemon=True)
+    writer = threading.Thread(target=write, name='l2-writer', daemon=True)
+    reader.start()
+    writer.start()
+    try:
+        while (item := read_queue.get()) is not done:
+            if errors:
+                continue
+            xdt, savepath = item
+            with metrics.subswath(xdt.encoding['source']):
+                l2_product = generate_l2_wave_product(xdt, models, models_outputs, predicted_variables, **product_kwargs)
+            write_queue.put((l2_product, xdt.encoding['source'], savepath))
+    except Exception as e:
+        errors.append(e)
+        while read_queue.get() is not done:
+            pass
+    finally:
+        write_queue.put(done)
+        reader.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _write_batch(pending, models, models_outputs, predicted_variables, batch_size, product_kwargs={}, writer_kwargs={}):
+    """
+    Generates and saves the products of a batch of subswaths.
+
+    Parameters:
+        pending (list): list of (DataTree, savepath) tuples.
+        models (dict): dict of onnx runtime inference sessions
+        models_outputs (dict): dict of List of model outputs names
+        predicted_variables (list): List of variable names to be predicted.
+        batch_size (int): Number of tiles per model call.
+        product_kwargs (dict): options of sarwaveifrproc.l2_wave.generate_l2_wave_products
+        writer_kwargs (dict): options of save_product
+    """
+    xdts, savepaths = zip(*pending)
+    logging.debug(f'Running inference on a batch of {len(xdts)} subswaths.')
+    l2_products = generate_l2_wave_products(xdts, models, models_outputs, predicted_variables, batch_size, **product_kwargs)
+    for xdt, l2_product, savepath in zip(xdts, l2_products, savepaths):
+        with metrics.subswath(xdt.encoding['source']):
+            save_product(l2_product, xdt.encoding['source'], savepath, predicted_variables, **writer_kwargs)
+
+
+def save_product(l2_product, path, savepath, predicted_variables, output_encoding=None, run_info=None, container=None):
+    """
+    Saves the product of a subswath and records it in the manifest of its output SAFE, or in the index of its container.
+
+    With a run info, each group of the product records what determines its predictions, see sarwaveifrproc.incremental.
+
+    Parameters:
+        l2_product (xr.DataTree or iterator): Level-2 wave product, or its blocks written by write_product_blocks.
+        path (str): path of the input subswath file.
+        savepath (str): path of the product, in the output SAFE directory.
+        predicted_variables (PredictedVariables): variables predicted in each group.
+        output_encoding (OutputEncoding): output profile, see write_product.
+        run_info (dict): run description recorded in the manifest, see sarwaveifrproc.manifest.get_run_info. No manifest is kept if None.
+        container (str): "day" or "orbit" to append the product to the container of its output SAFE instead, see sarwaveifrproc.containers.
+    """
+    output_safe = os.path.dirname(savepath)
+    if run_info is not None:
+        # what determines the predictions of each group, see sarwaveifrproc.incremental
+        if isinstance(l2_product, xr.DataTree):
+            for group in GROUPS:
+                incremental.set_group_info(l2_product[group], run_info, group)
+        else:
+            l2_product = ((g, ds if g == '/' else incremental.set_group_info(ds, run_info, g)) for g, ds in l2_product)
+    if container is not None:
+        if not isinstance(l2_product, xr.DataTree):
+            raise ValueError('Products written by blocks cannot be appended to a container.')
+        container_path = containers.get_container_path(output_safe, container)
+        encoding = None if output_encoding is None else get_product_encoding(l2_product, predicted_variables, output_encoding)
+        with metrics.stage('write', tiles=count_tiles(l2_product)) as m:
+            size = get_path_size(container_path) if os.path.exists(container_path) else 0
+            containers.write_product(l2_product, container_path, path, savepath, encoding, run_info)
+            m['bytes_written'] = get_path_size(container_path) - size
+        return
+    os.makedirs(output_safe, exist_ok=True)
+    if run_info is not None:
+        manifest.init_manifest(output_safe, run_info)
+    if isinstance(l2_product, xr.DataTree):
+        with metrics.stage('write', tiles=count_tiles(l2_product)) as m:
+            savepath = write_product(l2_product, savepath, predicted_variables, output_encoding)
+            m['bytes_written'] = get_path_size(savepath)
+    else:
+        savepath = write_product_blocks(l2_product, savepath, predicted_variables, output_encoding)
+    if run_info is not None:
+        manifest.record_subswath(output_safe, path, savepath, run_info)
+
+
+def write_product(l2_product, savepath, predicted_variables, output_encoding=None):
+    """
+    Writes a L2 product with the encoding of an output profile.
+
+    The product is written under a temporary name and renamed when complete, so that an interrupted
+    write never leaves a truncated product behind.
+
+    Parameters:
+        l2_product (xr.DataTree): Level-2 wave product.
+        savepath (str): path of the NetCDF file. Zarr stores get the .zarr extension instead.
+        predicted_variables (PredictedVariables): variables predicted in each group.
+        output_encoding (OutputEncoding): output profile, see sarwaveifrproc.main.OutputEncoding. Default NetCDF encoding if None.
+    Returns:
+        str: path of the written product.
+    """
+    if output_encoding is None:
+        with atomic_path(savepath) as tmp_path:
+            l2_product.to_netcdf(tmp_path)
+        return savepath
+
+    encoding = get_product_encoding(l2_product, predicted_variables, output_encoding)
+    if output_encoding.format == 'netcdf':
+        with atomic_path(savepath) as tmp_path:
+            l2_product.to_netcdf(tmp_path, encoding=encoding)
+    elif output_encoding.format == 'zarr':
+        try:
+            import zarr  # noqa: F401
+        except ImportError as e:
+            raise ImportError('Writing Zarr stores requires the zarr package: pip install sarwaveifrproc[zarr]') from e
+        savepath = os.path.splitext(savepath)[0] + '.zarr'
+        with atomic_path(savepath) as tmp_path:
+            l2_product.to_zarr(tmp_path, mode='w', encoding=encoding, consolidated=True)
+    else:
+        raise ValueError(f"Unknown output format {output_encoding.format!r}, expected 'netcdf' or 'zarr'.")
+    return savepath
+
+
+def write_product_blocks(blocks, savepath, predicted_variables, output_encoding=None):
+    """
+    Writes a L2 product block by block, so that only the current block is in memory.
+
+    The first block of each group creates the group, with its first tile dimension (burst) unlimited,
+    and the next blocks are appended along it. As with write_product, the product is written under
+    a temporary name and renamed when complete.
+
+    Parameters:
+        blocks (iterator): (group, dataset) pairs, see sarwaveifrproc.l2_wave.generate_l2_wave_product_blocks.
+        savepath (str): path of the NetCDF file.
+        predicted_variables (PredictedVariables): variables predicted in each group.
+        output_encoding (OutputEncoding): output profile, see sarwaveifrproc.main.OutputEncoding. Only NetCDF profiles
+            without int16 packing are supported, since the packing depends on the values of the whole product.
+    Returns:
+        str: path of the written product.
+    """
+    if output_encoding is not None and (output_encoding.format != 'netcdf' or output_encoding.predictions_dtype == 'int16'):
+        raise ValueError('Products written by blocks must be NetCDF files without int16 packed predictions.')
+
+    encodings = {}
+    m = None
+    with atomic_path(savepath) as tmp_path:
+        for group, ds in blocks:
+            if group == '/':
+                ds.to_netcdf(tmp_path)
+                continue
+            dim = get_tiles_dims(ds)[0]
+            with metrics.stage('write', tiles=ds['land_flag'].size) as m:
+                if group in encodings:
+                    append_block(tmp_path, group, ds, dim, encodings[group])
+                    continue
+                encoding = {} if output_encoding is None else get_dataset_encoding(ds, getattr(predicted_variables, group), output_encoding)
+                for v, var in ds.variables.items():
+                    # netCDF4 chunks unlimited dimensions by 1 by default
+                    if dim in var.dims and 'chunksizes' not in encoding.get(v, {}):
+                        encoding.setdefault(v, {})['chunksizes'] = var.shape
+                ds.to_netcdf(tmp_path, mode='a', group=group, encoding=encoding, unlimited_dims=[dim])
+                encodings[group] = encoding
+        if m is not None:
+            m['bytes_written'] = get_path_size(tmp_path)
+    return savepath
+
+
+def append_block(path, group, ds, dim, encoding):
+    """
+    Appends a block to the variables of a group of a NetCDF file, along an unlimited dimension.
+
+    The variables without this dimension are left as written with the first block.
+
+    Parameters:
+        path (str): path of the NetCDF file.
+        group (str): group of the block.
+        ds (xr.Dataset): block, with the variables of the first block of the group.
+        dim (str): unlimited dimension of the group.
+        encoding (dict): encoding of the variables of the first block.
+    """
+    with netCDF4.Dataset(path, 'a') as nc:
+        nc_group = nc[group]
+        start = len(nc_group.dimensions[dim])
+        for v, var in ds.variables.items():
+            if dim not in var.dims:
+                continue
+            var = var.copy(deep=False)
+            var.encoding = {**var.encoding, **encoding.get(v, {})}
+            values = xr.conventions.encode_cf_variable(var, name=v).values
+            nc_var = nc_group[v]
+            nc_var.set_auto_maskandscale(False)
+            index = tuple(slice(start, start + n) if d == dim else slice(None) for d, n in var.sizes.items())
+            nc_var[index] = values
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Provides a temporary path, next to `path`, that is renamed to `path` if the block succeeds and removed otherwise.
+
+    Parameters:
+        path (str): final path of a file or a directory (Zarr store).
+    Yields:
+        str: temporary path to write to.
+    """
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+    remove_path(tmp_path)
+    try:
+        yield tmp_path
+        if os.path.isdir(tmp_path):
+            # directories cannot be replaced atomically, the previous one is removed first
+            remove_path(path)
+        os.replace(tmp_path, path)
+    finally:
+        remove_path(tmp_path)
+
+
+def get_path_size(path):
+    """
+    Computes the size of a file or of the files of a directory (Zarr store).
+
+    Parameters:
+        path (str): path of a file or a directory.
+    Returns:
+        int: size in bytes.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def count_tiles(xdt):
+    """
+    Counts the tiles of the intraburst and interburst groups of a subswath or of a product.
+
+    Parameters:
+        xdt (xr.DataTree): input subswath or L2 product.
+    Returns:
+        int: number of tiles.
+    """
+    return sum(xdt[g]['land_flag'].size for g in GROUPS)
+
+
+def remove_path(path):
+    """
+    Removes a file or a directory, if it exists.
+
+    Parameters:
+        path (str): path of a file or a directory.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def get_product_encoding(l2_product, predicted_variables, output_encoding):
+    """
+    Builds the encoding of the variables of a L2 product from an output profile.
+
+    With the int16 dtype, each predicted variable is packed as scaled integers: the scale factor and offset
+    map the range of its values in the product to the int16 range, the lowest value being kept as fill value.
+
+    Parameters:
+        l2_product (xr.DataTree): Level-2 wave product.
+        predicted_variables (PredictedVariables): variables predicted in each group.
+        output_encoding (OutputEncoding): output profile, see sarwaveifrproc.main.OutputEncoding.
+    Returns:
+        dict: encoding of the variables, by group path.
+    """
+    return {
+        f'/{g}': get_dataset_encoding(l2_product[g].ds, getattr(predicted_variables, g), output_encoding)
+        for g in GROUPS
+    }
+
+
+def get_dataset_encoding(ds, predicted_variables, output_encoding):
+    """
+    Builds the encoding of the variables of a group of a L2 product from an output profile, see get_product_encoding.
+
+    Parameters:
+        ds (xr.Dataset): intraburst or interburst group of a Level-2 wave product.
+        predicted_variables (dict): variables predicted in the group.
+        output_encoding (OutputEncoding): output profile, see sarwaveifrproc.main.OutputEncoding.
+    Returns:
+        dict: encoding of the variables of the group.
+    """
+    if output_encoding.predictions_dtype not in (None, 'float32', 'int16'):
+        raise ValueError(f"Unsupported predictions dtype {output_encoding.predictions_dtype!r}, expected float32 or int16.")
+
+    encoding = {}
+    for v, da in ds.data_vars.items():
+        enc = {}
+        if output_encoding.format == 'netcdf' and output_encoding.zlib:
+            enc.update(zlib=True, complevel=output_encoding.complevel, shuffle=output_encoding.shuffle)
+        if output_encoding.chunks and da.dims:
+            chunks = tuple(min(output_encoding.chunks.get(d, n), n) for d, n in da.sizes.items())
+            enc['chunksizes' if output_encoding.format == 'netcdf' else 'chunks'] = chunks
+        if v in predicted_variables:
+            if output_encoding.predictions_dtype == 'float32':
+                enc['dtype'] = 'float32'
+            elif output_encoding.predictions_dtype == 'int16':
+                enc.update(get_packing(da.values))
+        encoding[v] = enc
+    return encoding
+
+
+def get_packing(values):
+    """
+    Computes the encoding packing an array of floats into int16 scaled integers.
+
+    Parameters:
+        values (np.ndarray): values to pack.
+    Returns:
+        dict: dtype, scale_factor, add_offset and _FillValue encoding.
+    """
+    fill_value = np.iinfo(np.int16).min
+    finite = values[np.isfinite(values)]
+    vmin, vmax = (float(finite.min()), float(finite.max())) if finite.size else (0., 0.)
+    # The values are mapped to [-32766, 32766], away from the fill value. xarray packs float32 values
+    # in float32 arithmetic: the offset is made exact in float32 and the steps are kept coarser than
+    # the float32 resolution of the values, so that rounding errors cannot overflow the int16 range.
+    add_offset = float(np.float32((vmax + vmin) / 2))
+    resolution = float(np.spacing(np.float32(max(abs(vmin), abs(vmax)))))
+    scale_factor = max((vmax - vmin) / (2 ** 16 - 4), resolution)
+    return dict(dtype='int16', scale_factor=scale_factor, add_offset=add_offset, _FillValue=fill_value)
+
+
+def load_subswath(path, variables=KEPT_VARIABLES, reader='full', pols=None):
+    """
+    Loads in memory the variables of a subswath file needed to generate its product, and closes the file.
+
+    Parameters:
+        path (str): path of the L1B or L1C subswath file.
+        variables (list): variables to load from each group.
+        reader (str): 'full' or 'selective', see open_subswath.
+        pols (list): polarisations to load, all of them if None.
+    Returns:
+        xr.DataTree: DataTree containing the intraburst and interburst datasets.
+    """
+    groups = open_subswath(path, reader, pols, variables)
+    try:
+        xdt = xr.DataTree.from_dict({g: groups[f'/{g}'][variables].load() for g in GROUPS})
+    finally:
+        close_groups(groups)
+    xdt.encoding = {'source': path}
+    return xdt
+
+
+def open_subswath(path, reader='full', pols=None, variables=KEPT_VARIABLES):
+    """
+    Opens lazily the groups of a subswath file.
+
+    The 'full' reader opens every group and variable of the file. The 'selective' reader opens only the intraburst
+    and interburst groups, and skips the variables that are neither inputs of the models nor kept in the product
+    (cross-spectra, ...), with their coordinates.
+
+    Parameters:
+        path (str): path of the L1B or L1C subswath file.
+        reader (str): 'full' or 'selective'.
+        pols (list): polarisations to select, all of them if None. Only VV is used by the models.
+        variables (list): variables needed from each group, by the 'selective' reader.
+    Returns:
+        dict[str, xr.Dataset]: datasets of the groups, by group path ('/intraburst', ...).
+    """
+    if reader == 'full':
+        groups = xr.open_groups(path)
+    elif reader == 'selective':
+        drop_variables = get_unneeded_variables(path, variables)
+        groups = {f'/{g}': xr.open_dataset(path, group=g, drop_variables=drop_variables[g]) for g in GROUPS}
+    else:
+        raise ValueError(f"Unknown reader {reader!r}, expected 'full' or 'selective'.")
+
+    if pols is not None:
+        groups = {k: ds.sel(pol=list(pols)) if 'pol' in ds.dims else ds for k, ds in groups.items()}
+    return groups
+
+
+def get_land_reader_kwargs(path, reader_kwargs={}):
+    """
+    Adapts the options of open_subswath to a subswath file whose tiles are all on land.
+
+    The land flags are read first: if all the tiles of the file are on land, only the variables copied to the
+    product on land are read (see sarwaveifrproc.l2_wave.generate_product_on_land), instead of the whole file.
+
+    Parameters:
+        path (str): path of the L1B or L1C subswath file.
+        reader_kwargs (dict): options of open_subswath.
+    Returns:
+        dict: options of open_subswath for this file.
+    """
+    if not is_land_subswath(path):
+        return reader_kwargs
+    return dict(reader_kwargs, reader='selective', variables=LAND_VARIABLES)
+
+
+def is_land_subswath(path):
+    """
+    Checks whether all the tiles of a subswath file are on land, reading only its land flags.
+
+    Parameters:
+        path (str): path of the L1B or L1C subswath file.
+    Returns:
+        bool: True if all the tiles of the intraburst and interburst groups are on land.
+    """
+    with netCDF4.Dataset(path) as nc:
+        return all(bool(nc[g]['land_flag'][:].all()) for g in GROUPS)
+
+
+def close_groups(groups):
+    """
+    Closes the files of the groups opened by open_subswath.
+
+    Parameters:
+        groups (dict[str, xr.Dataset]): datasets of the groups, by group path.
+    """
+    for ds in groups.values():
+        ds.close()
+
+
+def get_unneeded_variables(path, variables):
+    """
+    Lists the variables of the intraburst and interburst groups of a subswath file that are not needed to read `variables`.
+
+    The needed variables are `variables`, their coordinates and the coordinates of their dimensions.
+
+    Parameters:
+        path (str): path of the L1B or L1C subswath file.
+        variables (list): variables to read.
+    Returns:
+        dict[str, list]: names of the variables to drop, by group.
+    """
+    drop_variables = {}
+    with netCDF4.Dataset(path) as nc:
+        for g in GROUPS:
+            group_variables = nc[g].variables
+            needed = set(variables)
+            for v in variables:
+                if v in group_variables:
+                    needed.update(group_variables[v].dimensions)
+                    needed.update(getattr(group_variables[v], 'coordinates', '').split())
+            drop_variables[g] = [v for v in group_variables if v not in needed]
+    return drop_variables
+
+
+def to_datatree(groups, path):
+    """
+    Builds the DataTree of a subswath file from the datasets of its groups.
+
+    Parameters:
+        groups (dict[str, xr.Dataset]): datasets of the groups, by group path.
+        path (str): path of the subswath file, recorded as the source of the DataTree.
+    Returns:
+        xr.DataTree: DataTree containing the intraburst and interburst datasets.
+    """
+    xdt = xr.DataTree.from_dict(groups)
+    xdt.encoding = {'source': path}
+    return xdt
+
+
+def list_subswaths(input_safe):
+    """
+    Lists the subswath files of a L1B or L1C SAFE.
+
+    Parameters:
+        input_safe (str): Input safe path.
+    Returns:
+        list: paths of the subswath files.
+    """
+    return glob.glob(os.path.join(input_safe, '*?v*.nc'))
+
+
+def iter_subswaths(input_safes, output_safes, product_id, run_info=None, container=None):
+    """
+    Iterates over the subswath files of several SAFEs.
+
+    With a run info, the subswaths whose product is up to date according to the manifest of their output SAFE,
+    or to the index of their container, are skipped.
+
+    Parameters:
+        input_safes (list): Input safe paths.
+        output_safes (list): Paths to the output directories, one per input safe.
+        product_id (str): Identifier for the output product.
+        run_info (dict): see sarwaveifrproc.manifest.get_run_info. No subswath is skipped if None.
+        container (str): "day" or "orbit" if the products are appended to containers, see sarwaveifrproc.containers.
+    Yields:
+        tuple: path of the subswath file and path where its product is saved.
+    """
+    for input_safe, output_safe in zip(input_safes, output_safes):
+        subswath_filenames = list_subswaths(input_safe)
+        if run_info is not None:
+            if container is not None:
+                products = containers.get_products(
+                    containers.load_index(containers.get_container_path(output_safe, container)), output_safe
+                )
+                todo = [path for path in subswath_filenames if not containers.is_subswath_done(products, path, run_info)]
+            else:
+                safe_manifest = manifest.load_manifest(output_safe)
+                todo = [
+                    path for path in subswath_filenames
+                    if not manifest.is_subswath_done(safe_manifest, path, output_safe, run_info)
+                ]
+            logging.info(
+                f'{len(subswath_filenames)} subswaths found in given safe, '
+                f'{len(subswath_filenames) - len(todo)} already processed.'
+            )
+            subswath_filenames = todo
+        else:
+            logging.info(f'{len(subswath_filenames)} subswaths found in given safe.')
+        for path in subswath_filenames:
+            yield path, get_output_filename(path, output_safe, product_id)
+
 
-        os.makedirs(output_safe, exist_ok=True)
-        savepath = get_output_filename(path, output_safe, product_id)
-        l2_product.to_netcdf(savepath)
-        
-    
 class RobustScaler:
     """
     Class to mimic scikit-learn RobustScaler. This is done in order to prevent warning messages when using pickle to load the scikit-learn scaler.
@@ -0,0 +1,326 @@
+import glob
+import json
+import logging
+import os
+from typing import Optional
+
+import hydra
+import hydra_zen
+import numpy as np
+from omegaconf import OmegaConf
+
+import sarwaveifrproc.utils as utils
+from sarwaveifrproc.l2_wave import GROUPS, get_valid_tiles, prepare_tiles, run_model
+
+VARIANTS = ["int8", "int8-static", "fp16"]
+
+
+def get_variant_path(path, variant=None):
+    """
+    Path of a variant of a model, next to the full precision model.
+
+    Parameters:
+    - path (str): path of the full precision onnx file.
+    - variant (str): one of VARIANTS, or None for the full precision model.
+    Returns:
+    - path (str): path of the variant onnx file, e.g. models/multi.int8.onnx
+    """
+    if variant is None:
+        return path
+    if variant not in VARIANTS:
+        raise ValueError(
+            f"Unknown model variant {variant!r}, expected one of {VARIANTS}."
+        )
+    root, ext = os.path.splitext(path)
+    return f"{root}.{variant}{ext}"
+
+
+def resolve_variant(path, variant=None):
+    """
+    Path of an existing variant of a model.
+
+    Parameters:
+    - path (str): path of the full precision onnx file.
+    - variant (str): one of VARIANTS, or None for the full precision model.
+    Returns:
+    - path (str): path of the variant onnx file.
+    """
+    variant_path = get_variant_path(path, variant)
+    if not os.path.exists(variant_path):
+        raise FileNotFoundError(
+            f"Model variant {variant_path} not found. Variants are written by L2-wave-prepare-models "
+            f"only if they pass its accuracy gate."
+        )
+    return variant_path
+
+
+def convert_model(path, variant_path, variant, calibration_tiles=None):
+    """
+    Write a quantized or float16 variant of a model. Requires the onnx package.
+
+    Parameters:
+    - path (str): path of the full precision onnx file.
+    - variant_path (str): path of the variant onnx file.
+    - variant (str): "int8" (dynamic quantization of the weights), "int8-static" (weights and activations,
+      calibrated on `calibration_tiles`) or "fp16" (float16 weights and activations, float32 inputs and outputs).
+    - calibration_tiles (np.ndarray): model inputs used to calibrate the static quantization.
+    """
+    try:
+        import onnx
+        from onnxruntime import quantization
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+    except ImportError as e:
+        raise ImportError(
+            "Preparing model variants requires the onnx package: pip install sarwaveifrproc[quantize]"
+        ) from e
+
+    if variant == "int8":
+        quantization.quantize_dynamic(
+            path, variant_path, weight_type=quantization.QuantType.QInt8
+        )
+    elif variant == "int8-static":
+        quantization.quantize_static(
+            path,
+            variant_path,
+            TilesReader(path, calibration_tiles),
+            quant_format=quantization.QuantFormat.QDQ,
+            activation_type=quantization.QuantType.QInt8,
+            weight_type=quantization.QuantType.QInt8,
+        )
+    elif variant == "fp16":
+        model = convert_float_to_float16(onnx.load(path), keep_io_types=True)
+        onnx.save(model, variant_path)
+    else:
+        raise ValueError(
+            f"Unknown model variant {variant!r}, expected one of {VARIANTS}."
+        )
+
+
+class TilesReader:
+    """
+    Calibration data reader of the onnx runtime static quantization, feeding tiles by batches.
+    """
+
+    def __init__(self, path, tiles, batch_size=256):
+        import onnxruntime
+
+        name = onnxruntime.InferenceSession(path).get_inputs()[0].name
+        self.batches = iter(
+            [
+                {name: tiles[i : i + batch_size]}
+                for i in range(0, len(tiles), batch_size)
+            ]
+        )
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def load_tiles(path, max_tiles=None, seed=0):
+    """
+    Gather the valid ocean tiles of L1B or L1C subswaths, as model inputs of each group.
+
+    Parameters:
+    - path (str): listing (.txt), SAFE, directory or subswath file (.nc).
+    - max_tiles (int): maximum number of tiles per group, drawn at random. All the tiles if None.
+    - seed (int): seed of the random draw.
+    Returns:
+    - tiles (dict[str, np.ndarray]): float32 model inputs of the intraburst and interburst groups.
+    """
+    if path.endswith(".txt"):
+        paths = [
+            p
+            for f in np.atleast_1d(np.loadtxt(path, dtype=str))
+            for p in utils.list_subswaths(f)
+        ]
+    elif os.path.isdir(path):
+        paths = utils.list_subswaths(path) or sorted(
+            glob.glob(os.path.join(path, "*.nc"))
+        )
+    else:
+        paths = [path]
+
+    tiles = {g: [] for g in GROUPS}
+    for p in sorted(paths):
+        xdt = utils.load_subswath(p)
+        for g in GROUPS:
+            ds = xdt[g].ds
+            if "pol" in ds.coords and not ds["pol"].dims:
+                ds = ds.drop_vars("pol").expand_dims(pol=[str(ds["pol"].values)])
+            _, _, X, land_flag = prepare_tiles(ds, engine="numpy")
+            tiles[g].append(X[get_valid_tiles(land_flag, X)])
+
+    rng = np.random.default_rng(seed)
+    for g in GROUPS:
+        X = np.concatenate(tiles[g]) if tiles[g] else np.empty((0, 0), dtype=np.float32)
+        if max_tiles is not None and len(X) > max_tiles:
+            X = X[np.sort(rng.choice(len(X), max_tiles, replace=False))]
+        tiles[g] = X
+    return tiles
+
+
+def compare_outputs(path, variant_path, outputs, tiles):
+    """
+    Compare the outputs of a model variant to the outputs of the full precision model.
+
+    Parameters:
+    - path (str): path of the full precision onnx file.
+    - variant_path (str): path of the variant onnx file.
+    - outputs (list): names of the output columns of the model.
+    - tiles (np.ndarray): model inputs.
+    Returns:
+    - stats (dict[str, dict]): bias, RMSE, 99th percentile and maximum of the absolute error of each output column.
+    """
+    import onnxruntime
+
+    if not len(tiles):
+        raise ValueError("No valid ocean tile to compare the models on.")
+    expected = run_model(tiles, onnxruntime.InferenceSession(path))
+    actual = run_model(tiles, onnxruntime.InferenceSession(variant_path))
+    stats = {}
+    for name, e, a in zip(outputs, expected, actual):
+        error = a.astype(np.float64) - e
+        stats[name] = dict(
+            bias=float(error.mean()),
+            rmse=float(np.sqrt((error**2).mean())),
+            p99=float(np.percentile(np.abs(error), 99)),
+            max=float(np.abs(error).max()),
+        )
+    return stats
+
+
+def load_models_config(config):
+    """
+    Load the models and predicted variables of a configuration.
+
+    Parameters:
+    - config (str): name of a shipped configuration (e.g. e11) or path of a yaml configuration.
+    Returns:
+    - models (dict): path and outputs of each model.
+    - predicted_variables (dict): model and output of the variables of each group.
+    """
+    if not config.endswith(".yaml"):
+        import sarwave_config
+
+        config = os.path.join(
+            os.path.dirname(sarwave_config.__file__), f"{config}.yaml"
+        )
+    conf = OmegaConf.load(config)
+    return OmegaConf.to_container(conf.models), OmegaConf.to_container(
+        conf.predicted_variables
+    )
+
+
+def prepare_models(
+    validation_path: str,
+    config: str = "e11",
+    models: Optional[list[str]] = None,
+    variants: list[str] = ["int8", "fp16"],
+    calibration_path: Optional[str] = None,
+    max_tiles: Optional[int] = 10000,
+    tolerances: dict[str, float] = {
+        "hs_most_likely": 0.1,
+        "phs0_most_likely": 0.1,
+        "t0m1_most_likely": 0.2,
+    },
+    force: bool = False,
+):
+    """
+    Write quantized and float16 variants of the models of a configuration, next to them, and check their accuracy.
+
+    validation_path: listing, SAFE, directory or subswath file whose ocean tiles are used to compare the variants with the full precision models
+    config: name of a shipped configuration (e.g. e11) or path of a yaml configuration
+    models: names of the models to convert, all the models of the configuration if null
+    variants: int8 (dynamic quantization), int8-static (quantization calibrated on reference tiles) and/or fp16
+    calibration_path: listing, SAFE, directory or subswath file whose ocean tiles calibrate the static quantization, validation_path if null
+    max_tiles: maximum number of calibration and validation tiles per group
+    tolerances: maximum RMSE between the variant and the full precision model of each predicted variable, on the validation tiles. The other variables are only reported
+    force: keep the variants that do not pass the accuracy gate
+
+    A variant is kept only if the RMSE of all the predicted variables with a tolerance is within it. The statistics of each
+    variant are written in a json report next to it (e.g. models/multi.int8.json). The variants are selected with the
+    model_variant option of L2-wave-processor.
+    """
+    from sarwaveifrproc.main import setup_logging
+
+    setup_logging()
+    models_conf, predicted_variables = load_models_config(config)
+    names = models if models is not None else list(models_conf)
+    logging.info(f"Loading validation tiles from {validation_path}...")
+    validation = load_tiles(validation_path, max_tiles)
+    calibration = None
+    if "int8-static" in variants:
+        calibration_path = calibration_path or validation_path
+        logging.info(f"Loading calibration tiles from {calibration_path}...")
+        calibration = load_tiles(calibration_path, max_tiles, seed=1)
+
+    reports = {}
+    for k in names:
+        path, outputs = models_conf[k]["path"], models_conf[k]["outputs"]
+        # tiles of the groups predicted by the model, and output column of each predicted variable
+        groups = [
+            g
+            for g in GROUPS
+            if any(v["model"] == k for v in predicted_variables[g].values())
+        ]
+        columns = {
+            v: p["output"]
+            for g in groups
+            for v, p in predicted_variables[g].items()
+            if p["model"] == k
+        }
+        tiles = np.concatenate([validation[g] for g in groups])
+        calibration_tiles = (
+            np.concatenate([calibration[g] for g in groups])
+            if calibration is not None
+            else None
+        )
+        for variant in variants:
+            variant_path = get_variant_path(path, variant)
+            convert_model(path, variant_path, variant, calibration_tiles)
+            stats = compare_outputs(path, variant_path, outputs, tiles)
+            variables = {
+                v: dict(stats[o], output=o, tolerance=tolerances.get(v))
+                for v, o in columns.items()
+            }
+            passed = all(
+                s["rmse"] <= s["tolerance"]
+                for s in variables.values()
+                if s["tolerance"] is not None
+            )
+            report = dict(
+                model=path,
+                variant=variant,
+                validation_path=validation_path,
+                validation_tiles=len(tiles),
+                passed=passed,
+                variables=variables,
+            )
+            with open(f"{os.path.splitext(variant_path)[0]}.json", "w") as f:
+                json.dump(report, f, indent=1)
+            for v, s in variables.items():
+                logging.info(
+                    f"{variant_path} {v}: bias {s['bias']:.4f}, RMSE {s['rmse']:.4f} (tolerance {s['tolerance']}), max error {s['max']:.4f}"
+                )
+            if passed:
+                logging.info(
+                    f"{variant_path} passed the accuracy gate on {len(tiles)} tiles."
+                )
+            elif force:
+                logging.warning(
+                    f"{variant_path} failed the accuracy gate, kept with force=true."
+                )
+            else:
+                os.remove(variant_path)
+                logging.error(
+                    f"{variant_path} failed the accuracy gate on {len(tiles)} tiles and was removed."
+                )
+            reports[variant_path] = report
+    return reports
+
+
+hydra_main = hydra.main(
+    config_name="prepare_models",
+    config_path="pkg://sarwave_config",
+    version_base="1.3",
+)(hydra_zen.zen(prepare_models))
@@ -0,0 +1,59 @@
+import functools
+import os
+
+import onnxruntime
+import pytest
+import xarray as xr
+from omegaconf import OmegaConf
+
+import sarwaveifrproc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+L1B_SAR_vv = os.path.join(
+    os.path.dirname(sarwaveifrproc.__file__),
+    "reference_data",
+    "s1a-iw2-slc-vv-20231128t035702-20231128t035727-051412-063451-005_L1B_xspec_IFR_3.7_nospectra.nc",
+)
+SAFE = "S1A_IW_XSP__1SDV_20231128T035702_20231128T035727_051412_063451_A1B2_B08.SAFE"
+SUBSWATH = (
+    "l1b-s1a-{swath}-xsp-vv-20231128t035702-20231128t035727-051412-063451-002-b08.nc"
+)
+
+
+@functools.lru_cache
+def load_reference():
+    with xr.open_dataset(L1B_SAR_vv) as ds:
+        return ds.load()
+
+
+def get_xdt(land=None):
+    """Build an intraburst/interburst DataTree from the reference L1B subswath."""
+    ds = load_reference().copy(deep=True).drop_vars("pol").expand_dims(pol=["VV"])
+    if land is not None:
+        ds["land_flag"] = ds["land_flag"] & False | land
+    xdt = xr.DataTree.from_dict(
+        {"intraburst": ds, "interburst": ds.isel(burst=slice(0, 8))}
+    )
+    xdt.encoding = {"source": L1B_SAR_vv}
+    return xdt
+
+
+@pytest.fixture
+def input_safe(tmp_path):
+    """A L1B SAFE with a coastal, an ocean and a land subswath."""
+    safe = tmp_path / "input" / SAFE
+    safe.mkdir(parents=True)
+    for swath, land in [("iw1", False), ("iw2", None), ("iw3", True)]:
+        get_xdt(land).to_netcdf(safe / SUBSWATH.format(swath=swath))
+    return str(safe)
+
+
+@pytest.fixture(scope="session")
+def config():
+    conf = OmegaConf.load(os.path.join(root, "sarwave_config", "e11.yaml"))
+    models = {
+        k: onnxruntime.InferenceSession(os.path.join(root, d.path))
+        for k, d in conf.models.items()
+    }
+    models_outputs = {k: d.outputs for k, d in conf.models.items()}
+    return models, models_outputs, conf.predicted_variables
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from sarwaveifrproc.l2_wave import (
+    generate_l2_wave_product,
+    generate_l2_wave_products,
+)
+from tests.conftest import get_xdt
+
+
+@pytest.mark.parametrize("batch_size", [None, 1, 7, 1000])
+def test_batched_products_match(config, batch_size):
+    models, models_outputs, predicted_variables = config
+    xdts = [get_xdt(), get_xdt(land=False), get_xdt(land=True)]
+    expected = [
+        generate_l2_wave_product(xdt, models, models_outputs, predicted_variables)
+        for xdt in xdts
+    ]
+    actual = generate_l2_wave_products(
+        xdts, models, models_outputs, predicted_variables, batch_size
+    )
+    for e, a in zip(expected, actual):
+        for group in ["intraburst", "interburst"]:
+            for v in predicted_variables[group]:
+                np.testing.assert_allclose(
+                    a[group][v].values, e[group][v].values, rtol=1e-6, equal_nan=True
+                )
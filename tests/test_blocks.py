@@ -0,0 +1,68 @@
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import utils
+from sarwaveifrproc.l2_wave import get_block_length, iter_blocks
+from sarwaveifrproc.main import OutputEncoding
+from tests.conftest import get_xdt
+from tests.test_process_files import read_products
+
+
+def test_iter_blocks():
+    ds = get_xdt()["intraburst"].ds
+    assert get_block_length(ds, "burst", 1e-3) == 1
+    assert get_block_length(ds, "burst", 1e3) >= ds.sizes["burst"]
+
+    length = get_block_length(ds, "burst", 0.1)
+    blocks = list(iter_blocks(ds, 0.1))
+    assert 1 < len(blocks) < ds.sizes["burst"]
+    assert all(b.sizes["burst"] <= length for b in blocks)
+    xr.testing.assert_identical(
+        xr.concat([b["sigma0_filt"] for b in blocks], dim="burst"), ds["sigma0_filt"]
+    )
+
+
+@pytest.mark.parametrize("engine", ["xarray", "numpy"])
+@pytest.mark.parametrize(
+    "output_encoding",
+    [None, OutputEncoding(zlib=True, predictions_dtype="float32", chunks={"burst": 4})],
+)
+def test_process_files_blocks(input_safe, tmp_path, config, engine, output_encoding):
+    expected, actual = str(tmp_path / "expected"), str(tmp_path / "actual")
+    product_kwargs = dict(engine=engine)
+    writer_kwargs = dict(output_encoding=output_encoding)
+    utils.process_files(
+        input_safe, expected, *config, "E11", product_kwargs, {}, writer_kwargs
+    )
+    utils.process_files(
+        input_safe,
+        actual,
+        *config,
+        "E11",
+        product_kwargs,
+        {},
+        writer_kwargs,
+        block_size_mb=0.05,
+    )
+    expected, actual = read_products(expected), read_products(actual)
+    assert expected.keys() == actual.keys()
+    for name in expected:
+        xr.testing.assert_identical(actual[name], expected[name])
+
+
+@pytest.mark.parametrize(
+    "output_encoding",
+    [OutputEncoding(format="zarr"), OutputEncoding(predictions_dtype="int16")],
+)
+def test_process_files_blocks_unsupported(
+    input_safe, tmp_path, config, output_encoding
+):
+    with pytest.raises(ValueError):
+        utils.process_files(
+            input_safe,
+            str(tmp_path / "output"),
+            *config,
+            "E11",
+            writer_kwargs=dict(output_encoding=output_encoding),
+            block_size_mb=0.05,
+        )
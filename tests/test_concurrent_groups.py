@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import main, metrics
+from sarwaveifrproc.l2_wave import generate_l2_wave_product
+from tests.conftest import get_xdt
+from tests.test_process_files import read_products
+from tests.test_startup import run_main
+
+
+@pytest.mark.parametrize("engine", ["xarray", "numpy"])
+def test_concurrent_groups(config, engine):
+    models, models_outputs, predicted_variables = config
+    for xdt in [get_xdt(), get_xdt(land=False), get_xdt(land=True)]:
+        expected = generate_l2_wave_product(
+            xdt, models, models_outputs, predicted_variables, engine=engine
+        )
+        actual = generate_l2_wave_product(
+            xdt,
+            models,
+            models_outputs,
+            predicted_variables,
+            engine=engine,
+            concurrent_groups=True,
+        )
+        xr.testing.assert_identical(actual, expected)
+
+
+def test_concurrent_groups_metrics(config):
+    metrics.enable()
+    try:
+        with metrics.subswath("subswath.nc"):
+            generate_l2_wave_product(
+                get_xdt(land=False), *config, concurrent_groups=True
+            )
+    finally:
+        metrics.enable(False)
+    records = metrics.pop_records()
+    assert {r["stage"] for r in records} >= {"stack", "inference", "format"}
+    assert all(r.get("file") == "subswath.nc" for r in records)
+
+
+def test_share_threads(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)), False)
+    models = {
+        "multi": main.Model("multi.onnx", ["hs"]),
+        "multi_interburst": main.Model(
+            "multi_interburst.onnx", ["hs"], intra_op_num_threads=3
+        ),
+    }
+    shared = main.share_threads(models, 2)
+    assert shared["multi"].intra_op_num_threads == 4
+    assert shared["multi_interburst"].intra_op_num_threads == 3
+    assert main.share_threads(models, 16)["multi"].intra_op_num_threads == 1
+
+
+def test_main_concurrent_groups(input_safe, tmp_path, monkeypatch):
+    overrides = [f"input_path={input_safe}"]
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    reports = tmp_path / "expected.json", tmp_path / "actual.json"
+    try:
+        run_main(
+            monkeypatch,
+            *overrides,
+            f"save_directory={expected}",
+            f"metrics_report={reports[0]}",
+        )
+        run_main(
+            monkeypatch,
+            *overrides,
+            f"save_directory={actual}",
+            f"metrics_report={reports[1]}",
+            "concurrent_groups=true",
+        )
+    finally:
+        metrics.enable(False)
+    expected = read_products(next(expected.glob("*/*/*.SAFE")))
+    actual = read_products(next(actual.glob("*/*/*.SAFE")))
+    assert len(expected) == 3
+    assert expected.keys() == actual.keys()
+    for name in expected:
+        xr.testing.assert_identical(actual[name], expected[name])
+
+    # the stages run in the group threads are attributed to their subswath file
+    files = []
+    for path in reports:
+        with open(path) as f:
+            report = json.load(f)
+        files.append({f["file"]: f["array_bytes"] for f in report["files"]})
+    assert len(files[0]) == 3
+    assert files[1] == files[0]
+
+    with pytest.raises(ValueError, match="concurrent_groups"):
+        run_main(
+            monkeypatch,
+            *overrides,
+            f"save_directory={tmp_path / 'blocks'}",
+            "concurrent_groups=true",
+            "block_size_mb=1",
+        )
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import containers, utils
+from tests.test_manifest import RUN_INFO
+from tests.test_process_files import read_products
+from tests.test_startup import run_main
+
+
+def test_container_path():
+    output_safe = os.path.join(
+        "out",
+        "2023",
+        "332",
+        "S1A_IW_WAV__2SDV_20231128T035702_20231128T035727_051412_063451_A1B2_E11.SAFE",
+    )
+    assert containers.get_container_path(output_safe, "day") == os.path.join(
+        "out", "2023", "332", "l2-s1a-wav-20231128-e11.nc"
+    )
+    assert containers.get_container_path(output_safe, "orbit") == os.path.join(
+        "out", "orbits", "l2-s1a-wav-051412-e11.nc"
+    )
+    with pytest.raises(ValueError):
+        containers.get_container_path(output_safe, "month")
+
+
+@pytest.mark.parametrize("container", containers.CONTAINERS)
+def test_container(input_safe, tmp_path, config, container):
+    output_safe = utils.get_output_safe(input_safe, str(tmp_path / "output"), "E11")
+    inputs = utils.list_subswaths(input_safe)
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=dict(run_info=RUN_INFO)
+    )
+    expected = read_products(output_safe)
+
+    output_safe = utils.get_output_safe(input_safe, str(tmp_path / "container"), "E11")
+    writer_kwargs = dict(run_info=RUN_INFO, container=container)
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    path = containers.get_container_path(output_safe, container)
+    assert not os.path.exists(output_safe)
+    index = containers.load_index(path)
+    assert len(index) == 3
+    assert {e["input_safe"] for e in index} == {os.path.basename(input_safe)}
+    for name, product in expected.items():
+        savepath = os.path.join(output_safe, name)
+        with containers.open_product(path, output_safe, savepath) as actual:
+            xr.testing.assert_identical(actual.load(), product)
+    assert containers.is_safe_done(inputs, output_safe, RUN_INFO, container)
+
+    # up to date subswaths are not written again
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    assert len(containers.load_index(path)) == 3
+
+    # a changed input is written again, under a new group
+    with open(inputs[0], "ab") as f:
+        f.write(b"\0")
+    assert not containers.is_safe_done(inputs, output_safe, RUN_INFO, container)
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    index = containers.load_index(path)
+    assert len(index) == 4
+    assert index[-1]["group"].endswith("_2")
+    assert containers.is_safe_done(inputs, output_safe, RUN_INFO, container)
+    other_run_info = dict(RUN_INFO, models={"multi": "def"})
+    assert not containers.is_safe_done(inputs, output_safe, other_run_info, container)
+
+    containers.invalidate_safe(output_safe, container)
+    assert not containers.get_products(containers.load_index(path), output_safe)
+    with pytest.raises(KeyError):
+        containers.open_product(path, output_safe, sorted(expected)[0])
+
+
+def test_main_container(input_safe, tmp_path, monkeypatch):
+    save_directory = tmp_path / "output"
+    overrides = [
+        f"input_path={input_safe}",
+        f"save_directory={save_directory}",
+        "container=day",
+        "overwrite=false",
+    ]
+    summary = run_main(monkeypatch, *overrides)
+    assert summary == dict(safes=1, processed=1, failures={})
+    summary = run_main(monkeypatch, *overrides)
+    assert summary == dict(safes=1, processed=0, failures={})
+    summary = run_main(monkeypatch, *overrides, "overwrite=true")
+    assert summary == dict(safes=1, processed=1, failures={})
+    output_safe = utils.get_output_safe(input_safe, str(save_directory), "E11")
+    index = containers.load_index(containers.get_container_path(output_safe))
+    assert [e["valid"] for e in index] == [0, 0, 0, 1, 1, 1]
+
+    with pytest.raises(ValueError):
+        run_main(monkeypatch, *overrides, "block_size_mb=1")
@@ -0,0 +1,123 @@
+import datetime
+import os
+import threading
+
+from sarwaveifrproc import daemon, utils
+
+
+def touch(path, mtime_ns=10**18):
+    with open(path, "w") as f:
+        f.write("")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_poll(tmp_path):
+    inbox = str(tmp_path)
+    touch(os.path.join(inbox, "a.txt"))
+    touch(os.path.join(inbox, "b.txt"), 11 * 10**17)
+    touch(os.path.join(inbox, "ignored.nc"))
+    processed = []
+
+    def process(path):
+        processed.append(os.path.basename(path))
+        if path.endswith("b.txt"):
+            raise RuntimeError("boom")
+        return dict(safes=1, processed=1, failures={})
+
+    statuses = daemon.poll(inbox, process)
+    assert processed == ["a.txt", "b.txt"]
+    assert statuses["a.txt"]["state"] == "done"
+    assert statuses["b.txt"]["state"] == "failed"
+    assert "boom" in statuses["b.txt"]["error"]
+    assert (
+        daemon.load_status(daemon.get_status_path(inbox, "a.txt")) == statuses["a.txt"]
+    )
+
+    # processed items are not processed again, unless they are replaced
+    assert daemon.poll(inbox, process) == {}
+    touch(os.path.join(inbox, "a.txt"), 12 * 10**17)
+    assert list(daemon.poll(inbox, process)) == ["a.txt"]
+
+
+def test_poll_settle_time(tmp_path):
+    open(tmp_path / "a.txt", "w").close()
+    assert daemon.poll(str(tmp_path), lambda path: {}, settle_time=60) == {}
+    assert list(daemon.poll(str(tmp_path), lambda path: {})) == ["a.txt"]
+
+
+def test_poll_failures(tmp_path):
+    touch(os.path.join(tmp_path, "a.txt"))
+    statuses = daemon.poll(
+        str(tmp_path), lambda path: dict(safes=2, processed=1, failures={"x": "e"})
+    )
+    assert statuses["a.txt"]["state"] == "failed"
+
+
+def test_poll_retry(tmp_path):
+    inbox = str(tmp_path)
+    touch(os.path.join(inbox, "a.txt"))
+
+    def process(path):
+        raise RuntimeError("boom")
+
+    statuses = daemon.poll(inbox, process, retry_interval=60)
+    assert statuses["a.txt"]["attempts"] == 1
+    assert daemon.poll(inbox, process, retry_interval=60) == {}
+    assert daemon.poll(inbox, process) == {}
+
+    # failed items are retried once the retry interval passed, doubled after each failure
+    status_path = daemon.get_status_path(inbox, "a.txt")
+    status = daemon.load_status(status_path)
+    status.update(finished="2000-01-01T00:00:00+00:00")
+    daemon.save_status(status_path, status)
+    statuses = daemon.poll(inbox, process, retry_interval=60)
+    assert statuses["a.txt"]["attempts"] == 2
+    status = dict(statuses["a.txt"])
+    assert daemon.is_pending(status, 10**18, retry_interval=0)
+    finished = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=90
+    )
+    status.update(finished=finished.isoformat(timespec="seconds"))
+    assert not daemon.is_pending(status, 10**18, retry_interval=60)
+    assert daemon.is_pending(status, 10**18, retry_interval=45)
+
+    # succeeding items start again from the first attempt
+    statuses = daemon.poll(inbox, lambda path: {}, retry_interval=0)
+    assert statuses["a.txt"]["state"] == "done"
+    assert daemon.poll(inbox, process, retry_interval=0) == {}
+    touch(os.path.join(inbox, "a.txt"), 12 * 10**17)
+    assert daemon.poll(inbox, process)["a.txt"]["attempts"] == 1
+
+
+def test_poll_interrupted(tmp_path):
+    inbox = str(tmp_path)
+    touch(os.path.join(inbox, "a.txt"))
+    daemon.save_status(
+        daemon.get_status_path(inbox, "a.txt"),
+        dict(item="a.txt", mtime_ns=10**18, state="processing"),
+    )
+    assert list(daemon.poll(inbox, lambda path: {})) == ["a.txt"]
+
+
+def test_serve(input_safe, tmp_path, config):
+    inbox, output = str(tmp_path / "inbox"), str(tmp_path / "output")
+    os.makedirs(inbox)
+    os.symlink(input_safe, os.path.join(inbox, os.path.basename(input_safe)))
+    stop = threading.Event()
+
+    def process(path):
+        utils.process_files(path, output, *config, "E11")
+        stop.set()
+        return dict(safes=1, processed=1, failures={})
+
+    thread = threading.Thread(
+        target=daemon.serve, args=(inbox, process, 0.01), kwargs=dict(stop=stop)
+    )
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive()
+    assert len(os.listdir(output)) == 3
+    status = daemon.load_status(
+        daemon.get_status_path(inbox, os.path.basename(input_safe))
+    )
+    assert status["state"] == "done"
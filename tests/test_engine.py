@@ -0,0 +1,48 @@
+import pytest
+import xarray as xr
+
+from sarwaveifrproc.l2_wave import (
+    generate_l2_wave_product,
+    generate_l2_wave_products,
+    prepare_tiles,
+)
+from tests.conftest import get_xdt
+
+
+@pytest.mark.parametrize("mask_invalid_tiles", [False, True])
+def test_numpy_engine_matches_xarray(config, mask_invalid_tiles):
+    models, models_outputs, predicted_variables = config
+    xdts = [get_xdt(), get_xdt(land=False), get_xdt(land=True)]
+    for xdt in xdts:
+        expected = generate_l2_wave_product(
+            xdt, models, models_outputs, predicted_variables, mask_invalid_tiles
+        )
+        actual = generate_l2_wave_product(
+            xdt,
+            models,
+            models_outputs,
+            predicted_variables,
+            mask_invalid_tiles,
+            engine="numpy",
+        )
+        xr.testing.assert_identical(actual, expected)
+
+    actual = generate_l2_wave_products(
+        xdts,
+        models,
+        models_outputs,
+        predicted_variables,
+        7,
+        mask_invalid_tiles,
+        engine="numpy",
+    )
+    for xdt, a in zip(xdts, actual):
+        expected = generate_l2_wave_product(
+            xdt, models, models_outputs, predicted_variables, mask_invalid_tiles
+        )
+        xr.testing.assert_identical(a, expected)
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError, match="engine"):
+        prepare_tiles(get_xdt()["intraburst"].ds, engine="pandas")
@@ -0,0 +1,51 @@
+import glob
+import os
+
+from omegaconf import OmegaConf
+
+from sarwaveifrproc import executor, metrics
+from sarwaveifrproc.main import Model
+from tests.conftest import SAFE, root
+
+
+def load_models():
+    conf = OmegaConf.load(os.path.join(root, "sarwave_config", "e11.yaml"))
+    models = {
+        k: Model(path=os.path.join(root, d.path), outputs=list(d.outputs))
+        for k, d in conf.models.items()
+    }
+    return models, conf.predicted_variables
+
+
+def test_process_listing_collects_failures(input_safe, tmp_path):
+    models, predicted_variables = load_models()
+    broken_safe = tmp_path / "broken" / SAFE
+    broken_safe.mkdir(parents=True)
+    (broken_safe / "l1b-s1a-iw1-xsp-vv-broken.nc").write_text("not a netCDF file")
+
+    outputs = [str(tmp_path / "output" / "ok"), str(tmp_path / "output" / "broken")]
+    failures = executor.process_listing(
+        [input_safe, str(broken_safe)],
+        outputs,
+        models,
+        predicted_variables,
+        "E11",
+        workers=2,
+    )
+    assert list(failures) == [str(broken_safe)]
+    assert len(glob.glob(os.path.join(outputs[0], "*.nc"))) == 3
+
+
+def test_process_listing_gathers_metrics(input_safe, tmp_path):
+    models, predicted_variables = load_models()
+    executor.process_listing(
+        [input_safe],
+        [str(tmp_path / "output")],
+        models,
+        predicted_variables,
+        "E11",
+        workers=1,
+        collect_metrics=True,
+    )
+    records = metrics.pop_records()
+    assert sum(r["stage"] == "write" for r in records) == 3
@@ -0,0 +1,114 @@
+import glob
+import os
+
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import incremental, metrics, utils
+from tests.test_process_files import read_products
+from tests.test_startup import run_main
+
+
+def get_run_info(product_id, predicted_variables, **hashes):
+    return {
+        "product_id": product_id,
+        "models": dict({"multi": "a", "multi_interburst": "b"}, **hashes),
+        "predicted_variables": {
+            group: {
+                v: [p.model, p.output]
+                for v, p in getattr(predicted_variables, group).items()
+            }
+            for group in ["intraburst", "interburst"]
+        },
+    }
+
+
+def process(input_safe, save_directory, config, run_info, incremental_from=None):
+    product_id = run_info["product_id"]
+    output_safe = utils.get_output_safe(input_safe, save_directory, product_id)
+    utils.process_files(
+        input_safe,
+        output_safe,
+        *config,
+        product_id,
+        writer_kwargs=dict(run_info=run_info),
+        incremental_from=incremental_from,
+    )
+    return output_safe
+
+
+@pytest.fixture
+def collect():
+    metrics.enable()
+    yield
+    metrics.enable(False)
+    metrics.pop_records()
+
+
+def test_incremental(input_safe, tmp_path, config, collect):
+    save_directory = str(tmp_path / "output")
+    e11 = get_run_info("E11", config[2])
+    previous = read_products(process(input_safe, save_directory, config, e11))
+    metrics.pop_records()
+
+    # only the interburst model changed: the intraburst groups are reused
+    e12 = get_run_info("E12", config[2], multi_interburst="c")
+    actual = read_products(process(input_safe, save_directory, config, e12, "E11"))
+    models = {r["model"] for r in metrics.pop_records() if r["stage"] == "inference"}
+    assert models == {"multi_interburst"}
+    assert len(actual) == 3
+    for name, product in previous.items():
+        product_e12 = actual[name.replace("e11.nc", "e12.nc")]
+        xr.testing.assert_identical(product_e12["intraburst"], product["intraburst"])
+        xr.testing.assert_equal(product_e12["interburst"], product["interburst"])
+        attrs = product_e12["interburst"].attrs[incremental.GROUP_INFO_ATTR]
+        assert '"c"' in attrs
+
+    # nothing changed: the products are linked
+    e13 = get_run_info("E13", config[2])
+    output_safe = process(input_safe, save_directory, config, e13, "E11")
+    assert not [r for r in metrics.pop_records() if r["stage"] == "inference"]
+    previous_safe = utils.get_output_safe(input_safe, save_directory, "E11")
+    for name in previous:
+        assert os.path.samefile(
+            os.path.join(previous_safe, name),
+            os.path.join(output_safe, name.replace("e11.nc", "e13.nc")),
+        )
+
+    # the previous products of changed inputs are not reused
+    path = utils.list_subswaths(input_safe)[0]
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    previous_savepath = utils.get_previous_savepath(
+        path, input_safe, output_safe, "E11"
+    )
+    assert incremental.get_previous_groups(path, previous_savepath, e13) == []
+
+
+def test_main_incremental(input_safe, tmp_path, monkeypatch):
+    overrides = [
+        f"input_path={input_safe}",
+        f"save_directory={tmp_path / 'output'}",
+        "overwrite=false",
+    ]
+    run_main(monkeypatch, *overrides)
+    summary = run_main(
+        monkeypatch, *overrides, "product_id=E12", "incremental_from=E11"
+    )
+    assert summary == dict(safes=1, processed=1, failures={})
+    output_safe = utils.get_output_safe(input_safe, str(tmp_path / "output"), "E12")
+    assert all(os.stat(f).st_nlink == 2 for f in glob.glob(f"{output_safe}/*.nc"))
+
+    # the products of other processing options are not reused
+    run_main(
+        monkeypatch,
+        *overrides,
+        "product_id=E13",
+        "incremental_from=E11",
+        "mask_invalid_tiles=true",
+    )
+    output_safe = utils.get_output_safe(input_safe, str(tmp_path / "output"), "E13")
+    assert all(os.stat(f).st_nlink == 1 for f in glob.glob(f"{output_safe}/*.nc"))
+
+    with pytest.raises(ValueError):
+        run_main(monkeypatch, *overrides, "incremental_from=E11", "prefetch=2")
@@ -0,0 +1,118 @@
+import contextlib
+import os
+import shutil
+import threading
+
+import pytest
+
+from sarwaveifrproc import inventory, manifest, utils
+
+RUN_INFO = {"product_id": "E11", "models": {"multi": "abc"}, "predicted_variables": {}}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = inventory.connect(str(tmp_path / "inventory.db"))
+    yield db
+    db.close()
+
+
+def test_refresh_inputs(input_safe, db):
+    subswaths = inventory.refresh_inputs(db, [input_safe])
+    assert subswaths[input_safe] == sorted(utils.list_subswaths(input_safe))
+    (version,) = db.execute("SELECT version FROM safes").fetchone()
+    assert version == "B08"
+
+
+def test_get_done(input_safe, tmp_path, config, db, monkeypatch):
+    output_safe = str(tmp_path / "output" / "S1A_IW_WAV_E11.SAFE")
+    assert inventory.get_done(db, [input_safe], [output_safe], RUN_INFO) == [False]
+
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=dict(run_info=RUN_INFO)
+    )
+    # checked against the manifest, then recorded
+    assert inventory.get_done(db, [input_safe], [output_safe], RUN_INFO) == [True]
+    other_run_info = dict(RUN_INFO, models={"multi": "def"})
+    assert inventory.get_done(db, [input_safe], [output_safe], other_run_info) == [
+        False
+    ]
+    monkeypatch.setattr(manifest, "is_safe_done", None)
+    assert inventory.get_done(db, [input_safe], [output_safe], RUN_INFO) == [True]
+    assert inventory.get_summary(db) == dict(safes=1, subswaths=3, processed={"E11": 1})
+
+    inventory.forget_processed(db, [output_safe])
+    assert inventory.get_summary(db)["processed"] == {}
+
+
+def test_removed_output(input_safe, tmp_path, db):
+    output_safe = str(tmp_path / "output" / "S1A_IW_WAV_E11.SAFE")
+    os.makedirs(output_safe)
+    inventory.set_processed(db, [input_safe], [output_safe], RUN_INFO)
+    shutil.rmtree(output_safe)
+    assert inventory.get_done(db, [input_safe], [output_safe], RUN_INFO) == [False]
+
+
+def test_changed_input(input_safe, tmp_path, db):
+    output_safe = str(tmp_path / "output" / "S1A_IW_WAV_E11.SAFE")
+    os.makedirs(output_safe)
+    inventory.refresh_inputs(db, [input_safe])
+    inventory.set_processed(db, [input_safe], [output_safe], RUN_INFO)
+
+    # a file removed from the SAFE does not change the directory of the SAFEs
+    parent_mtime_ns = os.stat(os.path.dirname(input_safe)).st_mtime_ns
+    os.remove(utils.list_subswaths(input_safe)[0])
+    os.utime(input_safe, ns=(0, 0))  # whatever the resolution of the timestamps
+    assert os.stat(os.path.dirname(input_safe)).st_mtime_ns == parent_mtime_ns
+    subswaths = inventory.refresh_inputs(db, [input_safe])
+    assert len(subswaths[input_safe]) == 2
+    assert inventory.get_summary(db)["processed"] == {}
+
+
+def test_replaced_input(input_safe, tmp_path, db):
+    output_safe = str(tmp_path / "output" / "S1A_IW_WAV_E11.SAFE")
+    os.makedirs(output_safe)
+    inventory.refresh_inputs(db, [input_safe])
+    inventory.set_processed(db, [input_safe], [output_safe], RUN_INFO)
+
+    moved = str(tmp_path / "moved")
+    shutil.move(input_safe, moved)
+    os.makedirs(input_safe)
+    shutil.copy(utils.list_subswaths(moved)[0], input_safe)
+    subswaths = inventory.refresh_inputs(db, [input_safe])
+    assert len(subswaths[input_safe]) == 1
+    assert inventory.get_summary(db)["processed"] == {}
+
+
+def test_concurrent_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory, "TIMEOUT", 30.0)
+    path = str(tmp_path / "inventory.db")
+    with contextlib.closing(inventory.connect(path)) as db:
+        assert db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    errors = []
+
+    def job(i):
+        try:
+            with contextlib.closing(inventory.connect(path)) as db:
+                for j in range(20):
+                    safe = str(tmp_path / f"input{i}_{j}.SAFE")
+                    output_safe = str(tmp_path / f"output{i}_{j}.SAFE")
+                    os.makedirs(safe)
+                    inventory.refresh_inputs(db, [safe])
+                    inventory.set_processed(db, [safe], [output_safe], RUN_INFO)
+        except Exception as e:
+            errors.append(e)
+
+    # a job holding a write transaction makes the others wait instead of failing
+    with contextlib.closing(inventory.connect(path)) as db:
+        db.execute("BEGIN IMMEDIATE")
+        threads = [threading.Thread(target=job, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        threading.Event().wait(0.5)
+        db.rollback()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with contextlib.closing(inventory.connect(path)) as db:
+        assert inventory.get_summary(db)["processed"] == {"E11": 40}
@@ -0,0 +1,100 @@
+import glob
+import os
+
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import manifest, utils
+from sarwaveifrproc.main import OutputEncoding
+
+RUN_INFO = {"product_id": "E11", "models": {"multi": "abc"}, "predicted_variables": {}}
+
+
+def get_mtimes(output_safe):
+    return {
+        os.path.basename(f): os.stat(f).st_mtime_ns
+        for f in glob.glob(os.path.join(output_safe, "*.nc"))
+    }
+
+
+def test_resume(input_safe, tmp_path, config):
+    output_safe = str(tmp_path / "output")
+    inputs = utils.list_subswaths(input_safe)
+    writer_kwargs = dict(run_info=RUN_INFO)
+
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    assert manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+    first = get_mtimes(output_safe)
+    assert len(first) == 3
+
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    assert get_mtimes(output_safe) == first
+
+    removed = sorted(first)[0]
+    os.remove(os.path.join(output_safe, removed))
+    assert not manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    second = get_mtimes(output_safe)
+    assert {k for k in first if first[k] != second[k]} == {removed}
+
+    with open(inputs[0], "ab") as f:
+        f.write(b"\0")
+    assert not manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+
+    other_run_info = dict(RUN_INFO, models={"multi": "def"})
+    assert not manifest.is_safe_done(inputs, output_safe, other_run_info)
+
+
+def test_touched_input_is_done(input_safe, tmp_path, config):
+    output_safe = str(tmp_path / "output")
+    inputs = utils.list_subswaths(input_safe)
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=dict(run_info=RUN_INFO)
+    )
+    os.utime(inputs[0])
+    assert manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+
+
+def test_legacy_safe(input_safe, tmp_path, config):
+    output_safe = str(tmp_path / "output")
+    inputs = utils.list_subswaths(input_safe)
+    assert not manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+    os.makedirs(output_safe)
+    assert not manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+    utils.process_files(input_safe, output_safe, *config, "E11")
+    assert not os.path.exists(manifest.get_manifest_path(output_safe))
+    assert manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+
+
+def test_legacy_zarr_safe(input_safe, tmp_path, config):
+    pytest.importorskip("zarr")
+    output_safe = str(tmp_path / "output")
+    inputs = utils.list_subswaths(input_safe)
+    writer_kwargs = dict(output_encoding=OutputEncoding(format="zarr"))
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    assert not os.path.exists(manifest.get_manifest_path(output_safe))
+    assert all(f.endswith(".zarr") for f in os.listdir(output_safe))
+    assert manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+
+
+def test_atomic_write(tmp_path, monkeypatch):
+    savepath = str(tmp_path / "product.nc")
+    l2_product = xr.DataTree(xr.Dataset({"v": ("x", [1.0, 2.0])}))
+
+    def failing_to_netcdf(self, path, **kwargs):
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(xr.DataTree, "to_netcdf", failing_to_netcdf)
+    with pytest.raises(OSError):
+        utils.write_product(l2_product, savepath, None)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from sarwaveifrproc.l2_wave import (
+    generate_l2_wave_product,
+    generate_l2_wave_products,
+    run_model_masked,
+)
+from tests.conftest import get_xdt
+
+
+def get_coastal_xdt():
+    """A coastal subswath with an ocean tile whose cwave parameters are missing."""
+    xdt = get_xdt()
+    ds = xdt["intraburst"].ds.copy()
+    ocean = dict(zip(ds["land_flag"].dims, np.argwhere(~ds["land_flag"].values)[0]))
+    ds["cwave_params"] = ds["cwave_params"].copy()
+    ds["cwave_params"][ocean] = np.nan
+    xdt["intraburst"] = ds
+    return xdt
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_masked_products(config, batched):
+    models, models_outputs, predicted_variables = config
+    xdts = [get_coastal_xdt(), get_xdt(land=False), get_xdt(land=True)]
+    expected = [
+        generate_l2_wave_product(xdt, models, models_outputs, predicted_variables)
+        for xdt in xdts
+    ]
+    if batched:
+        actual = generate_l2_wave_products(
+            xdts, models, models_outputs, predicted_variables, 7, True
+        )
+    else:
+        actual = [
+            generate_l2_wave_product(
+                xdt, models, models_outputs, predicted_variables, True
+            )
+            for xdt in xdts
+        ]
+    for xdt, e, a in zip(xdts, expected, actual):
+        for group in ["intraburst", "interburst"]:
+            ds = xdt[group].ds.sel(pol="VV", drop=True)
+            valid = ~ds["land_flag"] & ds["cwave_params"].notnull().all(
+                ["2tau", "k_gp", "phi_hf"]
+            )
+            for v in predicted_variables[group]:
+                expected_values = e[group][v].where(valid)
+                np.testing.assert_allclose(
+                    a[group][v].values,
+                    expected_values.transpose(*a[group][v].dims).values,
+                    rtol=1e-6,
+                    equal_nan=True,
+                )
+
+
+def test_run_model_masked_without_valid_tiles(config):
+    models, _, _ = config
+    X = np.zeros((3, 24), dtype=np.float32)
+    res = run_model_masked(X, models["multi"], valid=np.zeros(3, dtype=bool))
+    assert len(res) == 6
+    assert all(r.shape == (3,) and np.isnan(r).all() for r in res)
@@ -0,0 +1,102 @@
+import contextlib
+import os
+
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import inventory, manifest, utils
+from sarwaveifrproc.l2_wave import get_memory_estimate
+from sarwaveifrproc.main import OutputEncoding
+from tests.conftest import get_xdt
+from tests.test_manifest import RUN_INFO
+from tests.test_process_files import read_products
+from tests.test_startup import run_main
+
+
+def test_memory_estimate():
+    xdt = get_xdt()
+    estimate = get_memory_estimate(xdt)
+    land_only = xr.DataTree.from_dict(
+        {g: xdt[g].ds[["land_flag"]] for g in ["intraburst", "interburst"]}
+    )
+    assert 0 < get_memory_estimate(land_only) < estimate
+
+
+def test_budget_blocks(input_safe, tmp_path, config):
+    expected, actual = str(tmp_path / "expected"), str(tmp_path / "actual")
+    utils.process_files(input_safe, expected, *config, "E11")
+    deferred = utils.process_files(
+        input_safe, actual, *config, "E11", memory_budget_mb=0.05
+    )
+    assert deferred == []
+    expected, actual = read_products(expected), read_products(actual)
+    assert expected.keys() == actual.keys()
+    for name in expected:
+        xr.testing.assert_identical(actual[name], expected[name])
+
+
+def test_budget_deferred(input_safe, tmp_path, config):
+    output_safe = str(tmp_path / "output")
+    inputs = utils.list_subswaths(input_safe)
+    writer_kwargs = dict(
+        output_encoding=OutputEncoding(predictions_dtype="int16"), run_info=RUN_INFO
+    )
+    # the land subswath reads a few variables only, and fits in the budget
+    groups = utils.open_subswath(inputs[0])
+    budget = get_memory_estimate(utils.to_datatree(groups, inputs[0])) / 2
+    utils.close_groups(groups)
+    deferred = utils.process_files(
+        input_safe,
+        output_safe,
+        *config,
+        "E11",
+        writer_kwargs=writer_kwargs,
+        memory_budget_mb=budget,
+    )
+    assert len(deferred) == 2 and "iw3" not in "".join(deferred)
+    assert len(os.listdir(output_safe)) == 2  # land product and manifest
+    assert not manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+
+    # the deferred subswaths are processed by the next run
+    utils.process_files(
+        input_safe, output_safe, *config, "E11", writer_kwargs=writer_kwargs
+    )
+    assert manifest.is_safe_done(inputs, output_safe, RUN_INFO)
+
+
+def test_out_of_memory_deferred(input_safe, tmp_path, config, monkeypatch):
+    def generate_l2_wave_product(*args, **kwargs):
+        raise MemoryError
+
+    monkeypatch.setattr(utils, "generate_l2_wave_product", generate_l2_wave_product)
+    output_safe = str(tmp_path / "output")
+    with pytest.raises(MemoryError):
+        utils.process_files(input_safe, output_safe, *config, "E11")
+    deferred = utils.process_files(
+        input_safe, output_safe, *config, "E11", memory_budget_mb=1e3
+    )
+    assert deferred == utils.list_subswaths(input_safe)
+
+
+def test_main_deferred_inventory(input_safe, tmp_path, monkeypatch):
+    listing = tmp_path / "listing.txt"
+    listing.write_text(f"{input_safe}\n")
+    db = str(tmp_path / "inventory.db")
+    overrides = [
+        f"input_path={listing}",
+        f"save_directory={tmp_path / 'output'}",
+        f"inventory_db={db}",
+        "output_encoding=packed",
+        "overwrite=false",
+    ]
+    summary = run_main(monkeypatch, *overrides, "memory_budget_mb=0.05")
+    assert summary["processed"] == 0 and not summary["failures"]
+    assert list(summary["deferred"]) == [input_safe]
+    with contextlib.closing(inventory.connect(db)) as connection:
+        assert inventory.get_summary(connection)["processed"] == {}
+
+    # the deferred SAFE is not skipped by the next run
+    summary = run_main(monkeypatch, *overrides)
+    assert summary == dict(safes=1, processed=1, failures={})
+    with contextlib.closing(inventory.connect(db)) as connection:
+        assert inventory.get_summary(connection)["processed"] == {"E11": 1}
@@ -0,0 +1,150 @@
+import csv
+import json
+import os
+import threading
+
+import pytest
+
+from sarwaveifrproc import metrics, sessions, utils
+from tests.test_startup import run_main
+
+
+@pytest.fixture
+def collect():
+    metrics.enable()
+    yield
+    metrics.enable(False)
+    metrics.pop_records()
+
+
+def test_stage_disabled():
+    with metrics.stage("open", tiles=3) as m:
+        m["bytes_read"] = 10
+    assert metrics.pop_records() == []
+
+
+def test_stage_failure_not_recorded(collect):
+    with pytest.raises(RuntimeError):
+        with metrics.stage("open"):
+            raise RuntimeError
+    assert metrics.pop_records() == []
+
+
+def test_process_files_metrics(input_safe, tmp_path, config, collect):
+    output_safe = str(tmp_path / "output")
+    utils.process_files(input_safe, output_safe, *config, "E11")
+    report = metrics.get_report(metrics.pop_records(), 1.0, safes=1)
+    stages = {(s["stage"], s["model"]): s for s in report["stages"]}
+    assert list(dict.fromkeys(s for s, _ in stages)) == metrics.STAGES
+    assert report["subswaths"] == 3
+    assert stages["open", ""]["bytes_read"] == sum(
+        os.path.getsize(p) for p in utils.list_subswaths(input_safe)
+    )
+    assert stages["write", ""]["bytes_written"] == sum(
+        os.path.getsize(os.path.join(output_safe, f)) for f in os.listdir(output_safe)
+    )
+    assert stages["write", ""]["tiles"] == report["tiles"]
+    # the land subswath is not stacked, and each model runs on the tiles of its group
+    assert stages["stack", ""]["calls"] == 4
+    assert stages["inference", "multi"]["calls"] == 2
+    assert stages["inference", "multi"]["tiles"] == 2 * 45
+    assert stages["inference", "multi_interburst"]["tiles"] == 2 * 40
+
+
+def test_process_files_memory(input_safe, tmp_path, config, collect):
+    utils.process_files(input_safe, str(tmp_path / "output"), *config, "E11")
+    records = metrics.pop_records()
+    assert all(r["peak_rss"] > 0 for r in records)
+    report = metrics.get_report(records, 1.0)
+    assert report["max_peak_rss"] == max(r["peak_rss"] for r in records)
+    files = {f["file"]: f for f in report["files"]}
+    assert sorted(files) == sorted(
+        os.path.basename(p) for p in utils.list_subswaths(input_safe)
+    )
+    assert sum(f["tiles"] for f in files.values()) == report["tiles"]
+    assert all(f["array_bytes"] > 0 and f["peak_stage"] for f in files.values())
+    stages = {(s["stage"], s["model"]): s for s in report["stages"]}
+    assert stages["stack", ""]["array_bytes"] > 0
+
+
+@pytest.mark.parametrize("ext", [".json", ".csv"])
+def test_write_report(tmp_path, ext):
+    records = [
+        dict(stage="inference", model="m", tiles=10, wall_time=0.5),
+        dict(stage="open", tiles=10, bytes_read=100, wall_time=1.0),
+        dict(stage="open", tiles=30, bytes_read=300, wall_time=3.0),
+    ]
+    path = str(tmp_path / "reports" / f"report{ext}")
+    metrics.write_report(path, metrics.get_report(records, 5.0))
+    with open(path) as f:
+        if ext == ".json":
+            stages = json.load(f)["stages"]
+        else:
+            stages = list(csv.DictReader(f))
+    assert [s["stage"] for s in stages] == ["open", "inference"]
+    assert float(stages[0]["wall_time"]) == 4.0
+    assert float(stages[0]["max_wall_time"]) == 3.0
+    assert float(stages[0]["tiles_per_second"]) == 10.0
+    assert int(stages[0]["bytes_read"]) == 400
+
+
+def test_write_report_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        metrics.write_report(str(tmp_path / "report.txt"), metrics.get_report([], 1.0))
+
+
+def test_main_unknown_report_format(input_safe, tmp_path, monkeypatch):
+    def create_sessions(*args, **kwargs):
+        raise AssertionError("The report format should be checked before the run.")
+
+    monkeypatch.setattr(sessions, "create_sessions", create_sessions)
+    with pytest.raises(ValueError, match="metrics report format"):
+        run_main(
+            monkeypatch,
+            f"input_path={input_safe}",
+            f"save_directory={tmp_path / 'output'}",
+            f"metrics_report={tmp_path / 'report.txt'}",
+        )
+    assert not os.path.exists(tmp_path / "output")
+
+
+def test_shared_peak_rss(collect):
+    started, release = threading.Event(), threading.Event()
+
+    def run():
+        with metrics.stage("open"):
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    with metrics.stage("inference", model="multi"):
+        release.set()
+    thread.join()
+    with metrics.stage("write"):
+        pass
+    records = {r["stage"]: r for r in metrics.pop_records()}
+    assert records["open"]["shared_peak_rss"]
+    assert records["inference"]["shared_peak_rss"]
+    assert "shared_peak_rss" not in records["write"]
+
+
+@pytest.mark.parametrize("mode", ["pipelined", "batched"])
+def test_files_metrics(input_safe, tmp_path, config, collect, mode):
+    output_safes = [str(tmp_path / "output")]
+    if mode == "pipelined":
+        utils.process_files_pipelined([input_safe], output_safes, *config, "E11")
+    else:
+        utils.process_files_batched([input_safe], output_safes, *config, "E11", 100)
+    records = metrics.pop_records()
+    report = metrics.get_report(records, 1.0)
+    files = {f["file"]: f for f in report["files"]}
+    assert sorted(files) == sorted(
+        os.path.basename(p) for p in utils.list_subswaths(input_safe)
+    )
+    assert sum(f["tiles"] for f in files.values()) == report["tiles"]
+    # the models run on the tiles of several subswaths at once when batched
+    attributed = {r["stage"] for r in records if "file" in r}
+    assert attributed >= {"open", "stack", "format", "write"}
+    assert ("inference" in attributed) == (mode == "pipelined")
@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import utils
+from sarwaveifrproc.l2_wave import generate_l2_wave_product
+from sarwaveifrproc.main import OutputEncoding
+from tests.conftest import get_xdt
+
+
+@pytest.fixture
+def l2_product(config):
+    return generate_l2_wave_product(get_xdt(), *config)
+
+
+def read(path, **kwargs):
+    with xr.open_datatree(path, **kwargs) as xdt:
+        return xdt.load()
+
+
+@pytest.mark.parametrize(
+    "output_encoding",
+    [
+        None,
+        OutputEncoding(),
+        OutputEncoding(zlib=True, predictions_dtype="float32", chunks={"burst": 4}),
+    ],
+)
+def test_write_netcdf(tmp_path, config, l2_product, output_encoding):
+    savepath = str(tmp_path / "product.nc")
+    assert (
+        utils.write_product(l2_product, savepath, config[2], output_encoding)
+        == savepath
+    )
+    product = read(savepath)
+    xr.testing.assert_allclose(product, l2_product)
+    if output_encoding is not None and output_encoding.zlib:
+        hs = product["intraburst"]["hs_most_likely"]
+        assert hs.encoding["zlib"]
+        assert hs.encoding["chunksizes"][0] == 4
+        assert hs.dtype == np.float32
+
+
+def test_write_packed(tmp_path, config, l2_product):
+    savepath = str(tmp_path / "product.nc")
+    utils.write_product(
+        l2_product, savepath, config[2], OutputEncoding(predictions_dtype="int16")
+    )
+    raw = read(savepath, decode_cf=False)
+    product = read(savepath)
+    for group in ["intraburst", "interburst"]:
+        for v in config[2][group]:
+            assert raw[group][v].dtype == np.int16
+            expected = l2_product[group][v].values
+            np.testing.assert_array_equal(
+                np.isnan(product[group][v].values), np.isnan(expected)
+            )
+            np.testing.assert_allclose(
+                product[group][v].values,
+                expected,
+                atol=raw[group][v].attrs["scale_factor"]
+                + 1e-6 * np.nanmax(np.abs(expected)),
+            )
+
+
+def test_write_zarr(tmp_path, config, l2_product):
+    pytest.importorskip("zarr")
+    savepath = utils.write_product(
+        l2_product,
+        str(tmp_path / "product.nc"),
+        config[2],
+        OutputEncoding(format="zarr"),
+    )
+    assert savepath == str(tmp_path / "product.zarr")
+    assert os.path.isdir(savepath)
+    xr.testing.assert_allclose(read(savepath, engine="zarr"), l2_product)
+
+
+@pytest.mark.parametrize(
+    "output_encoding",
+    [OutputEncoding(format="grib"), OutputEncoding(predictions_dtype="int8")],
+)
+def test_invalid_output_encoding(tmp_path, config, l2_product, output_encoding):
+    with pytest.raises(ValueError):
+        utils.write_product(
+            l2_product, str(tmp_path / "product.nc"), config[2], output_encoding
+        )
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        np.linspace(0, 15, 1000),
+        -1 + np.linspace(0, 1e-5, 1000),
+        np.full(10, 3.0),
+        np.full(10, np.nan),
+    ],
+)
+def test_packing_round_trip(tmp_path, values):
+    values = values.astype(np.float32)
+    values[::7] = np.nan
+    packing = utils.get_packing(values)
+    path = str(tmp_path / "packed.nc")
+    xr.Dataset({"v": ("x", values)}).to_netcdf(path, encoding={"v": packing})
+    with xr.open_dataset(path) as ds:
+        np.testing.assert_array_equal(np.isnan(ds["v"].values), np.isnan(values))
+        np.testing.assert_allclose(ds["v"].values, values, atol=packing["scale_factor"])
@@ -0,0 +1,32 @@
+import pytest
+
+from sarwaveifrproc.utils import get_safe_weight, partition, partition_listing
+
+
+@pytest.mark.parametrize("n_items", [0, 1, 9, 10, 11, 101])
+@pytest.mark.parametrize("n", [1, 3, 10])
+def test_partition_covers_every_item_once(n_items, n):
+    weights = [(7 * k) % 13 + 1 for k in range(n_items)]
+    chunks = partition(weights, n)
+    assert len(chunks) == n
+    assert sorted(k for c in chunks for k in c) == list(range(n_items))
+
+
+def test_partition_is_balanced():
+    weights = [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+    loads = [sum(weights[k] for k in c) for c in partition(weights, 3)]
+    assert max(loads) - min(loads) <= max(weights) / 2
+    assert max(loads) <= sum(weights) / 3 + min(weights)
+
+
+def test_partition_listing(input_safe, tmp_path):
+    empty_safe = tmp_path / "empty.SAFE"
+    empty_safe.mkdir()
+    files = [str(empty_safe), input_safe]
+    assert get_safe_weight(input_safe, "tiles") == 3 * (45 + 40)
+    assert get_safe_weight(str(empty_safe), "bytes") == 0
+    for weight in ["bytes", "tiles", "count"]:
+        chunks = partition_listing(files, 2, weight)
+        assert sorted(f for c in chunks for f in c) == sorted(files)
+    with pytest.raises(ValueError):
+        get_safe_weight(input_safe, "unknown")
@@ -0,0 +1,105 @@
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import utils
+from sarwaveifrproc.l2_wave import (
+    LAND_VARIABLES,
+    generate_l2_wave_product,
+    generate_l2_wave_products,
+)
+from tests.conftest import SAFE, SUBSWATH, get_xdt
+from tests.test_process_files import read_products
+
+
+def get_dual_pol_xdt(land=None, land_pols=True):
+    """
+    A VV+VH DataTree, whose VH tiles have a lower sigma0. Without `land_pols`, the land flags, corners and
+    incidence have no pol dimension, as in the L1B products.
+    """
+    xdt = get_xdt(land)
+    groups = {}
+    for group in ["intraburst", "interburst"]:
+        ds = xdt[group].ds
+        vh = ds.assign_coords(pol=["VH"])
+        vh["sigma0_filt"] = vh["sigma0_filt"] * 0.1
+        groups[group] = xr.concat([ds, vh], dim="pol")
+        if not land_pols:
+            groups[group] = groups[group].assign(
+                {v: ds[v].isel(pol=0, drop=True) for v in LAND_VARIABLES}
+            )
+    dual_pol = xr.DataTree.from_dict(groups)
+    dual_pol.encoding = xdt.encoding
+    return dual_pol
+
+
+@pytest.mark.parametrize("land", [None, True])
+@pytest.mark.parametrize("mask_invalid_tiles", [False, True])
+def test_predicted_pols(config, land, mask_invalid_tiles):
+    models, models_outputs, predicted_variables = config
+    xdt = get_dual_pol_xdt(land)
+    args = (xdt, models, models_outputs, predicted_variables, mask_invalid_tiles)
+    actual = generate_l2_wave_product(*args, pol=["VV", "VH"])
+    xr.testing.assert_identical(
+        generate_l2_wave_product(*args, engine="numpy", pol=["VV", "VH"]), actual
+    )
+    batched = generate_l2_wave_products(
+        [xdt],
+        models,
+        models_outputs,
+        predicted_variables,
+        7,
+        mask_invalid_tiles,
+        pol=["VV", "VH"],
+    )
+    xr.testing.assert_identical(batched[0], actual)
+    for pol in ["VV", "VH"]:
+        expected = generate_l2_wave_product(*args, pol=pol)
+        for group in ["intraburst", "interburst"]:
+            for v in getattr(predicted_variables, group):
+                da = actual[group][v]
+                assert da.dims[0] == "pol"
+                e = expected[group][v]
+                if (
+                    "pol" in e.dims
+                ):  # land products keep the polarisations of the land flags
+                    e = e.sel(pol=pol)
+                xr.testing.assert_equal(
+                    da.sel(pol=pol, drop=True), e.drop_vars("pol", errors="ignore")
+                )
+
+
+@pytest.mark.parametrize("land", [None, True])
+def test_land_variables_without_pol(config, land):
+    models, models_outputs, predicted_variables = config
+    expected, actual = [
+        generate_l2_wave_product(
+            get_dual_pol_xdt(land, land_pols),
+            models,
+            models_outputs,
+            predicted_variables,
+            pol=["VV", "VH"],
+        )
+        for land_pols in [True, False]
+    ]
+    for group in ["intraburst", "interburst"]:
+        assert "pol" not in actual[group]["land_flag"].dims
+        for v in getattr(predicted_variables, group):
+            assert list(actual[group][v]["pol"].values) == ["VV", "VH"]
+            xr.testing.assert_equal(actual[group][v], expected[group][v])
+
+
+def test_process_files_predicted_pols(tmp_path, config):
+    safe = tmp_path / "input" / SAFE
+    safe.mkdir(parents=True)
+    get_dual_pol_xdt().to_netcdf(safe / SUBSWATH.format(swath="iw1"))
+    expected, actual = str(tmp_path / "expected"), str(tmp_path / "actual")
+    product_kwargs = dict(pol=["VV", "VH"])
+    utils.process_files(str(safe), expected, *config, "E11", product_kwargs)
+    utils.process_files(
+        str(safe), actual, *config, "E11", product_kwargs, block_size_mb=0.05
+    )
+    expected, actual = read_products(expected), read_products(actual)
+    assert len(expected) == 1
+    for name in expected:
+        assert expected[name]["intraburst"]["hs_most_likely"].sizes["pol"] == 2
+        xr.testing.assert_identical(actual[name], expected[name])
@@ -0,0 +1,61 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import utils
+
+
+def read_products(directory):
+    products = {}
+    for f in sorted(glob.glob(os.path.join(directory, "*.nc"))):
+        with xr.open_datatree(f) as xdt:
+            products[os.path.basename(f)] = xdt.load()
+    return products
+
+
+def assert_same_products(expected_dir, actual_dir):
+    expected, actual = read_products(expected_dir), read_products(actual_dir)
+    assert expected.keys() == actual.keys()
+    for name in expected:
+        for group in ["intraburst", "interburst"]:
+            e, a = expected[name][group].ds, actual[name][group].ds
+            assert set(e.data_vars) == set(a.data_vars)
+            for v in e.data_vars:
+                np.testing.assert_allclose(a[v].values, e[v].values, equal_nan=True)
+
+
+def test_process_files(input_safe, tmp_path, config):
+    output_safe = str(tmp_path / "output")
+    utils.process_files(input_safe, output_safe, *config, "E11")
+    products = read_products(output_safe)
+    assert len(products) == 3
+    for xdt in products.values():
+        assert np.isfinite(xdt["intraburst"]["hs_most_likely"]).any() or bool(
+            xdt["intraburst"]["land_flag"].all()
+        )
+
+
+@pytest.mark.parametrize("prefetch", [1, 2])
+def test_process_files_pipelined(input_safe, tmp_path, config, prefetch):
+    expected, actual = str(tmp_path / "expected"), str(tmp_path / "actual")
+    utils.process_files(input_safe, expected, *config, "E11")
+    utils.process_files_pipelined(
+        [input_safe], [actual], *config, "E11", prefetch=prefetch
+    )
+    assert_same_products(expected, actual)
+
+
+def test_process_files_pipelined_error(input_safe, tmp_path, config):
+    models, models_outputs, predicted_variables = config
+    with pytest.raises(KeyError):
+        utils.process_files_pipelined(
+            [input_safe],
+            [str(tmp_path / "output")],
+            models,
+            {},
+            predicted_variables,
+            "E11",
+        )
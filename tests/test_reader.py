@@ -0,0 +1,93 @@
+import glob
+import os
+
+import pytest
+import xarray as xr
+
+from sarwaveifrproc import utils
+from sarwaveifrproc.l2_wave import (
+    KEPT_VARIABLES,
+    LAND_VARIABLES,
+    generate_l2_wave_product,
+    get_land_template,
+)
+from tests.conftest import get_xdt
+
+
+def test_selective_reader(input_safe):
+    for path in glob.glob(os.path.join(input_safe, "*.nc")):
+        expected = utils.load_subswath(path)
+        actual = utils.load_subswath(path, reader="selective")
+        xr.testing.assert_identical(actual, expected)
+        assert actual.encoding["source"] == path
+
+
+def test_unneeded_variables(input_safe):
+    path = glob.glob(os.path.join(input_safe, "*.nc"))[0]
+    drop_variables = utils.get_unneeded_variables(path, KEPT_VARIABLES)
+    for group in ["intraburst", "interburst"]:
+        assert drop_variables[group]
+        assert not set(drop_variables[group]) & set(
+            KEPT_VARIABLES + ["pol", "burst", "longitude", "latitude"]
+        )
+        groups = utils.open_subswath(path, reader="selective")
+        assert set(groups) == {"/intraburst", "/interburst"}
+        assert not set(drop_variables[group]) & set(groups[f"/{group}"].variables)
+        for ds in groups.values():
+            ds.close()
+
+
+def test_read_pols(tmp_path):
+    xdt = get_xdt()
+    path = str(tmp_path / "dual_pol.nc")
+    xr.DataTree.from_dict(
+        {
+            g: xr.concat([xdt[g].ds, xdt[g].ds.assign_coords(pol=["VH"])], dim="pol")
+            for g in ["intraburst", "interburst"]
+        }
+    ).to_netcdf(path)
+    expected = utils.load_subswath(path)
+    assert expected["intraburst"].sizes["pol"] == 2
+    for reader in ["full", "selective"]:
+        actual = utils.load_subswath(path, reader=reader, pols=["VV"])
+        xr.testing.assert_identical(actual, expected.sel(pol=["VV"]))
+
+
+def test_unknown_reader(input_safe):
+    path = glob.glob(os.path.join(input_safe, "*.nc"))[0]
+    with pytest.raises(ValueError, match="reader"):
+        utils.open_subswath(path, reader="partial")
+
+
+def test_land_reader_kwargs(input_safe):
+    paths = sorted(glob.glob(os.path.join(input_safe, "*.nc")))
+    assert [utils.is_land_subswath(p) for p in paths] == [False, False, True]
+    assert utils.get_land_reader_kwargs(paths[0], dict(pols=["VV"])) == dict(
+        pols=["VV"]
+    )
+    reader_kwargs = utils.get_land_reader_kwargs(paths[2], dict(pols=["VV"]))
+    assert reader_kwargs == dict(
+        pols=["VV"], reader="selective", variables=LAND_VARIABLES
+    )
+    xdt = utils.load_subswath(paths[2], **reader_kwargs)
+    assert set(xdt["intraburst"].data_vars) == set(LAND_VARIABLES)
+
+
+def test_land_template(config):
+    models, models_outputs, predicted_variables = config
+    get_land_template.cache_clear()
+    xdt = get_xdt(land=True)
+    expected = generate_l2_wave_product(
+        xdt, models, models_outputs, predicted_variables
+    )
+    land_only = xr.DataTree.from_dict(
+        {g: xdt[g].ds[LAND_VARIABLES] for g in ["intraburst", "interburst"]}
+    )
+    land_only.encoding = xdt.encoding
+    actual = generate_l2_wave_product(
+        land_only, models, models_outputs, predicted_variables
+    )
+    xr.testing.assert_identical(actual, expected)
+    # one template per tile shape, reused by the second product
+    info = get_land_template.cache_info()
+    assert (info.currsize, info.hits) == (2, 2)
@@ -0,0 +1,155 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+import xarray as xr
+from omegaconf import OmegaConf
+
+from sarwaveifrproc import server
+from sarwaveifrproc.l2_wave import generate_l2_wave_product
+from sarwaveifrproc.main import Model
+from tests.conftest import get_xdt, root
+
+
+@pytest.fixture
+def models():
+    conf = OmegaConf.load(os.path.join(root, "sarwave_config", "e11.yaml"))
+    return {
+        k: Model(os.path.join(root, d.path), list(d.outputs))
+        for k, d in conf.models.items()
+    }
+
+
+@pytest.fixture
+def inference_server(tmp_path):
+    """
+    An inference server process of the e11 models, yielding its socket path and a function stopping it, which
+    returns its log.
+    """
+    socket_path = str(tmp_path / "inference.sock")
+    log_path = tmp_path / "server.log"
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from sarwaveifrproc.main import hydra_main; hydra_main()",
+                f"hydra.run.dir={tmp_path / 'hydra'}",
+                "input_path=none",
+                "save_directory=none",
+                f"inference_server={socket_path}",
+                "serve_models=true",
+                "inference_batch_window=0.2",
+                "verbose=true",
+            ],
+            cwd=root,
+            stderr=log,
+        )
+    while not os.path.exists(socket_path):
+        assert process.poll() is None, log_path.read_text()
+        time.sleep(0.01)
+
+    def stop_server():
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=60) == 0
+        assert not os.path.exists(socket_path)
+        return log_path.read_text()
+
+    yield socket_path, stop_server
+    if process.poll() is None:
+        stop_server()
+
+
+def test_remote_sessions(config, models, inference_server):
+    ort_mods, mod_outs, predicted_variables = config
+    remote, remote_outs = server.load_sessions(models, inference_server[0])
+    assert remote["multi"] is not remote["multi_interburst"]
+    assert remote_outs == mod_outs
+    for xdt in [get_xdt(), get_xdt(land=False)]:
+        expected = generate_l2_wave_product(
+            xdt, ort_mods, mod_outs, predicted_variables
+        )
+        actual = generate_l2_wave_product(xdt, remote, mod_outs, predicted_variables)
+        xr.testing.assert_identical(actual, expected)
+
+
+def test_batching(config, models, inference_server):
+    socket_path, stop_server = inference_server
+    X = np.random.default_rng(0).random((10, 24), dtype=np.float32)
+    expected = config[0]["multi"].run(None, {"input": X})
+    results = {}
+
+    def run(i):
+        remote, _ = server.connect(socket_path, models)
+        results[i] = remote["multi"].run(None, {"input": X[: 4 + i]})
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i, res in results.items():
+        for r, e in zip(res, expected):
+            np.testing.assert_allclose(r, e[: 4 + i], rtol=1e-6)
+    # the requests of the three clients arrived within the batch window
+    assert "multi: 15 tiles of 3 request(s)" in stop_server()
+
+
+def test_errors(models, inference_server):
+    socket_path, _ = inference_server
+    remote, _ = server.connect(socket_path, models)
+    with pytest.raises(RuntimeError, match="inference server failed"):
+        remote["multi"].run(None, {"input": np.zeros((2, 3), np.float32)})
+
+    other = dict(models, multi=Model(models["multi_interburst"].path, ["hs"]))
+    with pytest.raises(ValueError, match="does not hold the model multi"):
+        server.connect(socket_path, other)
+
+
+CLIENT = """
+import sys
+import numpy as np
+from sarwaveifrproc import server
+client = server.InferenceClient(sys.argv[1])
+info = client.info["multi"]
+try:
+    client.run(info["session"], np.zeros((2, 24), np.float32), info["outputs"])
+except RuntimeError as e:
+    print(e)
+"""
+
+
+def test_stopped_with_pending_requests(config, tmp_path):
+    ort_mods, mod_outs, _ = config
+    socket_path = str(tmp_path / "inference.sock")
+    inference_server = server.InferenceServer(ort_mods, mod_outs, socket_path)
+    # batches stopped before the requests are run
+    inference_server.run_batches = lambda stop: None
+    stop = threading.Event()
+    serving = threading.Thread(target=inference_server.serve, args=(stop,))
+    serving.start()
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+    client = subprocess.Popen(
+        [sys.executable, "-c", CLIENT, socket_path],
+        cwd=root,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        while inference_server.requests.empty():
+            assert client.poll() is None
+            time.sleep(0.01)
+        stop.set()
+        serving.join(timeout=10)
+        # the client gets an error instead of waiting forever
+        out, _ = client.communicate(timeout=30)
+    finally:
+        stop.set()
+        client.kill()
+    assert "The inference server was stopped." in out
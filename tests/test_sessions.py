@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from sarwaveifrproc.l2_wave import run_models
+from sarwaveifrproc.main import Model
+from sarwaveifrproc.sessions import FusedSession, create_session, create_sessions
+from tests.conftest import root
+
+
+def get_model(**options):
+    return Model(
+        path=os.path.join(root, "models", "multi.onnx"),
+        outputs=[
+            "pred_hs",
+            "pred_phs0",
+            "pred_t0m1",
+            "conf_hs",
+            "conf_phs0",
+            "conf_t0m1",
+        ],
+        **options,
+    )
+
+
+def run(session):
+    X = np.linspace(0, 1, 10 * 24, dtype=np.float32).reshape(10, 24)
+    return session.run(None, {session.get_inputs()[0].name: X})
+
+
+def test_optimized_model_cache(tmp_path):
+    model = get_model(intra_op_num_threads=1, execution_mode="parallel")
+    expected = run(create_session(model))
+    first = create_session(model, str(tmp_path))
+    cached = os.listdir(tmp_path)
+    assert len(cached) == 1 and cached[0].startswith("multi-")
+    second = create_session(model, str(tmp_path))
+    assert os.listdir(tmp_path) == cached
+    for session in [first, second]:
+        for e, a in zip(expected, run(session)):
+            np.testing.assert_allclose(a, e, rtol=1e-5)
+
+    # the cached graphs are optimized up to the extended level, independent of the hardware
+    create_session(get_model(graph_optimization_level="extended"), str(tmp_path))
+    assert os.listdir(tmp_path) == cached
+    create_session(get_model(graph_optimization_level="basic"), str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_invalid_session_option():
+    with pytest.raises(ValueError):
+        create_session(get_model(execution_mode="unknown"))
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_fused_models(tmp_path, cache):
+    pytest.importorskip("onnx")
+    models = {
+        k: Model(
+            path=os.path.join(root, "models", f"{k}.onnx"), outputs=["pred", "conf"]
+        )
+        for k in ["hs", "t0m1", "phs0"]
+    }
+    cache_dir = str(tmp_path) if cache else None
+    sessions, _ = create_sessions(models, cache_dir)
+    fused, _ = create_sessions(models, cache_dir, fused_groups=[["hs", "phs0"]])
+    assert isinstance(fused["hs"], FusedSession) and fused["hs"] is fused["phs0"]
+    assert not isinstance(fused["t0m1"], FusedSession)
+
+    X = np.linspace(0, 1, 10 * 24, dtype=np.float32).reshape(10, 24)
+    expected, actual = run_models(X, sessions), run_models(X, fused)
+    assert list(actual) == list(models)
+    for k in models:
+        for e, a in zip(expected[k], actual[k]):
+            np.testing.assert_allclose(a, e, rtol=1e-5)
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import hydra
+import hydra_zen
+
+from sarwaveifrproc import main, sessions
+from tests.conftest import root
+
+
+def test_import_is_light():
+    code = (
+        "import sys, sarwaveifrproc.main, sarwave_config; "
+        "print(sorted({'onnxruntime', 'scipy'} & set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def run_main(monkeypatch, *overrides):
+    monkeypatch.chdir(root)
+    with hydra.initialize_config_module("sarwave_config", version_base="1.3"):
+        cfg = hydra.compose("e11", overrides=list(overrides))
+    return hydra_zen.zen(main.main)(cfg)
+
+
+def test_no_models_loaded(input_safe, tmp_path, monkeypatch):
+    overrides = [f"input_path={input_safe}", f"save_directory={tmp_path / 'output'}"]
+    summary = run_main(monkeypatch, *overrides, "overwrite=false")
+    assert summary == dict(safes=1, processed=1, failures={})
+
+    def create_sessions(*args, **kwargs):
+        raise AssertionError("The models should not be loaded.")
+
+    monkeypatch.setattr(sessions, "create_sessions", create_sessions)
+    # nothing left to process
+    summary = run_main(monkeypatch, *overrides, "overwrite=false")
+    assert summary == dict(safes=1, processed=0, failures={})
+    summary = run_main(monkeypatch, *overrides, "dry_run=true")
+    assert summary["processed"] == 0
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import onnxruntime
+import pytest
+
+from sarwaveifrproc import variants
+from tests.conftest import root
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    """A copy of the models, whose relative paths are resolved like the configurations."""
+    shutil.copytree(os.path.join(root, "models"), tmp_path / "models")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / "models"
+
+
+def test_variant_path():
+    assert variants.get_variant_path("models/multi.onnx") == "models/multi.onnx"
+    assert (
+        variants.get_variant_path("models/multi.onnx", "int8")
+        == "models/multi.int8.onnx"
+    )
+    with pytest.raises(ValueError):
+        variants.get_variant_path("models/multi.onnx", "int4")
+    with pytest.raises(FileNotFoundError):
+        variants.resolve_variant(os.path.join(root, "models", "multi.onnx"), "fp16")
+
+
+@pytest.mark.parametrize("variant", variants.VARIANTS)
+def test_convert_model(tmp_path, variant):
+    path = os.path.join(root, "models", "multi.onnx")
+    variant_path = str(tmp_path / f"multi.{variant}.onnx")
+    X = np.random.default_rng(0).normal(size=(64, 24)).astype(np.float32)
+    variants.convert_model(path, variant_path, variant, X)
+    session = onnxruntime.InferenceSession(variant_path)
+    pred, conf = session.run(None, {"input": X})
+    assert pred.shape == conf.shape == (64, 3)
+    assert pred.dtype == np.float32
+
+
+@pytest.mark.parametrize("tolerance, passed", [(100.0, True), (0.0, False)])
+def test_accuracy_gate(input_safe, models_dir, tolerance, passed):
+    reports = variants.prepare_models(
+        input_safe,
+        models=["multi"],
+        variants=["int8"],
+        tolerances={"hs_most_likely": tolerance},
+    )
+    report = reports["models/multi.int8.onnx"]
+    assert report["passed"] == passed
+    assert report["validation_tiles"] > 0
+    assert set(report["variables"]) == {
+        "hs_most_likely",
+        "hs_conf",
+        "phs0_most_likely",
+        "phs0_conf",
+        "t0m1_most_likely",
+        "t0m1_conf",
+    }
+    assert (models_dir / "multi.int8.onnx").exists() == passed
+    with open(models_dir / "multi.int8.json") as f:
+        assert json.load(f) == report